@@ -36,7 +36,7 @@ subgroups ={'cumulative': '1: Cumulative Completeness',
             'colors': '5: Colors'}
 
 
-def setupSlicer(orbitFile, Hrange, obsFile=None):
+def setupSlicer(orbitFile, Hrange, obsFile=None, chunkSize=None, cache=False):
     """
     Set up the slicer and read orbitFile and obsFile from disk.
 
@@ -49,6 +49,12 @@ def setupSlicer(orbitFile, Hrange, obsFile=None):
     obsFile : str, optional
         The file containing the observations of each object, optional.
         If not provided (default, None), then the slicer will not be able to 'slice', but can still plot.
+    chunkSize : int, optional
+        If provided, stream the observations from obsFile in chunks of chunkSize objects,
+        rather than reading all of them into memory. Default None.
+    cache : bool, optional
+        If True, read (or create) binary columnar copies of orbitFile and obsFile, which are much faster
+        to read than the text files. Default False.
 
     Returns
     -------
@@ -56,13 +62,13 @@ def setupSlicer(orbitFile, Hrange, obsFile=None):
     """
     # Read the orbit file and set the H values for the slicer.
     slicer = slicers.MoObjSlicer()
-    slicer.readOrbits(orbitFile, Hrange=Hrange)
+    slicer.readOrbits(orbitFile, Hrange=Hrange, cache=cache)
     if obsFile is not None:
-        slicer.readObs(obsFile)
+        slicer.readObs(obsFile, chunkSize=chunkSize, cache=cache)
     return slicer
 
 
-def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None):
+def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None, randomSeed=None):
     """
     Set up the standard metrics to analyze each opsim run.
 
@@ -80,6 +86,8 @@ def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None):
         Albedo to specify for the plotting dictionary. Default None (and so no 'size' marked on plots).
     Hmark : float, optional
         Hmark to specify for the plotting dictionary. Default None.
+    randomSeed : int, optional
+        Seed for the per-object random streams of the MoMagStackers. Default None (global random state).
 
     Returns
     -------
@@ -100,8 +108,8 @@ def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None):
     plotFuncs = [plots.MetricVsH()]
 
     # Add different mag/vis stacker.
-    stackerDet = stackers.MoMagStacker(lossCol='dmagDetect')
-    stackerTrail = stackers.MoMagStacker(lossCol='dmagTrail')
+    stackerDet = stackers.MoMagStacker(lossCol='dmagDetect', randomSeed=randomSeed)
+    stackerTrail = stackers.MoMagStacker(lossCol='dmagTrail', randomSeed=randomSeed)
 
     # Little subroutine to configure child discovery metrics in each year.
     def _setup_child_metrics(parentMetric):
@@ -654,7 +662,7 @@ def setupMetrics(slicer, runName, metadata, mParams, albedo=None, Hmark=None):
     return allBundles
 
 
-def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None):
+def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None, nProcesses=1):
     """
     Run metrics, write basic output in OutDir.
 
@@ -668,6 +676,8 @@ def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None):
         The results database to use to track metrics and summary statistics.
     Hmark : float, optional
         The Hmark value to add to the completeness bundles plotDicts.
+    nProcesses : int, optional
+        The number of processes to use to calculate the metrics. Default 1.
 
     Returns
     -------
@@ -690,7 +700,7 @@ def runMetrics(allBundles, outDir, resultsDb=None, Hmark=None):
     print("Counted %d top-level metric bundles." % count)
 
     print("Calculating and saving metric values.")
-    bg = mmb.MoMetricBundleGroup(bundleDict, outDir=outDir, resultsDb=resultsDb)
+    bg = mmb.MoMetricBundleGroup(bundleDict, outDir=outDir, resultsDb=resultsDb, nProcesses=nProcesses)
     # Just calculate here, we'll create the (mostly custom) plots later.
     bg.runAll()
     print("Generating completeness bundles.")
@@ -722,43 +732,22 @@ def addAllCompletenessBundles(allBundles, Hmark, outDir, resultsDb):
         and "CumulativeCompleteness", which contain bundles of completeness metrics at each year.
     """
     # Add completeness bundles and write completeness at Hmark to resultsDb.
-    allBundles['DifferentialCompleteness'] = {}
-    allBundles['CumulativeCompleteness'] = {}
     subgroups['completenessVal'] = '3: Completeness @ H=%.1f' % (Hmark)
+    # Gather all of the bundles with discovery chances, so their completeness can be calculated together.
+    chanceBundles = {}
     k = 'discovery'
     if k in allBundles:
         for md in allBundles[k]:
             for submd in allBundles[k][md].childBundles:
-                if submd.startswith('Time') or submd.startswith['N_Chances']:
-                    b = allBundles[k][md].childBundles[submd]
-                    compmd = ' '.join([md, submd.lstrip("Time")]).replace('_', ' ')
+                if submd.startswith('N_Chances'):
                     compmd = ' '.join([md, submd.lstrip("N_Chances")]).replace('_', ' ')
-                    allBundles['DifferentialCompleteness'][compmd] = \
-                        mmb.makeCompletenessBundle(b, summaryName='DifferentialCompleteness', Hmark=Hmark,
-                                                   resultsDb=resultsDb)
-                    allBundles['CumulativeCompleteness'][compmd] = \
-                        mmb.makeCompletenessBundle(b, summaryName='CumulativeCompleteness', Hmark=Hmark,
-                                                   resultsDb=resultsDb)
-    k = 'velocity'
-    if k in allBundles:
-        for md in allBundles[k]:
-            b = allBundles[k][md]
-            allBundles['DifferentialCompleteness'][md] = \
-                mmb.makeCompletenessBundle(b, summaryName='DifferentialCompleteness',
-                                           Hmark=Hmark, resultsDb=resultsDb)
-            allBundles['CumulativeCompleteness'][md] = \
-                mmb.makeCompletenessBundle(b, summaryName='CumulativeCompleteness',
-                                           Hmark=Hmark, resultsDb=resultsDb)
-    k = 'magic'
-    if k in allBundles:
-        for md in allBundles[k]:
-            b = allBundles[k][md]
-            allBundles['DifferentialCompleteness'][md] = \
-                mmb.makeCompletenessBundle(b, summaryName='DifferentialCompleteness',
-                                           Hmark=Hmark, resultsDb=resultsDb)
-            allBundles['CumulativeCompleteness'][md] = \
-                mmb.makeCompletenessBundle(b, summaryName='CumulativeCompleteness',
-                                           Hmark=Hmark, resultsDb=resultsDb)
+                    chanceBundles[compmd] = allBundles[k][md].childBundles[submd]
+    for k in ['velocity', 'magic']:
+        if k in allBundles:
+            for md in allBundles[k]:
+                chanceBundles[md] = allBundles[k][md]
+    allBundles['DifferentialCompleteness'], allBundles['CumulativeCompleteness'] = \
+        mmb.makeCompletenessBundles(chanceBundles, Hmark=Hmark, resultsDb=resultsDb)
 
     # Write the completeness bundles to disk, so we can re-read them later.
     for md in allBundles['DifferentialCompleteness']:
@@ -1487,6 +1476,17 @@ if __name__ == '__main__':
                              "Default 10.")
     parser.add_argument("--plotOnly", action='store_true', default=False,
                         help="Reload metric values from disk and replot them.")
+    parser.add_argument("--chunkSize", type=int, default=None,
+                        help="Read the observations from obsFile in chunks of this many objects,"
+                             " instead of all at once. Default None (read all at once).")
+    parser.add_argument("--cache", action='store_true', default=False,
+                        help="Cache binary copies of the orbitFile and obsFile next to them,"
+                             " and use these (if up to date) instead of parsing the text files.")
+    parser.add_argument("--nProcesses", type=int, default=1,
+                        help="Number of processes to use to calculate the metrics. Default 1.")
+    parser.add_argument("--randomSeed", type=int, default=None,
+                        help="Seed for the random visibility of each observation. If set, the results are"
+                             " reproducible (for any nProcesses). Default None.")
     args = parser.parse_args()
 
     if args.orbitFile is None:
@@ -1522,10 +1522,12 @@ if __name__ == '__main__':
         resultsDb = db.ResultsDb(outDir=args.outDir)
 
         Hrange = np.arange(args.hMin, args.hMax + args.hStep, args.hStep)
-        slicer = setupSlicer(args.orbitFile, Hrange, obsFile=args.obsFile)
+        slicer = setupSlicer(args.orbitFile, Hrange, obsFile=args.obsFile, chunkSize=args.chunkSize,
+                             cache=args.cache)
         allBundles = setupMetrics(slicer, runName=args.opsimRun, metadata=args.metadata,
-                                  albedo=args.albedo, Hmark=args.hMark, mParams=mParams)
-        allBundles = runMetrics(allBundles, args.outDir, resultsDb, args.hMark)
+                                  albedo=args.albedo, Hmark=args.hMark, mParams=mParams,
+                                  randomSeed=args.randomSeed)
+        allBundles = runMetrics(allBundles, args.outDir, resultsDb, args.hMark, nProcesses=args.nProcesses)
 
     plotMetrics(allBundles, args.outDir, args.metadata, args.opsimRun, mParams,
                 Hmark=args.hMark, resultsDb=resultsDb)
@@ -5,13 +5,40 @@ import os
 import healpy as hp
 from lsst.sims.maf.utils import radec2pix
 
-__all__ = ['StellarDensityMap']
+__all__ = ['StellarDensityMap', 'crowdingIntegral']
+
+
+def crowdingIntegral(magVector, lumFunc):
+    """Calculate the seeing-independent part of the crowding error (Olsen, Blum, & Rigaut 2003).
+
+    The crowding error at each magnitude is sqrt(pi / area) * seeing / 2 times this value,
+    so it can be calculated once for each luminosity function and scaled by the seeing later.
+
+    Parameters
+    ----------
+    magVector : np.array
+        Stellar magnitudes.
+    lumFunc : np.array
+        Stellar luminosity function. May be 2-d (one luminosity function per row), in which case
+        the integral is calculated for each row.
+
+    Returns
+    -------
+    np.array
+        sqrt(cumulative integral of lum**2 * lumFunc, from the faint end) / lum, the same shape as lumFunc.
+    """
+    lumVector = 10**(-0.4 * magVector)
+    integral = np.add.accumulate((lumVector**2 * lumFunc)[..., ::-1], axis=-1)[..., ::-1]
+    return np.sqrt(integral) / lumVector
 
 
 class StellarDensityMap(BaseMap):
     """
     Return the cumulative stellar luminosity function for each slicepoint. Units of stars per sq degree.
     Uses a healpix map of nside=64. Uses the nearest healpix point for other ra,dec values.
+
+    Also adds 'starCrowdTerm', the seeing-independent part of the crowding error at each magnitude
+    (see crowdingIntegral), which is calculated once for the whole map rather than at each slicepoint.
     """
     def __init__(self, startype='allstars', filtername='r', nside=64):
         """
@@ -43,6 +70,7 @@ class StellarDensityMap(BaseMap):
         self.starMap = starMap['starDensity'].copy()
         self.starMapBins = starMap['bins'].copy()
         self.starmapNside = hp.npix2nside(np.size(self.starMap[:, 0]))
+        self.starCrowdTerm = crowdingIntegral(self.starMapBins[1:], self.starMap)
 
     def run(self, slicePoints):
         self._readMap()
@@ -51,11 +79,13 @@ class StellarDensityMap(BaseMap):
         if 'nside' in slicePoints:
             if slicePoints['nside'] == self.starmapNside:
                 slicePoints['starLumFunc'] = self.starMap
+                slicePoints['starCrowdTerm'] = self.starCrowdTerm
                 nsideMatch = True
         if not nsideMatch:
             # Compute the healpix for each slicepoint on the nside=64 grid
             indx = radec2pix(self.starmapNside, slicePoints['ra'], slicePoints['dec'])
             slicePoints['starLumFunc'] = self.starMap[indx, :]
+            slicePoints['starCrowdTerm'] = self.starCrowdTerm[indx, :]
 
         slicePoints['starMapBins'] = self.starMapBins
         return slicePoints
@@ -13,6 +13,8 @@ import lsst.sims.maf.db as db
 import lsst.sims.maf.utils as utils
 from lsst.sims.maf.plots import PlotHandler
 import lsst.sims.maf.maps as maps
+from lsst.sims.maf.metrics import SliceContext
+from lsst.sims.maf.stackers import StackerEngine
 from .metricBundle import MetricBundle, createEmptyMetricBundle
 import warnings
 
@@ -35,6 +37,21 @@ def makeBundlesDictFromList(bundleList):
     return bDict
 
 
+def _hasRunMany(metric):
+    """Return True if metric has a runMany method matching its run method.
+
+    A subclass which overrides run (but not runMany) is still run at each slicePoint.
+    """
+    if not hasattr(metric, 'runMany'):
+        return False
+    for cls in type(metric).__mro__:
+        if 'runMany' in cls.__dict__:
+            return True
+        if 'run' in cls.__dict__:
+            return False
+    return False
+
+
 class MetricBundleGroup(object):
     """The MetricBundleGroup exists to calculate the metric values for a group of
     MetricBundles.
@@ -51,6 +68,11 @@ class MetricBundleGroup(object):
     The MetricBundleGroup also determines how to efficiently group the MetricBundles
     to reduce the number of sql queries of the database, grabbing larger chunks of data at once.
 
+    Metrics with a runMany method (such as the PhaseGapMetric and FftMetric) are calculated for
+    batches of runManyBatchSize slicePoints at once, rather than at each slicePoint; runMany groups
+    the dataSlices with the same number of visits (see utils.stackSlices). These metrics are not
+    passed the slicePoint, and their dataSlices only contain the metric's own columns (colNameArr).
+
     Parameters
     ----------
     bundleDict : dict[MetricBundle]
@@ -78,9 +100,30 @@ class MetricBundleGroup(object):
         If False, metric values will only be saved after summary statistics are calculated.
     dbTable : Optional[str]
         The name of the table in the dbObj to query for data.
+    presortCol : Optional[str]
+        If set (typically to 'expMJD'), simData is sorted on this column once, before running stackers
+        and slicers. The slicers return the indexes of each slice in increasing order, so each dataSlice
+        is then also sorted on presortCol, and metrics with requiresSorted == presortCol (such as the
+        cadence and vector metrics) only check the order of their data at each slicePoint, rather than
+        sorting it. A warning is issued for metrics with requiresSorted set to a different column.
+        Default None (simData is used in the order returned by the database).
+    stackerCacheCol : Optional[str]
+        The column identifying each visit, used to cache the columns added by per-visit stackers
+        (see StackerEngine). These are then calculated only once for each visit, rather than for
+        each compatible list and each constraint queried from the dbObj (typically 'expMJD', as the
+        Summary table is queried with one row per expMJD). The cache is cleared whenever simData is
+        passed to runCurrent. Default None (the stackers are rerun each time).
+    lazyStackers : Optional[bool]
+        If True, the per-visit stackers whose columns are not needed by the slicer are only run
+        on the visits in each dataSlice, just before the metrics are calculated for that slicePoint
+        (so visits which are never in any dataSlice are not calculated). Default False.
     """
+    # The number of slicePoints in each batch of dataSlices passed to metric.runMany.
+    runManyBatchSize = 1000
+
     def __init__(self, bundleDict, dbObj, outDir='.', resultsDb=None, verbose=True,
-                 saveEarly=True, dbTable='Summary'):
+                 saveEarly=True, dbTable='Summary', presortCol=None, stackerCacheCol=None,
+                 lazyStackers=False):
         """Set up the MetricBundleGroup.
         """
         # Print occasional messages to screen.
@@ -93,6 +136,11 @@ class MetricBundleGroup(object):
             os.makedirs(self.outDir)
         # Set the table we're going to be querying.
         self.dbTable = dbTable
+        # Set the column to presort simData on (if any).
+        self.presortCol = presortCol
+        # Runs the stackers, caching the per-visit stacker columns across compatible lists and constraints.
+        self.stackerEngine = StackerEngine(visitIdCol=stackerCacheCol)
+        self.lazyStackers = lazyStackers
         # Do some type checking on the MetricBundle dictionary.
         if not isinstance(bundleDict, dict):
             raise ValueError('bundleDict should be a dictionary containing MetricBundle objects.')
@@ -281,6 +329,8 @@ class MetricBundleGroup(object):
         # Can pass simData directly (if had other method for getting data)
         if simData is not None:
             self.simData = simData
+            # The cached stacker columns may have been calculated from different values of their inputs.
+            self.stackerEngine.clear()
 
         else:
             self.simData = None
@@ -295,6 +345,11 @@ class MetricBundleGroup(object):
                               ' Skipping constraint %s' % constraint)
                 return
 
+        # Sort simData once, so that each dataSlice is sorted on presortCol.
+        if self.presortCol is not None:
+            self._presortSimData()
+            self._checkRequiresSorted()
+
         # Find compatible subsets of the MetricBundle dictionary,
         # which can be run/metrics calculated/ together.
         self._findCompatibleLists()
@@ -329,6 +384,31 @@ class MetricBundleGroup(object):
             if self.verbose:
                 print('Deleted metricValues from memory.')
 
+    def _presortSimData(self):
+        """Sort simData (stably) on presortCol.
+
+        Sorting the index array and gathering the records once is much faster than
+        sorting the structured array by field name at every slicePoint.
+        """
+        if self.presortCol not in self.simData.dtype.names:
+            warnings.warn('presortCol %s is not in simData; not sorting simData.' % (self.presortCol))
+            return
+        sortCol = self.simData[self.presortCol]
+        if not np.all(sortCol[1:] >= sortCol[:-1]):
+            self.simData = self.simData[np.argsort(sortCol, kind='mergesort')]
+
+    def _checkRequiresSorted(self):
+        """Warn about the current metrics which need their data sorted on a column other than presortCol.
+
+        These metrics sort their dataSlice at each slicePoint, so do not benefit from presorting.
+        """
+        for b in self.currentBundleDict.values():
+            requiresSorted = getattr(b.metric, 'requiresSorted', None)
+            if requiresSorted is not None and requiresSorted != self.presortCol:
+                warnings.warn('Metric %s requires data sorted on %s, but simData is presorted on %s;'
+                              ' its data will be sorted at each slicePoint.'
+                              % (b.metric.name, requiresSorted, self.presortCol))
+
     def _runCompatible(self, compatibleList):
         """Runs a set of 'compatible' metricbundles in the MetricBundleGroup dictionary,
         identified by 'compatibleList' keys.
@@ -362,15 +442,17 @@ class MetricBundleGroup(object):
             if m not in uniqMaps:
                 uniqMaps.append(m)
 
-        # Run stackers.
-        for stacker in uniqStackers:
-            # Note that stackers will clobber previously existing rows with the same name.
-            self.simData = stacker.run(self.simData)
-
         # Pull out one of the slicers to use as our 'slicer'.
         # This will be forced back into all of the metricBundles at the end (so that they track
         #  the same metadata such as the slicePoints, in case the same actual object wasn't used).
         slicer = list(bDict.values())[0].slicer
+
+        # Run stackers (in dependency order, gathering cached per-visit columns where possible).
+        # Per-visit stackers which the slicer does not need can be run lazily, for each dataSlice.
+        # Note that stackers will clobber previously existing rows with the same name.
+        eagerCols = list(slicer.columnsNeeded) if self.lazyStackers else None
+        self.simData = self.stackerEngine.run(self.simData, uniqStackers, eagerCols=eagerCols)
+
         if (slicer.slicerName == 'OpsimFieldSlicer'):
             slicer.setupSlicer(self.simData, self.fieldData, maps=uniqMaps)
         else:
@@ -391,14 +473,36 @@ class MetricBundleGroup(object):
             cache = True
         else:
             cache = False
+        # Values calculated once over all of simData, shared with the context at each slicePoint.
+        sortedOn = self.presortCol if self.presortCol in self.simData.dtype.names else None
+        # (The deferred stacker columns are not calculated for all of simData yet, so are not shared).
+        simDataContext = SliceContext(self.simData, sortedOn=sortedOn,
+                                      incompleteCols=self.stackerEngine.deferredCols)
+        # Metrics with a runMany method are run on batches of dataSlices rather than at each slicePoint.
+        batchBundles = [b for b in bDict.values() if _hasRunMany(b.metric)]
+        runBundles = [b for b in bDict.values() if not _hasRunMany(b.metric)]
+        batch = []
         # Run through all slicepoints and calculate metrics.
         for i, slice_i in enumerate(slicer):
+            # Calculate any deferred stacker columns for the visits in this slice.
+            self.stackerEngine.fill(self.simData, slice_i['idxs'])
             slicedata = self.simData[slice_i['idxs']]
             if len(slicedata) == 0:
                 # No data at this slicepoint. Mask data values.
                 for b in bDict.values():
                     b.metricValues.mask[i] = True
             else:
+                # Share the intermediate values computed from slicedata (sorted times, unique nights, ..)
+                #  among all of the metrics run at this slicePoint.
+                # (The order of each dataSlice is checked, rather than trusting the slicer's idxs).
+                slice_i['slicePoint']['sliceContext'] = SliceContext(slicedata, parent=simDataContext,
+                                                                     idxs=slice_i['idxs'])
+                if len(batchBundles) > 0:
+                    # Keep only the indexes; the columns are gathered when the batch is run.
+                    batch.append((i, slice_i['idxs']))
+                    if len(batch) >= self.runManyBatchSize:
+                        self._runBatch(batchBundles, batch)
+                        batch = []
                 # There is data! Should we use our data cache?
                 if cache:
                     # Make the data idxs hashable.
@@ -413,7 +517,7 @@ class MetricBundleGroup(object):
                     else:
                         cacheDict[cacheKey] = i
                         useCache = False
-                    for b in bDict.values():
+                    for b in runBundles:
                         if useCache:
                             b.metricValues.data[i] = b.metricValues.data[cacheDict[cacheKey]]
                         else:
@@ -424,8 +528,12 @@ class MetricBundleGroup(object):
 
                 # Not using memoize, just calculate things normally
                 else:
-                    for b in bDict.values():
+                    for b in runBundles:
                         b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+        if len(batch) > 0:
+            self._runBatch(batchBundles, batch)
+        # Cache the deferred stacker columns calculated for the dataSlices (for later constraints).
+        self.stackerEngine.cacheDeferred(self.simData)
         # Mask data where metrics could not be computed (according to metric bad value).
         for b in bDict.values():
             if b.metricValues.dtype.name == 'object':
@@ -442,6 +550,34 @@ class MetricBundleGroup(object):
             for b in bDict.values():
                 b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
+    def _runBatch(self, bundles, batch):
+        """Calculate the metric values of bundles for a batch of slicePoints, with metric.runMany.
+
+        Parameters
+        ----------
+        bundles : list of MetricBundles
+            The metricBundles (whose metrics have a runMany method).
+        batch : list of (int, numpy.ndarray)
+            The index of each slicePoint and the indexes of its dataSlice in simData.
+        """
+        sids = [i for i, idxs in batch]
+        for b in bundles:
+            # Gather only the columns this metric uses, rather than every column of simData.
+            cols = []
+            for col in b.metric.colNameArr:
+                if col not in cols:
+                    cols.append(col)
+            dtype = [(col, self.simData.dtype[col]) for col in cols]
+            dataSlices = []
+            for i, idxs in batch:
+                columns = [self.simData[col][idxs] for col in cols]
+                dataSlice = np.empty(len(columns[0]), dtype=dtype)
+                for col, values in zip(cols, columns):
+                    dataSlice[col] = values
+                dataSlices.append(dataSlice)
+            for i, value in zip(sids, b.metric.runMany(dataSlices)):
+                b.metricValues.data[i] = value
+
     def reduceAll(self, updateSummaries=True):
         """Run the reduce methods for all metrics in bundleDict.
 
@@ -1,23 +1,41 @@
 from __future__ import print_function
 
-__all__ = ['MoMetricBundle', 'MoMetricBundleGroup', 'createEmptyMoMetricBundle', 'makeCompletenessBundle']
+__all__ = ['MoMetricBundle', 'MoMetricBundleGroup', 'createEmptyMoMetricBundle', 'makeCompletenessBundle',
+           'makeCompletenessBundles', 'computeMoSummaryStats']
 
 from builtins import object
 import os
+import warnings
+import multiprocessing
 import numpy as np
 import numpy.ma as ma
 import matplotlib.pyplot as plt
 
 from lsst.sims.maf.metrics import BaseMoMetric
-from lsst.sims.maf.metrics import MoCompletenessMetric, ValueAtHMetric
+from lsst.sims.maf.metrics import MoCompletenessMetric, MoCompletenessAtTimeMetric, ValueAtHMetric
+from lsst.sims.maf.metrics import completenessH, completenessAtTime
 from lsst.sims.maf.slicers import MoObjSlicer
 from lsst.sims.maf.stackers import BaseMoStacker, MoMagStacker
 from lsst.sims.maf.plots import PlotHandler
 from lsst.sims.maf.plots import MetricVsH
+from lsst.sims.maf.utils import RaggedMetricValues
 
 from .metricBundle import MetricBundle
 
 
+def _hasRunH(metric):
+    """Return True if metric has a runH method matching its run method.
+
+    A subclass which overrides run (but not runH) is still run for each H value.
+    """
+    for cls in type(metric).__mro__:
+        if 'runH' in cls.__dict__:
+            return True
+        if 'run' in cls.__dict__:
+            return False
+    return False
+
+
 def createEmptyMoMetricBundle():
     """Create an empty metric bundle.
 
@@ -84,6 +102,93 @@ def makeCompletenessBundle(bundle, summaryName='CumulativeCompleteness', Hmark=N
     return mb
 
 
+def makeCompletenessBundles(bundleDict, Hmark=None, resultsDb=None):
+    """Make (mock) differential and cumulative completeness metric bundles for many bundles.
+
+    The completeness summary values which are not already available are calculated for all of the
+    bundles at once (see computeMoSummaryStats), then the mock bundles are made with makeCompletenessBundle.
+
+    Parameters
+    ----------
+    bundleDict : dict of ~lsst.sims.maf.metricBundles.MoMetricBundle
+        The metric bundles (with the number of discovery chances as their metric values).
+    Hmark : float, opt
+        The Hmark value to add to the plotting dictionary of the new mock bundles. Default None.
+    resultsDb : ~lsst.sims.maf.db.ResultsDb, opt
+        The resultsDb in which to record the summary statistic values. Default None.
+
+    Returns
+    -------
+    dict, dict
+        The differential and cumulative completeness bundles, with the same keys as bundleDict.
+    """
+    summaryNames = ['DifferentialCompleteness', 'CumulativeCompleteness']
+    missing = []
+    for b in bundleDict.values():
+        if b.summaryValues is None or not all(name in b.summaryValues for name in summaryNames):
+            b.setSummaryMetrics([MoCompletenessMetric(cumulative=False), MoCompletenessMetric(cumulative=True)])
+            missing.append(b)
+    computeMoSummaryStats(missing, resultsDb=resultsDb)
+    completeness = []
+    for summaryName in summaryNames:
+        completeness.append(dict([(k, makeCompletenessBundle(b, summaryName=summaryName, Hmark=Hmark,
+                                                             resultsDb=resultsDb))
+                                  for k, b in bundleDict.items()]))
+    return completeness[0], completeness[1]
+
+
+def computeMoSummaryStats(bundles, resultsDb=None):
+    """Compute the summary statistics of many moving object metric bundles.
+
+    The MoCompletenessMetric and MoCompletenessAtTimeMetric summary metrics of all of the bundles
+    with the same shape and H values (a cloned H distribution) are calculated together, by stacking
+    their metric values and calculating the differential and cumulative completeness of the stack
+    in one pass. Any other summary metrics are run for each bundle, as in computeSummaryStats.
+
+    Parameters
+    ----------
+    bundles : list of ~lsst.sims.maf.metricBundles.MoMetricBundle
+        The metric bundles.
+    resultsDb : ~lsst.sims.maf.db.ResultsDb, opt
+        The resultsDb in which to record the summary statistic values. Default None.
+    """
+    stacks = {}
+    for b in bundles:
+        others = []
+        Hvals = b.slicer.slicePoints['H']
+        summaryMetrics = b.summaryMetrics if b.summaryMetrics is not None else []
+        for m in summaryMetrics:
+            if b.metricValues.shape[1] != len(Hvals):
+                key = None
+            elif isinstance(m, MoCompletenessMetric):
+                key = ('chances', m.requiredChances, m.Hindex)
+            elif isinstance(m, MoCompletenessAtTimeMetric):
+                key = ('times', tuple(m.times), m.Hindex)
+            else:
+                key = None
+            if key is None:
+                others.append(m)
+            else:
+                key = key + (b.metricValues.shape, tuple(Hvals))
+                stacks.setdefault(key, []).append((b, m))
+        b.computeSummaryStats(resultsDb, summaryMetrics=others)
+    for key, bundleMetrics in stacks.items():
+        # Stack the metric values of each bundle (once, even if it has more than one of these summary metrics).
+        stackBundles = []
+        for b, m in bundleMetrics:
+            if b not in stackBundles:
+                stackBundles.append(b)
+        values = np.array([ma.filled(b.metricValues, np.nan if key[0] == 'times' else 0) for b in stackBundles])
+        Hvals = np.array(key[-1])
+        if key[0] == 'chances':
+            differential, cumulative = completenessH(values, Hvals, key[1], key[2])
+        else:
+            differential, cumulative = completenessAtTime(values, Hvals, key[1], key[2])
+        for b, m in bundleMetrics:
+            i = stackBundles.index(b)
+            b._setSummaryValue(m.name, m.summarize(differential[i], cumulative[i], Hvals), resultsDb)
+
+
 class MoMetricBundle(MetricBundle):
     def __init__(self, metric, slicer, constraint=None,
                  stackerList=None,
@@ -167,6 +272,16 @@ class MoMetricBundle(MetricBundle):
         self.metricValues = None
         self.summaryValues = None
 
+    def _setupMetricValues(self):
+        """Set up the numpy masked array (or RaggedMetricValues, if the metric defines raggedCols)
+        to store the metric value data.
+        """
+        raggedCols = getattr(self.metric, 'raggedCols', None)
+        if raggedCols is None:
+            super(MoMetricBundle, self)._setupMetricValues()
+        else:
+            self.metricValues = RaggedMetricValues(self.slicer.shape, raggedCols, fill_value=self.slicer.badval)
+
     def _buildMetadata(self, metadata):
         """If no metadata is provided, auto-generate it from the obsFile + constraint.
         """
@@ -207,22 +322,35 @@ class MoMetricBundle(MetricBundle):
         if len(childMetrics) > 0:
             self.summaryMetrics = []
 
-    def computeSummaryStats(self, resultsDb=None):
+    def computeSummaryStats(self, resultsDb=None, summaryMetrics=None):
         """Compute summary statistics on metricValues, using summaryMetrics, for self and child bundles.
+
+        Parameters
+        ----------
+        resultsDb : ~lsst.sims.maf.db.ResultsDb, opt
+            The resultsDb in which to record the summary statistic values. Default None.
+        summaryMetrics : list, opt
+            The summary metrics to compute. Default None, which uses self.summaryMetrics.
         """
         if self.summaryValues is None:
             self.summaryValues = {}
-        if self.summaryMetrics is not None:
+        if summaryMetrics is None:
+            summaryMetrics = self.summaryMetrics
+        if summaryMetrics is not None:
             # Build array of metric values, to use for (most) summary statistics.
-            for m in self.summaryMetrics:
-                summaryName = m.name
+            for m in summaryMetrics:
                 summaryVal = m.run(self.metricValues, self.slicer.slicePoints['H'])
-                self.summaryValues[summaryName] = summaryVal
-                # Add summary metric info to results database, if applicable.
-                if resultsDb:
-                    metricId = resultsDb.updateMetric(self.metric.name, self.slicer.slicerName,
-                                                      self.runName, self.constraint, self.metadata, None)
-                    resultsDb.updateSummaryStat(metricId, summaryName=summaryName, summaryValue=summaryVal)
+                self._setSummaryValue(m.name, summaryVal, resultsDb)
+
+    def _setSummaryValue(self, summaryName, summaryVal, resultsDb=None):
+        """Save a summary statistic value, and add it to the results database, if applicable."""
+        if self.summaryValues is None:
+            self.summaryValues = {}
+        self.summaryValues[summaryName] = summaryVal
+        if resultsDb:
+            metricId = resultsDb.updateMetric(self.metric.name, self.slicer.slicerName,
+                                              self.runName, self.constraint, self.metadata, None)
+            resultsDb.updateSummaryStat(metricId, summaryName=summaryName, summaryValue=summaryVal)
 
     def reduceMetric(self, reduceFunc, reducePlotDict=None, reduceDisplayDict=None):
         raise NotImplementedError
@@ -249,9 +377,54 @@ class MoMetricBundle(MetricBundle):
         self.setPlotFuncs([MetricVsH()])
 
 
+# The MoMetricBundleGroup (and its compatible lists and stackers) used by the worker processes.
+_shardState = {}
+
+
+def _initShard(group, compatibleLists, compatStackers, reseed):
+    _shardState['group'] = group
+    _shardState['compatibleLists'] = compatibleLists
+    _shardState['compatStackers'] = compatStackers
+    if reseed:
+        # Don't let every worker draw the same (forked) global random numbers.
+        np.random.seed()
+
+
+def _runShard(orbitIdxs):
+    """Calculate the metric values for the orbits in orbitIdxs in a worker process,
+    returning the parent and child metric values (and masks) for those orbits."""
+    group = _shardState['group']
+    values = {}
+    for compatibleList, stackers in zip(_shardState['compatibleLists'], _shardState['compatStackers']):
+        group._runCompatible(compatibleList, stackers, orbitIdxs)
+        for k in compatibleList:
+            for key, b in group._bundleAndChildren(k):
+                values[key] = b.metricValues[orbitIdxs]
+    return values
+
+
 class MoMetricBundleGroup(object):
-    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True):
+    """Run and save a set of moving object metric bundles, which all use the same slicer.
+
+    Parameters
+    ----------
+    bundleDict : dict
+        Dictionary of the MoMetricBundles to run.
+    outDir : str, optional
+        Directory for the output files. Default '.'.
+    resultsDb : ResultsDb, optional
+        ResultsDb to record the output files and summary statistics. Default None.
+    verbose : bool, optional
+        Default True.
+    nProcesses : int, optional
+        The number of processes to use to calculate the metric values. If more than one, the objects
+        are split into shards which are run in parallel, and the metric values merged back into the bundles.
+        For the results to be reproducible (and independent of nProcesses), use a randomSeed in
+        MoMagStacker. Default 1.
+    """
+    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True, nProcesses=1):
         self.verbose = verbose
+        self.nProcesses = int(nProcesses)
         self.bundleDict = bundleDict
         self.outDir = outDir
         if not os.path.isdir(self.outDir):
@@ -362,14 +535,23 @@ class MoMetricBundleGroup(object):
         self.slicer.subsetObs(constraint)
         # Identify the sets of these metricBundles can be run at the same time (also have the same stackers).
         compatibleLists = self._findCompatible(keysMatchingConstraint)
-
-        # And now run each of those subsets of compatible metricBundles.
+        compatStackers = [self._setupCompatible(compatibleList) for compatibleList in compatibleLists]
+
+        # And now run each of those subsets of compatible metricBundles, for each chunk of objects
+        # (if the slicer is streaming its observations from disk; otherwise there is a single chunk).
+        observed = np.zeros(self.slicer.nSso, bool)
+        for orbitIdxs in self.slicer.iterObsChunks():
+            observed[orbitIdxs] = True
+            if self.nProcesses > 1:
+                self._runShards(compatibleLists, compatStackers, orbitIdxs)
+            else:
+                for compatibleList, stackers in zip(compatibleLists, compatStackers):
+                    self._runCompatible(compatibleList, stackers, orbitIdxs)
         for compatibleList in compatibleLists:
-            self._runCompatible(compatibleList)
+            self._finishCompatible(compatibleList, np.where(~observed)[0])
 
-    def _runCompatible(self, compatibleList):
-        """Calculate the metric values for set of (parent and child) bundles, as well as the summary stats,
-        and write to disk.
+    def _setupCompatible(self, compatibleList):
+        """Set up the metric values for a set of (parent and child) bundles which can be calculated together.
 
         Parameters
         -----------
@@ -377,6 +559,11 @@ class MoMetricBundleGroup(object):
             List of dictionary keys, of the metricBundles which can be calculated together.
             This means they are 'compatible' and have the same slicer, constraint, and non-conflicting
             mappers and stackers.
+
+        Returns
+        -------
+        list
+            The stackers to run for this set of metricBundles.
         """
         if self.verbose:
             print('Running metrics %s' % compatibleList)
@@ -397,44 +584,141 @@ class MoMetricBundleGroup(object):
             b._setupMetricValues()
             for cb in b.childBundles.values():
                 cb._setupMetricValues()
+        return compatStackers
+
+    def _runCompatible(self, compatibleList, compatStackers, orbitIdxs):
+        """Calculate the metric values for set of (parent and child) bundles, for the orbits in orbitIdxs.
+
+        Parameters
+        -----------
+        compatibleList : list
+            List of dictionary keys, of the metricBundles which can be calculated together.
+        compatStackers : list
+            The stackers to run for this set of metricBundles.
+        orbitIdxs : numpy.ndarray
+            The indexes of the orbits (slicePoints) to calculate, whose observations are loaded in the slicer.
+        """
         # Calculate the metric values.
-        for i, slicePoint in enumerate(self.slicer):
+        for i in orbitIdxs:
+            slicePoint = self.slicer[i]
             ssoObs = slicePoint['obs']
-            for j, Hval in enumerate(slicePoint['Hvals']):
-                # Run stackers to add extra columns (that depend on Hval)
-                for s in compatStackers:
-                    ssoObs = s.run(ssoObs, slicePoint['orbit']['H'], Hval)
+            Hvals = slicePoint['Hvals']
+            # Mask the parent metric (and then child metrics) if there was no data.
+            if len(ssoObs) == 0:
+                for k in compatibleList:
+                    b = self.bundleDict[k]
+                    b.metricValues.mask[i] = True
+                    for cb in b.childBundles.values():
+                        cb.metricValues.mask[i] = True
+                continue
+            # Run stackers to add extra columns. The columns which depend on Hval are calculated
+            # for all Hvals at once (as nH x nObs arrays in Hcols).
+            Hcols = {}
+            for s in compatStackers:
+                ssoObs, stackerHcols = s.runH(ssoObs, slicePoint['orbit']['H'], Hvals)
+                Hcols.update(stackerHcols)
+            # Calculate the parent metrics for all Hvals at once, where the metric supports this.
+            mValsH = {}
+            fillHcols = False
+            for k in compatibleList:
+                b = self.bundleDict[k]
+                if _hasRunH(b.metric):
+                    mValsH[k] = b.metric.runH(ssoObs, slicePoint['orbit'], Hvals, Hcols)
+                else:
+                    mValsH[k] = None
+                if mValsH[k] is None or len(b.childBundles) > 0:
+                    fillHcols = True
+            for j, Hval in enumerate(Hvals):
+                # Fill in the columns for this Hval (if any metric needs them).
+                if fillHcols:
+                    for col in Hcols:
+                        ssoObs[col] = Hcols[col][j]
                 # Run all the parent metrics.
                 for k in compatibleList:
                     b = self.bundleDict[k]
-                    # Mask the parent metric (and then child metrics) if there was no data.
-                    if len(ssoObs) == 0:
+                    # Calculate for the parent.
+                    if mValsH[k] is not None:
+                        mVal = mValsH[k][j]
+                    else:
+                        mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
+                    # Mask if the parent metric returned a bad value.
+                    if mVal == b.metric.badval:
                         b.metricValues.mask[i][j] = True
-                        for cb in list(b.childBundles.values()):
+                        for cb in b.childBundles.values():
                             cb.metricValues.mask[i][j] = True
-                    # Otherwise, calculate the metric value for the parent, and then child.
+                    # Otherwise, set the parent value and calculate the child metric values as well.
                     else:
-                        # Calculate for the parent.
-                        mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
-                        # Mask if the parent metric returned a bad value.
-                        if mVal == b.metric.badval:
-                            b.metricValues.mask[i][j] = True
-                            for cb in b.childBundles.values():
+                        b.metricValues[i, j] = mVal
+                        for cb in b.childBundles.values():
+                            childVal = cb.metric.run(ssoObs, slicePoint['orbit'], Hval, mVal)
+                            if childVal == cb.metric.badval:
                                 cb.metricValues.mask[i][j] = True
-                        # Otherwise, set the parent value and calculate the child metric values as well.
-                        else:
-                            b.metricValues.data[i][j] = mVal
-                            for cb in b.childBundles.values():
-                                childVal = cb.metric.run(ssoObs, slicePoint['orbit'], Hval, mVal)
-                                if childVal == cb.metric.badval:
-                                    cb.metricValues.mask[i][j] = True
-                                else:
-                                    cb.metricValues.data[i][j] = childVal
+                            else:
+                                cb.metricValues.data[i][j] = childVal
+
+    def _bundleAndChildren(self, k):
+        """Return (key, bundle) for the bundle k and each of its child bundles."""
+        bundles = [((k, None), self.bundleDict[k])]
+        for childName, cb in self.bundleDict[k].childBundles.items():
+            bundles.append(((k, childName), cb))
+        return bundles
+
+    def _runShards(self, compatibleLists, compatStackers, orbitIdxs):
+        """Calculate the metric values for the orbits in orbitIdxs, split into shards run in nProcesses
+        worker processes, and merge the results into the metric bundles.
+
+        Parameters
+        -----------
+        compatibleLists : list of lists
+            The lists of dictionary keys of the metricBundles which can be calculated together.
+        compatStackers : list of lists
+            The stackers to run for each of the compatibleLists.
+        orbitIdxs : numpy.ndarray
+            The indexes of the orbits (slicePoints) to calculate, whose observations are loaded in the slicer.
+        """
+        reseed = False
+        for stackers in compatStackers:
+            for s in stackers:
+                if isinstance(s, MoMagStacker) and s.randomSeed is None:
+                    reseed = True
+        if reseed:
+            warnings.warn('Running in parallel without a MoMagStacker randomSeed; '
+                          'the results will not be reproducible.')
+        shards = [shard for shard in np.array_split(orbitIdxs, self.nProcesses) if len(shard) > 0]
+        pool = multiprocessing.Pool(min(self.nProcesses, max(len(shards), 1)), initializer=_initShard,
+                                    initargs=(self, compatibleLists, compatStackers, reseed))
+        try:
+            results = pool.map(_runShard, shards)
+        finally:
+            pool.close()
+            pool.join()
+        for compatibleList in compatibleLists:
+            for k in compatibleList:
+                for key, b in self._bundleAndChildren(k):
+                    for shard, values in zip(shards, results):
+                        b.metricValues[shard] = values[key]
+
+    def _finishCompatible(self, compatibleList, unobserved):
+        """Mask the orbits without observations, then calculate the summary stats and write to disk.
+
+        Parameters
+        -----------
+        compatibleList : list
+            List of dictionary keys, of the metricBundles which were calculated together.
+        unobserved : numpy.ndarray
+            The indexes of the orbits which were not in any chunk of observations.
+        """
+        bundles = []
+        for k in compatibleList:
+            for key, b in self._bundleAndChildren(k):
+                b.metricValues.mask[unobserved] = True
+                bundles.append(b)
+        # Calculate the summary stats of all of the bundles together, so that the completeness
+        # of all of the (child) bundles can be calculated at once.
+        computeMoSummaryStats(bundles, self.resultsDb)
         for k in compatibleList:
             b = self.bundleDict[k]
-            b.computeSummaryStats(self.resultsDb)
             for cB in b.childBundles.values():
-                cB.computeSummaryStats(self.resultsDb)
                 # Write to disk.
                 cB.write(outDir=self.outDir, resultsDb=self.resultsDb)
             # Write to disk.
@@ -1,4 +1,5 @@
 from .baseMetric import *
+from .sliceContext import *
 from .simpleMetrics import *
 from .summaryMetrics import *
 from .technicalMetrics import *
@@ -174,6 +174,10 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
 
         # Default to only return one metric value per slice
         self.shape = 1
+        # The column the metric needs its dataSlice sorted on (if any). Metrics which need sorted data
+        #  should use the SliceContext sortedSlice, which skips the sort if the MetricBundleGroup
+        #  presorted simData on this column.
+        self.requiresSorted = None
 
     def run(self, dataSlice, slicePoint=None):
         """Calculate metric values.
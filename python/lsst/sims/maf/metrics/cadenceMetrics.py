@@ -4,6 +4,7 @@ __all__ = ['TemplateExistsMetric', 'UniformityMetric',
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 
 
 class TemplateExistsMetric(BaseMetric):
@@ -16,6 +17,7 @@ class TemplateExistsMetric(BaseMetric):
                                                    units='fraction', **kwargs)
         self.seeingCol = seeingCol
         self.expMJDCol = expMJDCol
+        self.requiresSorted = self.expMJDCol
 
     def run(self, dataSlice, slicePoint=None):
         """"Calculate the fraction of images with a previous template image of desired quality.
@@ -33,7 +35,7 @@ class TemplateExistsMetric(BaseMetric):
             The fraction of images with a 'good' previous template image.
         """
         # Check that data is sorted in expMJD order
-        dataSlice.sort(order=self.expMJDCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.expMJDCol)
         # Find the minimum seeing up to a given time
         seeing_mins = np.minimum.accumulate(dataSlice[self.seeingCol])
         # Find the difference between the seeing and the minimum seeing at the previous visit
@@ -181,6 +183,7 @@ class NRevisitsMetric(BaseMetric):
         self.normed = normed
         super(NRevisitsMetric, self).__init__(col=self.timeCol, units=units, metricName=metricName, **kwargs)
         self.metricDtype = 'int'
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
         """Count the number of consecutive visits occuring within time intervals dT.
@@ -197,7 +200,7 @@ class NRevisitsMetric(BaseMetric):
         float
            Either the total number of consecutive visits within dT or the fraction compared to overall visits.
         """
-        dtimes = np.diff(np.sort(dataSlice[self.timeCol]))
+        dtimes = getSliceContext(dataSlice, slicePoint).dtimes(self.timeCol)
         nFastRevisits = np.size(np.where(dtimes <= self.dT)[0])
         if self.normed:
             nFastRevisits = nFastRevisits / float(np.size(dataSlice[self.timeCol]))
@@ -222,6 +225,7 @@ class IntraNightGapsMetric(BaseMetric):
         self.reduceFunc = reduceFunc
         super(IntraNightGapsMetric, self).__init__(col=[self.timeCol, self.nightCol],
                                                    units=units, metricName=metricName, **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
         """Calculate the (reduceFunc) of the gap between consecutive obervations within a night.
@@ -238,9 +242,9 @@ class IntraNightGapsMetric(BaseMetric):
         float
            The (reduceFunc) value of the gap, in hours.
         """
-        dataSlice.sort(order=self.timeCol)
-        dt = np.diff(dataSlice[self.timeCol])
-        dn = np.diff(dataSlice[self.nightCol])
+        context = getSliceContext(dataSlice, slicePoint)
+        dt = context.dtimes(self.timeCol)
+        dn = np.diff(context.sortedCol(self.nightCol, self.timeCol))
 
         good = np.where(dn == 0)
         if np.size(good[0]) == 0:
@@ -268,6 +272,7 @@ class InterNightGapsMetric(BaseMetric):
         self.reduceFunc = reduceFunc
         super(InterNightGapsMetric, self).__init__(col=[self.timeCol, self.nightCol],
                                                    units=units, metricName=metricName, **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
         """Calculate the (reduceFunc) of the gap between consecutive nights of observations.
@@ -284,15 +289,15 @@ class InterNightGapsMetric(BaseMetric):
         float
             The (reduceFunc) of the gap between consecutive nights of observations, in days.
         """
-        dataSlice.sort(order=self.timeCol)
-        unights = np.unique(dataSlice[self.nightCol])
+        context = getSliceContext(dataSlice, slicePoint)
+        unights = context.unique(self.nightCol)
         if np.size(unights) < 2:
             result = self.badval
         else:
             # Find the first and last observation of each night
-            firstOfNight = np.searchsorted(dataSlice[self.nightCol], unights)
-            lastOfNight = np.searchsorted(dataSlice[self.nightCol], unights, side='right') - 1
-            diff = dataSlice[self.timeCol][firstOfNight[1:]] - dataSlice[self.timeCol][lastOfNight[:-1]]
+            unights, firstOfNight, lastOfNight = context.nightBounds(self.nightCol, self.timeCol)
+            times = context.sortedCol(self.timeCol, self.timeCol)
+            diff = times[firstOfNight[1:]] - times[lastOfNight[:-1]]
             result = self.reduceFunc(diff)
         return result
 
@@ -314,6 +319,7 @@ class AveGapMetric(BaseMetric):
         self.reduceFunc = reduceFunc
         super(AveGapMetric, self).__init__(col=[self.timeCol, self.nightCol],
                                            units=units, metricName=metricName, **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
         """Calculate the (reduceFunc) of the gap between consecutive observations.
@@ -333,7 +339,6 @@ class AveGapMetric(BaseMetric):
         float
            The (reduceFunc) of the time between consecutive observations, in hours.
         """
-        dataSlice.sort(order=self.timeCol)
-        diff = np.diff(dataSlice[self.timeCol])
+        diff = getSliceContext(dataSlice, slicePoint).dtimes(self.timeCol)
         result = self.reduceFunc(diff) * 24.
         return result
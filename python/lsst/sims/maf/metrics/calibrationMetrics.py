@@ -4,6 +4,7 @@ __all__ = ['ParallaxMetric', 'ProperMotionMetric', 'RadiusObsMetric',
 import numpy as np
 from .baseMetric import BaseMetric
 import lsst.sims.maf.utils as mafUtils
+from lsst.sims.maf.stackers.filterStackers import filterNames, filterTable, filterLookup, getFilterIdx
 import lsst.sims.utils as utils
 from scipy.optimize import curve_fit
 from builtins import str
@@ -79,14 +80,9 @@ class ParallaxMetric(BaseMetric):
         return sigma
 
     def run(self, dataslice, slicePoint=None):
-        filters = np.unique(dataslice[self.filterCol])
-        if hasattr(filters[0], 'decode'):
-            filters = [str(f.decode('utf-8')) for f in filters]
-        snr = np.zeros(len(dataslice), dtype='float')
         # compute SNR for all observations
-        for filt in filters:
-            good = np.where(dataslice[self.filterCol] == filt)
-            snr[good] = mafUtils.m52snr(self.mags[str(filt)], dataslice[self.m5Col][good])
+        mags = filterLookup(self.mags, dataslice, self.filterCol)
+        snr = mafUtils.m52snr(mags, dataslice[self.m5Col])
         position_errors = np.sqrt(mafUtils.astrom_precision(dataslice[self.seeingCol],
                                                             snr)**2+self.atm_err**2)
         sigma = self._final_sigma(position_errors, dataslice['ra_pi_amp'], dataslice['dec_pi_amp'])
@@ -154,19 +150,13 @@ class ProperMotionMetric(BaseMetric):
             self.comment += 'Values closer to 1 indicate more optimal scheduling.'
 
     def run(self, dataslice, slicePoint=None):
-        filters = np.unique(dataslice['filter'])
-        filters = [str(f) for f in filters]
-        precis = np.zeros(dataslice.size, dtype='float')
-        for f in filters:
-            observations = np.where(dataslice['filter'] == f)
-            if np.size(observations[0]) < 2:
-                precis[observations] = self.badval
-            else:
-                snr = mafUtils.m52snr(self.mags[f],
-                                      dataslice[self.m5Col][observations])
-                precis[observations] = mafUtils.astrom_precision(
-                    dataslice[self.seeingCol][observations], snr)
-                precis[observations] = np.sqrt(precis[observations]**2 + self.atm_err**2)
+        filterIdx = getFilterIdx(dataslice, 'filter')
+        snr = mafUtils.m52snr(filterLookup(self.mags, dataslice, 'filter', filterIdx), dataslice[self.m5Col])
+        precis = mafUtils.astrom_precision(dataslice[self.seeingCol], snr)
+        precis = np.sqrt(precis**2 + self.atm_err**2)
+        # Don't use the observations in filters with fewer than 2 observations.
+        nObs = np.bincount(filterIdx + 1, minlength=len(filterNames) + 1)
+        precis[nObs[filterIdx + 1] < 2] = self.badval
         good = np.where(precis != self.badval)
         result = mafUtils.sigma_slope(dataslice['expMJD'][good], precis[good])
         result = result*365.25*1e3  # Convert to mas/yr
@@ -271,13 +261,9 @@ class ParallaxCoverageMetric(BaseMetric):
         if np.size(dataSlice) < 2:
             return self.badval
 
-        filters = np.unique(dataSlice[self.filterCol])
-        filters = [str(f) for f in filters]
-        snr = np.zeros(len(dataSlice), dtype='float')
         # compute SNR for all observations
-        for filt in filters:
-            inFilt = np.where(dataSlice[self.filterCol] == filt)
-            snr[inFilt] = mafUtils.m52snr(self.mags[str(filt)], dataSlice[self.m5Col][inFilt])
+        mags = filterLookup(self.mags, dataSlice, self.filterCol)
+        snr = mafUtils.m52snr(mags, dataSlice[self.m5Col])
 
         weights = self._computeWeights(dataSlice, snr)
         aveR = self._weightedR(dataSlice['ra_pi_amp'], dataSlice['dec_pi_amp'], weights)
@@ -356,11 +342,10 @@ class ParallaxDcrDegenMetric(BaseMetric):
 
     def run(self, dataSlice, slicePoint=None):
 
-        snr = np.zeros(len(dataSlice), dtype='float')
-        # compute SNR for all observations
-        for filt in self.filters:
-            inFilt = np.where(dataSlice[self.filterCol] == filt)
-            snr[inFilt] = mafUtils.m52snr(self.mags[filt], dataSlice[self.m5Col][inFilt])
+        # compute SNR for all observations (zero for any other filters)
+        filterIdx = getFilterIdx(dataSlice, self.filterCol)
+        snr = mafUtils.m52snr(filterTable(self.mags)[filterIdx], dataSlice[self.m5Col])
+        snr[filterIdx < 0] = 0.
         # Compute the centroiding uncertainties
         position_errors = np.sqrt(mafUtils.astrom_precision(dataSlice[self.seeingCol],
                                                             snr)**2+self.atm_err**2)
@@ -2,7 +2,7 @@ __all__ = ['CrowdingMetric', 'CrowdingMagUncertMetric']
 
 from .baseMetric import BaseMetric
 import numpy as np
-from scipy.interpolate import interp1d
+from lsst.sims.maf.maps import crowdingIntegral
 
 # Modifying from Knut Olson's fork at:
 # https://github.com/knutago/sims_maf_contrib/blob/master/tutorials/CrowdingMetric.ipynb
@@ -33,7 +33,7 @@ class CrowdingMetric(BaseMetric):
         super(CrowdingMetric, self).__init__(col=cols, maps=maps, units=units,
                                              metricName=metricName, **kwargs)
 
-    def _compCrowdError(self, magVector, lumFunc, seeing, singleMag=None):
+    def _compCrowdError(self, magVector, lumFunc, seeing, singleMag=None, crowdTerm=None):
         """Compute the crowding error for each observation
 
         Parameters
@@ -48,6 +48,9 @@ class CrowdingMetric(BaseMetric):
         singleMag : float (None)
             If singleMag is None, the crowding error is calculated for each mag in magVector. If
             singleMag is a float, the crowding error is interpolated to that single value.
+        crowdTerm : np.array (None)
+            The seeing-independent part of the crowding error (as precomputed by the StellarDensityMap).
+            If None, this is calculated from lumFunc.
 
         Returns
         -------
@@ -57,32 +60,61 @@ class CrowdingMetric(BaseMetric):
 
         Equation from Olsen, Blum, & Rigaut 2003, AJ, 126, 452
         """
-        lumVector = 10**(-0.4 * magVector)
-        coeff = np.sqrt(np.pi / self.lumAreaArcsec) * seeing / 2.
-        myIntergral = (np.add.accumulate((lumVector**2 * lumFunc)[::-1]))[::-1]
-        temp = np.sqrt(myIntergral)/lumVector
+        coeff = np.sqrt(np.pi / self.lumAreaArcsec) * np.asarray(seeing, dtype=float) / 2.
+        if crowdTerm is None:
+            crowdTerm = crowdingIntegral(magVector, lumFunc)
+        temp = crowdTerm
         if singleMag is not None:
-            interp = interp1d(magVector, temp)
-            temp = interp(singleMag)
+            temp = self._interpCrowdTerm(magVector, crowdTerm, singleMag)
 
         crowdError = coeff*temp
 
         return crowdError
 
-    def run(self, dataSlice, slicePoint=None):
-        magVector = slicePoint['starMapBins'][1:]
-        lumFunc = slicePoint['starLumFunc']
+    def _interpCrowdTerm(self, magVector, crowdTerm, singleMag):
+        """Interpolate the (seeing-independent) crowding term for a single pixel to singleMag."""
+        if singleMag < magVector[0] or singleMag > magVector[-1]:
+            raise ValueError('Magnitude %f is outside the range of the stellar luminosity function (%f - %f).'
+                             % (singleMag, magVector[0], magVector[-1]))
+        return np.interp(singleMag, magVector, crowdTerm)
+
+    def crowdingMag(self, magVector, crowdTerm, seeing):
+        """Find the magnitude at which the crowding error reaches crowding_error.
+
+        run calls this for a single slicepoint. Outside of the MetricBundleGroup (which calls run for
+        each slicepoint), it can also be called directly for many slicepoints at once: crowdTerm may be
+        2-d (one row per slicepoint, such as the 'starCrowdTerm' values added by the StellarDensityMap)
+        with an array of seeing values.
 
-        crowdError = self._compCrowdError(magVector, lumFunc, seeing=min(dataSlice[self.seeingCol]))
+        Parameters
+        ----------
+        magVector : np.array
+            Stellar magnitudes.
+        crowdTerm : np.array
+            The seeing-independent part of the crowding error at each magnitude.
+        seeing : float or np.array
+            The best seeing at each slicepoint.
 
-        # Locate at which point crowding error is greater than user-defined limit
-        aboveCrowd = np.where(crowdError >= self.crowding_error)[0]
+        Returns
+        -------
+        float or np.array
+            The magnitude of a star which has a photometric error of `crowding_error`.
+        """
+        coeff = np.sqrt(np.pi / self.lumAreaArcsec) * np.asarray(seeing, dtype=float) / 2.
+        crowdError = coeff[..., np.newaxis] * crowdTerm
+        aboveCrowd = crowdError >= self.crowding_error
+        # Locate the first point at which crowding error is greater than user-defined limit
+        first = np.argmax(aboveCrowd, axis=-1)
+        crowdMag = magVector[np.maximum(first - 1, 0)]
+        return np.where(aboveCrowd.any(axis=-1), crowdMag, max(magVector))
 
-        if np.size(aboveCrowd) == 0:
-            return max(magVector)
-        else:
-            crowdMag = magVector[max(aboveCrowd[0]-1, 0)]
-            return crowdMag
+    def run(self, dataSlice, slicePoint=None):
+        magVector = slicePoint['starMapBins'][1:]
+        crowdTerm = slicePoint.get('starCrowdTerm')
+        if crowdTerm is None:
+            crowdTerm = crowdingIntegral(magVector, slicePoint['starLumFunc'])
+        crowdMag = self.crowdingMag(magVector, crowdTerm, min(dataSlice[self.seeingCol]))
+        return float(crowdMag)
 
 
 class CrowdingMagUncertMetric(CrowdingMetric):
@@ -111,10 +143,12 @@ class CrowdingMagUncertMetric(CrowdingMetric):
     def run(self, dataSlice, slicePoint=None):
 
         magVector = slicePoint['starMapBins'][1:]
-        lumFunc = slicePoint['starLumFunc']
-        # Magnitude uncertainty given crowding
-        dmagCrowd = self._compCrowdError(magVector, lumFunc,
-                                         dataSlice[self.seeingCol], singleMag=self.rmag)
-
-        result = np.mean(dmagCrowd)
+        crowdTerm = slicePoint.get('starCrowdTerm')
+        if crowdTerm is None:
+            crowdTerm = crowdingIntegral(magVector, slicePoint['starLumFunc'])
+        # The crowding term at rmag does not depend on the seeing, so the mean magnitude uncertainty
+        # given crowding is this term times the mean seeing coefficient.
+        term = self._interpCrowdTerm(magVector, crowdTerm, self.rmag)
+        coeff = np.sqrt(np.pi / self.lumAreaArcsec) * dataSlice[self.seeingCol] / 2.
+        result = np.mean(coeff) * term
         return result
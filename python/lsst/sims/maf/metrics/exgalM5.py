@@ -54,7 +54,7 @@ class ExgalM5(BaseMetric):
              float that is the dust atennuated co-added m5-depth.
         """
 
-        m5 = self.Coaddm5Metric.run(dataSlice)
+        m5 = self.Coaddm5Metric.run(dataSlice, slicePoint)
         A_x = (self.a[0] + self.b[0] / self.R_v) * (self.R_v * slicePoint['ebv'])
         result = m5 - A_x
         return result
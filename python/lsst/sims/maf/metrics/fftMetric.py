@@ -1,5 +1,6 @@
 from scipy import fftpack
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import stackSlices
 
 __all__ = ['FftMetric']
 
@@ -24,5 +25,17 @@ class FftMetric(BaseMetric):
         fft = fftpack.rfft(dataSlice[self.times])
         return fft[0:self.nCoeffs]
 
+    def runMany(self, dataSlices):
+        """Calculate the truncated FFT for many dataSlices at once.
+
+        The dataSlices with the same number of visits are transformed together, as a 2-d array.
+        Returns a list of the FFT coefficients for each dataSlice."""
+        results = [None] * len(dataSlices)
+        for indexes, times in stackSlices(dataSlices, self.times):
+            fft = fftpack.rfft(times, axis=-1)
+            for i, coeffs in zip(indexes, fft):
+                results[i] = coeffs[0:self.nCoeffs]
+        return results
+
     def reducePeak(self, fftCoeff):
         pass
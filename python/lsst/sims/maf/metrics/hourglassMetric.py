@@ -1,20 +1,30 @@
 from builtins import zip
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 from lsst.sims.utils import Site
+from lsst.sims.maf.utils import Almanac
 
 __all__ = ['HourglassMetric']
 
 
-def nearestVal(A, val):
-    return A[np.argmin(np.abs(np.array(A)-val))]
-
-
 class HourglassMetric(BaseMetric):
     """Plot the filters used as a function of time.
     Must be used with the Hourglass Slicer.
+
+    The times of local midnight, twilight and the moon phase for each night come from an
+    Almanac, which is calculated once per night over the span of the survey (rather than for every
+    night and filter change in every run) and can be saved to disk for later runs.
+
+    Parameters
+    ----------
+    telescope : str, optional
+        The name of the site (passed to lsst.sims.utils.Site). Default 'LSST'.
+    almanacDir : str, optional
+        Directory to save and read the almanac for this site. Default None (the almanac is
+        only cached in memory, for the lifetime of the metric).
     """
-    def __init__(self, telescope='LSST', **kwargs):
+    def __init__(self, telescope='LSST', almanacDir=None, **kwargs):
 
         metricName = 'hourglass'
         filtercol = "filter"
@@ -25,55 +35,26 @@ class HourglassMetric(BaseMetric):
         self.nightcol = nightcol
         self.mjdcol = mjdcol
         self.filtercol = filtercol
+        self.requiresSorted = self.mjdcol
         self.telescope = Site(name=telescope)
+        self.almanac = Almanac(self.telescope.latitude_rad, self.telescope.longitude_rad,
+                               self.telescope.height, cacheDir=almanacDir)
 
     def run(self, dataSlice, slicePoint=None):
 
-        import ephem
-        dataSlice.sort(order=self.mjdcol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.mjdcol)
         unights, uindx = np.unique(dataSlice[self.nightcol], return_index=True)
 
         names = ['mjd', 'midnight', 'moonPer', 'twi6_rise', 'twi6_set', 'twi12_rise',
                  'twi12_set', 'twi18_rise', 'twi18_set']
         types = ['float']*len(names)
         pernight = np.zeros(len(unights), dtype=list(zip(names, types)))
-        pernight['mjd'] = dataSlice['expMJD'][uindx]
-
-        left = np.searchsorted(dataSlice[self.nightcol], unights)
-
-        lsstObs = ephem.Observer()
-        lsstObs.lat = self.telescope.latitude_rad
-        lsstObs.lon = self.telescope.longitude_rad
-        lsstObs.elevation = self.telescope.height
-        horizons = ['-6', '-12', '-18']
-        key = ['twi6', 'twi12', 'twi18']
-
-        obsList = []
-        S = ephem.Sun()
-        moon = ephem.Moon()
-        for h in horizons:
-            obs = ephem.Observer()
-            obs.lat, obs.lon, obs.elevation = self.telescope.latitude_rad, \
-                                              self.telescope.longitude_rad, self.telescope.height
-            obs.horizon = h
-            obsList.append(obs)
-
-        # Oh for fuck's sake...pyephem uses 1899 as it's zero-day, and MJD has Nov 17 1858 as zero-day.
-        doff = ephem.Date(0)-ephem.Date('1858/11/17')
-
-        for i, mjd in enumerate(pernight['mjd']):
-            mjd = mjd-doff
-
-            pernight['midnight'][i] = nearestVal([lsstObs.previous_antitransit(S, start=mjd),
-                                                  lsstObs.next_antitransit(S, start=mjd)], mjd) + doff
-            moon.compute(mjd)
-            pernight['moonPer'][i] = moon.phase
-            for j, obs in enumerate(obsList):
-                pernight[key[j]+'_rise'][i] = obs.next_rising(S, start=pernight['midnight'][i]-doff,
-                                                              use_center=True) + doff
+        pernight['mjd'] = dataSlice[self.mjdcol][uindx]
 
-                pernight[key[j]+'_set'][i] = obs.previous_setting(S, start=pernight['midnight'][i]-doff,
-                                                                  use_center=True) + doff
+        # Look up the almanac values for the night nearest to the first visit of each night.
+        almanacNights = self.almanac.getNights(pernight['mjd'])
+        for name in names[1:]:
+            pernight[name] = almanacNights[name]
 
         # Define the breakpoints as where either the filter changes
         # OR there's more than a 2 minute gap in observing
@@ -89,11 +70,8 @@ class HourglassMetric(BaseMetric):
         names = ['mjd', 'midnight', 'filter']
         types = ['float', 'float', '|S1']
         perfilter = np.zeros((good.size), dtype=list(zip(names, types)))
-        perfilter['mjd'] = dataSlice['expMJD'][good]
-        perfilter['filter'] = dataSlice['filter'][good]
-        for i, mjd in enumerate(perfilter['mjd']):
-            mjd = mjd - doff
-            perfilter['midnight'][i] = nearestVal([lsstObs.previous_antitransit(S, start=mjd),
-                                                   lsstObs.next_antitransit(S, start=mjd)], mjd)+doff
+        perfilter['mjd'] = dataSlice[self.mjdcol][good]
+        perfilter['filter'] = dataSlice[self.filtercol][good]
+        perfilter['midnight'] = self.almanac.getNights(perfilter['mjd'])['midnight']
 
         return {'pernight': pernight, 'perfilter': perfilter}
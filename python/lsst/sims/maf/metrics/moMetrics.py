@@ -88,6 +88,57 @@ class BaseMoMetric(BaseMetric):
         """
         raise NotImplementedError
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        """Calculate the metric value for all of the H values at once, if the metric supports this.
+
+        Parameters
+        ----------
+        ssoObs: np.ndarray
+            The input data to the metric (without the H-dependent columns filled).
+        orb: np.ndarray
+            The information about the orbit for which the metric is being calculated.
+        Hvals : np.ndarray
+            The H values for which the metric is being calculated.
+        Hcols : dict
+            The values of the H-dependent columns (such as appMag, SNR and vis), as (nH x nObs) arrays.
+
+        Returns
+        -------
+        list or np.ndarray or None
+            The metric value for each H value, or None if the metric must be run for each H value separately.
+        """
+        return None
+
+    def _visH(self, Hcols):
+        """Return the (nH x nObs) mask of the observations which are visible at each H value,
+        or None if this cannot be found from Hcols."""
+        snrLimit = getattr(self, 'snrLimit', None)
+        if snrLimit is not None:
+            if self.snrCol not in Hcols:
+                return None
+            return Hcols[self.snrCol] >= snrLimit
+        if self.visCol not in Hcols:
+            return None
+        return Hcols[self.visCol] > 0
+
+    def _nightCountsH(self, ssoObs, visH):
+        """Return the number of visible observations on each night (with any observations), at each H value."""
+        nights = ssoObs[self.nightCol]
+        order = np.argsort(nights, kind='mergesort')
+        sortedNights = nights[order]
+        starts = np.where(np.concatenate([[True], sortedNights[1:] != sortedNights[:-1]]))[0]
+        return np.add.reduceat(visH[:, order].astype(int), starts, axis=1)
+
+    def _visSorted(self, ssoObs):
+        """Return the indexes of the visible observations in ssoObs (with SNR above snrLimit if set,
+        otherwise with vis > 0), in time order."""
+        snrLimit = getattr(self, 'snrLimit', None)
+        if snrLimit is not None:
+            vis = np.where(ssoObs[self.snrCol] >= snrLimit)[0]
+        else:
+            vis = np.where(ssoObs[self.visCol] > 0)[0]
+        return vis[np.argsort(ssoObs[self.expMJDCol][vis])]
+
 
 class BaseChildMetric(BaseMoMetric):
     """Base class for child metrics.
@@ -129,6 +180,16 @@ class BaseChildMetric(BaseMoMetric):
         """
         raise NotImplementedError
 
+    def _visIdx(self, ssoObs, metricValues):
+        """Return the indexes of the visible observations in ssoObs, in time order.
+
+        The parent DiscoveryMetric shares these in metricValues['visIdx']; they are only
+        recalculated if they are not available (such as for metric values read from disk).
+        """
+        if 'visIdx' in metricValues:
+            return metricValues['visIdx']
+        return self._visSorted(ssoObs)
+
 
 class NObsMetric(BaseMoMetric):
     """Count the total number of observations where an SS object was 'visible'.
@@ -150,6 +211,12 @@ class NObsMetric(BaseMoMetric):
             vis = np.where(ssoObs[self.visCol] > 0)[0]
             return vis.size
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(Hcols)
+        if visH is None:
+            return None
+        return visH.sum(axis=1)
+
 
 class NObsNoSinglesMetric(BaseMoMetric):
     """Count the number of observations for an SS object, but not if it was a single observation on a night.
@@ -172,6 +239,13 @@ class NObsNoSinglesMetric(BaseMoMetric):
         nobs = ncounts[np.where(ncounts > 1)].sum()
         return nobs
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(Hcols)
+        if visH is None:
+            return None
+        ncounts = self._nightCountsH(ssoObs, visH)
+        return np.where(ncounts > 1, ncounts, 0).sum(axis=1)
+
 
 class NNightsMetric(BaseMoMetric):
     """Count the number of distinct nights an SS object is observed.
@@ -195,6 +269,12 @@ class NNightsMetric(BaseMoMetric):
         nights = len(np.unique(ssoObs[self.nightCol][vis]))
         return nights
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(Hcols)
+        if visH is None:
+            return None
+        return (self._nightCountsH(ssoObs, visH) > 0).sum(axis=1)
+
 
 class ObsArcMetric(BaseMoMetric):
     """Calculate the time difference between the first and last observation of an SS object.
@@ -214,6 +294,15 @@ class ObsArcMetric(BaseMoMetric):
         arc = ssoObs[self.expMJDCol][vis].max() - ssoObs[self.expMJDCol][vis].min()
         return arc
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(Hcols)
+        if visH is None:
+            return None
+        times = ssoObs[self.expMJDCol]
+        tMax = np.where(visH, times, -np.inf).max(axis=1)
+        tMin = np.where(visH, times, np.inf).min(axis=1)
+        return np.where(visH.any(axis=1), tMax - tMin, 0)
+
 
 class DiscoveryMetric(BaseMoMetric):
     """Identify the discovery opportunities for an SS object.
@@ -247,67 +336,85 @@ class DiscoveryMetric(BaseMoMetric):
         self.tMax = tMax
         self.nNightsPerWindow = nNightsPerWindow
         self.tWindow = tWindow
+        # Store the metric values compactly (see RaggedMetricValues), rather than as a dictionary per value.
+        self.raggedCols = [('start', 'int32'), ('end', 'int32'), ('trackletNights', 'float')]
 
     def run(self, ssoObs, orb, Hval):
         if self.snrLimit is not None:
             vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
         else:
             vis = np.where(ssoObs[self.visCol] > 0)[0]
+        return self._discoveries(ssoObs, vis)
+
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(Hcols)
+        if visH is None:
+            return None
+        # The visible observations only change at some H values (they shrink as H gets fainter),
+        # so only recalculate the discovery opportunities when the visible observations change.
+        results = []
+        for j, visMask in enumerate(visH):
+            if j > 0 and np.array_equal(visMask, visH[j - 1]):
+                results.append(results[-1])
+            else:
+                results.append(self._discoveries(ssoObs, np.where(visMask)[0]))
+        return results
+
+    def _discoveries(self, ssoObs, vis):
         if len(vis) == 0:
             return self.badval
-        # Identify discovery opportunities.
-        #  Identify visits where the 'night' changes.
+        # Sort the visible observations in time once; all of the indexes below refer to these sorted values.
         visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        nights = ssoObs[self.nightCol][vis][visSort]
+        visIdx = vis[visSort]
+        times = ssoObs[self.expMJDCol][visIdx]
+        nights = ssoObs[self.nightCol][visIdx]
+        # Identify discovery opportunities.
+        #  Find the first and last index of each night, and the nights with at least nObsPerNight.
         n = np.unique(nights)
-        # Identify all the indexes where the night changes in value.
         nIdx = np.searchsorted(nights, n)
-        # Count the number of observations per night (except last night)
-        obsPerNight = (nIdx - np.roll(nIdx, 1))[1:]
-        # Add the number of observations on the last night.
-        obsLastNight = np.array([len(nights) - nIdx[-1]])
-        obsPerNight = np.concatenate((obsPerNight, obsLastNight))
-        # Find the nights with more than nObsPerNight.
-        nWithXObs = n[np.where(obsPerNight >= self.nObsPerNight)]
-        nIdxMany = np.searchsorted(nights, nWithXObs)
-        nIdxManyEnd = np.searchsorted(nights, nWithXObs, side='right') - 1
+        nIdxEnd = np.searchsorted(nights, n, side='right')
+        many = (nIdxEnd - nIdx) >= self.nObsPerNight
+        nIdxMany = nIdx[many]
+        nIdxManyEnd = nIdxEnd[many] - 1
         # Check that nObsPerNight observations are within tMin/tMax
-        timesStart = ssoObs[self.expMJDCol][vis][visSort][nIdxMany]
-        timesEnd = ssoObs[self.expMJDCol][vis][visSort][nIdxManyEnd]
+        dtimes = times[nIdxManyEnd] - times[nIdxMany]
         # Identify the nights with 'clearly good' observations.
-        good = np.where((timesEnd - timesStart >= self.tMin) & (timesEnd - timesStart <= self.tMax), 1, 0)
+        good = (dtimes >= self.tMin) & (dtimes <= self.tMax)
         # Identify the nights where we need more investigation
         # (a subset of the visits may be within the interval).
-        check = np.where((good == 0) &
-                         (nIdxManyEnd + 1 - nIdxMany > self.nObsPerNight) &
-                         (timesEnd-timesStart > self.tMax))[0]
-        for i, j, c in zip(visSort[nIdxMany][check], visSort[nIdxManyEnd][check], check):
-            t = ssoObs[self.expMJDCol][vis][visSort][i:j + 1]
-            dtimes = (np.roll(t, 1 - self.nObsPerNight) - t)[:-1]
-            tidx = np.where((dtimes >= self.tMin) & (dtimes <= self.tMax))[0]
-            if len(tidx) > 0:
-                good[c] = 1
+        check = np.where(~good & (nIdxManyEnd + 1 - nIdxMany > self.nObsPerNight) & (dtimes > self.tMax))[0]
+        if len(check) > 0:
+            good[check[self._checkTracklets(times, visSort[nIdxMany][check], visSort[nIdxManyEnd][check])]] = True
         # 'good' provides mask for observations which could count as 'good to make tracklets'
         #   (mask on ssoObs[visSort][nIdxMany])
         # Now identify tracklets which can make tracks.
-        goodIdx = visSort[nIdxMany][good == 1]
-        goodIdxEnds = visSort[nIdxManyEnd][good == 1]
+        goodIdx = visSort[nIdxMany][good]
+        goodIdxEnds = visSort[nIdxManyEnd][good]
         if len(goodIdx) < self.nNightsPerWindow:
             return self.badval
-        deltaNights = np.roll(ssoObs[self.nightCol][vis][goodIdx], 1 - self.nNightsPerWindow) - \
-                      ssoObs[self.nightCol][vis][goodIdx]
-        # Identify the index in ssoObs[vis][goodIdx] where the discovery opportunity starts.
+        trackletNights = nights[nIdxMany][good]
+        deltaNights = np.roll(trackletNights, 1 - self.nNightsPerWindow) - trackletNights
+        # Identify the index in trackletNights where the discovery opportunity starts.
         startIdxs = np.where((deltaNights >= 0) & (deltaNights <= self.tWindow))[0]
-        # Identify the index where the discovery opportunity ends.
-        endIdxs = np.zeros(len(startIdxs), dtype='int')
-        for i, sIdx in enumerate(startIdxs):
-            inWindow = np.where(ssoObs[self.nightCol][vis][goodIdx] -
-                                ssoObs[self.nightCol][vis][goodIdx][sIdx] <= self.tWindow)[0]
-            endIdxs[i] = np.array([inWindow.max()])
+        # Identify the index where the discovery opportunity ends (the last tracklet within tWindow).
+        endIdxs = np.searchsorted(trackletNights, trackletNights[startIdxs] + self.tWindow, side='right') - 1
         # Convert back to index based on ssoObs[vis] (sorted by expMJD).
         startIdxs = goodIdx[startIdxs]
         endIdxs = goodIdxEnds[endIdxs]
-        return {'start': startIdxs, 'end': endIdxs, 'trackletNights': ssoObs[self.nightCol][vis][goodIdx]}
+        return {'start': startIdxs, 'end': endIdxs, 'trackletNights': trackletNights, 'visIdx': visIdx}
+
+    def _checkTracklets(self, times, starts, ends):
+        """Return a mask of the nights (from times[start:end + 1] for each start, end) which
+        include any nObsPerNight consecutive observations within tMin/tMax of each other."""
+        lengths = np.maximum(ends + 1 - starts, 0)
+        nPairs = np.maximum(lengths - 1, 0)
+        night = np.repeat(np.arange(len(starts)), nPairs)
+        # The position of each observation within its night.
+        k = np.arange(nPairs.sum()) - np.repeat(np.cumsum(nPairs) - nPairs, nPairs)
+        # Time between each observation and the observation nObsPerNight - 1 later (wrapping within the night).
+        dtimes = times[starts[night] + (k + self.nObsPerNight - 1) % lengths[night]] - times[starts[night] + k]
+        inInterval = (dtimes >= self.tMin) & (dtimes <= self.tMax)
+        return np.bincount(night[inInterval], minlength=len(starts)) > 0
 
 
 class Discovery_N_ChancesMetric(BaseChildMetric):
@@ -334,14 +441,10 @@ class Discovery_N_ChancesMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         """Return the number of different discovery chances we had for each object/H combination.
         """
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        visIdx = self._visIdx(ssoObs, metricValues)
+        if len(visIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        nights = ssoObs[self.nightCol][vis][visSort]
+        nights = ssoObs[self.nightCol][visIdx]
         startNights = nights[metricValues['start']]
         endNights = nights[metricValues['end']]
         if self.nightEnd is None:
@@ -382,16 +485,11 @@ class Discovery_TimeMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i >= len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        visIdx = self._visIdx(ssoObs, metricValues)
+        if len(visIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        times = ssoObs[self.expMJDCol][vis][visSort]
         startIdx = metricValues['start'][self.i]
-        tDisc = times[startIdx]
+        tDisc = ssoObs[self.expMJDCol][visIdx[startIdx]]
         if self.tStart is not None:
             tDisc = tDisc - self.tStart
         return tDisc
@@ -410,17 +508,11 @@ class Discovery_RADecMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i >= len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        visIdx = self._visIdx(ssoObs, metricValues)
+        if len(visIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        ra = ssoObs[self.raCol][vis][visSort]
-        dec = ssoObs[self.decCol][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return (ra[startIdx], dec[startIdx])
+        obsIdx = visIdx[metricValues['start'][self.i]]
+        return (ssoObs[self.raCol][obsIdx], ssoObs[self.decCol][obsIdx])
 
 
 class Discovery_EcLonLatMetric(BaseChildMetric):
@@ -436,18 +528,11 @@ class Discovery_EcLonLatMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i >= len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        visIdx = self._visIdx(ssoObs, metricValues)
+        if len(visIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        ecLon = ssoObs['ecLon'][vis][visSort]
-        ecLat = ssoObs['ecLat'][vis][visSort]
-        solarElong = ssoObs['solarElong'][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return (ecLon[startIdx], ecLat[startIdx], solarElong[startIdx])
+        obsIdx = visIdx[metricValues['start'][self.i]]
+        return (ssoObs['ecLon'][obsIdx], ssoObs['ecLat'][obsIdx], ssoObs['solarElong'][obsIdx])
 
 
 class Discovery_VelocityMetric(BaseChildMetric):
@@ -461,16 +546,10 @@ class Discovery_VelocityMetric(BaseChildMetric):
     def run(self, ssoObs, orb, Hval, metricValues):
         if self.i >= len(metricValues['start']):
             return self.badval
-        if self.snrLimit is not None:
-            vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
-        else:
-            vis = np.where(ssoObs[self.visCol] > 0)[0]
-        if len(vis) == 0:
+        visIdx = self._visIdx(ssoObs, metricValues)
+        if len(visIdx) == 0:
             return self.badval
-        visSort = np.argsort(ssoObs[self.expMJDCol][vis])
-        velocity = ssoObs['velocity'][vis][visSort]
-        startIdx = metricValues['start'][self.i]
-        return velocity[startIdx]
+        return ssoObs['velocity'][visIdx[metricValues['start'][self.i]]]
 
 
 class ActivityOverTimeMetric(BaseMoMetric):
@@ -1,9 +1,10 @@
 import numpy as np
+import numpy.ma as ma
 import warnings
 
 from .moMetrics import BaseMoMetric
 
-__all__ = ['integrateOverH', 'ValueAtHMetric', 'MeanValueAtHMetric',
+__all__ = ['integrateOverH', 'completenessH', 'completenessAtTime', 'ValueAtHMetric', 'MeanValueAtHMetric',
            'MoCompletenessMetric', 'MoCompletenessAtTimeMetric']
 
 
@@ -13,9 +14,10 @@ def integrateOverH(Mvalues, Hvalues, Hindex = 0.3):
     Parameters
     ----------
     Mvalues : numpy.ndarray
-        The metric values at each H value.
+        The metric values at each H value. If Mvalues has more than one dimension, each set of
+        metric values along the last axis is integrated.
     Hvalues : numpy.ndarray
-        The H values corresponding to each Mvalue (must be the same length).
+        The H values corresponding to each Mvalue (must be the same length as the last axis of Mvalues).
     Hindex : float, opt
         The power-law index expected for the H value distribution.
         Default is 0.3  (dN/dH = 10^(Hindex * H) ).
@@ -30,10 +32,82 @@ def integrateOverH(Mvalues, Hvalues, Hindex = 0.3):
     # dndh = differential size distribution (number in this bin)
     dndh = np.power(10., Hindex*(Hvalues-Hvalues.min()))
     # dn = cumulative size distribution (number in this bin and brighter)
-    intVals = np.cumsum(Mvalues*dndh)/np.cumsum(dndh)
+    intVals = np.cumsum(Mvalues*dndh, axis=-1)/np.cumsum(dndh)
     return intVals
 
 
+def completenessH(discoveryChances, Hvalues, requiredChances=1, Hindex=0.3):
+    """Calculate the differential and cumulative completeness at each H value, from the number of
+    discovery chances of each object (for a cloned H distribution).
+
+    The discovery chances of many metric bundles can be stacked, to calculate their completeness at once.
+
+    Parameters
+    ----------
+    discoveryChances : numpy.ndarray or numpy.ma.MaskedArray
+        The number of discovery chances of each object at each H value (nSso x nH),
+        or a stack of these (nBundles x nSso x nH). Masked values count as zero discovery chances.
+    Hvalues : numpy.ndarray
+        The H values corresponding to the last axis of discoveryChances.
+    requiredChances : int, opt
+        Require at least this many discovery opportunities before counting the object as 'found'. Default = 1.
+    Hindex : float, opt
+        The power-law index used to integrate the cumulative completeness over H. Default 0.3.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The differential (@ H) and cumulative (<= H) completeness, with shape nH (or nBundles x nH).
+    """
+    chances = ma.filled(discoveryChances, 0)
+    nSsos = chances.shape[-2]
+    differential = np.count_nonzero(chances >= requiredChances, axis=-2) / float(nSsos)
+    return differential, integrateOverH(differential, Hvalues, Hindex)
+
+
+def completenessAtTime(discoveryTimes, Hvalues, times, Hindex=0.3):
+    """Calculate the differential and cumulative completeness at each H value as a function of time,
+    from the discovery time of each object (for a cloned H distribution).
+
+    The discovery times of many metric bundles can be stacked, to calculate their completeness at once.
+
+    Parameters
+    ----------
+    discoveryTimes : numpy.ndarray or numpy.ma.MaskedArray
+        The discovery time of each object at each H value (nSso x nH), or a stack of these
+        (nBundles x nSso x nH). Masked values (objects which were not discovered) are not counted.
+    Hvalues : numpy.ndarray
+        The H values corresponding to the last axis of discoveryTimes.
+    times : numpy.ndarray
+        The times at which to evaluate the completeness (the completeness at times[i] counts the
+        discoveries between times[0] and times[i], binned as np.histogram).
+    Hindex : float, opt
+        The power-law index used to integrate the cumulative completeness over H. Default 0.3.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The differential (@ H) and cumulative (<= H) completeness, with shape nTimes x nH
+        (or nBundles x nTimes x nH).
+    """
+    times = np.asarray(times, dtype=float)
+    discTimes = np.asarray(ma.filled(discoveryTimes, np.nan), dtype=float)
+    nSsos, nH = discTimes.shape[-2:]
+    nTimes = len(times)
+    discTimes = discTimes.reshape(-1, nSsos, nH)
+    nStack = discTimes.shape[0]
+    # Find the bin of each discovery time (as np.histogram, the last bin includes times[-1]).
+    inRange = (discTimes >= times[0]) & (discTimes <= times[-1])
+    timeIdx = np.clip(np.searchsorted(times, discTimes, side='right') - 1, 0, nTimes - 2)
+    # Count the discoveries in each (stack, time bin, H value) with a single bincount.
+    flatIdx = (np.arange(nStack)[:, np.newaxis, np.newaxis] * nTimes + timeIdx) * nH + np.arange(nH)
+    counts = np.bincount(flatIdx[inRange], minlength=nStack * nTimes * nH).reshape(nStack, nTimes, nH)
+    differential = np.zeros((nStack, nTimes, nH), float)
+    differential[:, 1:] = np.cumsum(counts[:, :-1], axis=1) / float(nSsos)
+    differential = differential.reshape(np.shape(discoveryTimes)[:-2] + (nTimes, nH))
+    return differential, integrateOverH(differential, Hvalues, Hindex)
+
+
 class ValueAtHMetric(BaseMoMetric):
     """Return the metric value at a given H value.
 
@@ -142,37 +216,52 @@ class MoCompletenessMetric(BaseMoMetric):
     def run(self, discoveryChances, Hvals):
         nSsos = discoveryChances.shape[0]
         nHval = len(Hvals)
-        discoveriesH = discoveryChances.swapaxes(0, 1)
         if nHval == discoveryChances.shape[1]:
             # Hvals array is probably the same as the cloned H array.
-            completeness = np.zeros(len(Hvals), float)
-            for i, H in enumerate(Hvals):
-                completeness[i] = np.where(discoveriesH[i].filled(0) >= self.requiredChances)[0].size
-            completeness = completeness / float(nSsos)
-        else:
-            # The Hvals are spread more randomly among the objects (we probably used one per object).
-            hrange = Hvals.max() - Hvals.min()
-            minH = Hvals.min()
-            if hrange < self.minHrange:
-                hrange = self.minHrange
-                minH = Hvals.min() - hrange/2.0
-            stepsize = hrange / float(self.nbins)
-            bins = np.arange(minH, minH + hrange + stepsize/2.0, stepsize)
-            Hvals = bins[:-1]
-            n_all, b = np.histogram(discoveriesH[0], bins)
-            condition = np.where(discoveriesH[0] >= self.requiredChances)[0]
-            n_found, b = np.histogram(discoveriesH[0][condition], bins)
-            completeness = n_found.astype(float) / n_all.astype(float)
-            completeness = np.where(n_all == 0, 0, completeness)
+            differential, cumulative = completenessH(discoveryChances, Hvals, self.requiredChances, self.Hindex)
+            return self.summarize(differential, cumulative, Hvals)
+        # The Hvals are spread more randomly among the objects (we probably used one per object).
+        discoveriesH = discoveryChances.swapaxes(0, 1)
+        hrange = Hvals.max() - Hvals.min()
+        minH = Hvals.min()
+        if hrange < self.minHrange:
+            hrange = self.minHrange
+            minH = Hvals.min() - hrange/2.0
+        stepsize = hrange / float(self.nbins)
+        bins = np.arange(minH, minH + hrange + stepsize/2.0, stepsize)
+        Hvals = bins[:-1]
+        n_all, b = np.histogram(discoveriesH[0], bins)
+        condition = np.where(discoveriesH[0] >= self.requiredChances)[0]
+        n_found, b = np.histogram(discoveriesH[0][condition], bins)
+        completeness = n_found.astype(float) / n_all.astype(float)
+        completeness = np.where(n_all == 0, 0, completeness)
+        return self.summarize(completeness, integrateOverH(completeness, Hvals, self.Hindex), Hvals)
+
+    def summarize(self, differential, cumulative, Hvals):
+        """Return the summary value, given the differential and cumulative completeness at each H value.
+
+        Parameters
+        ----------
+        differential : numpy.ndarray
+            The differential completeness at each H value (as from completenessH).
+        cumulative : numpy.ndarray
+            The cumulative completeness at each H value (as from completenessH).
+        Hvals : numpy.ndarray
+            The H values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Structured array of the (name, value) of the completeness at each H value.
+        """
         if self.cumulative:
-            completenessInt = integrateOverH(completeness, Hvals, self.Hindex)
-            summaryVal = np.empty(len(completenessInt), dtype=[('name', '|S20'), ('value', float)])
-            summaryVal['value'] = completenessInt
+            summaryVal = np.empty(len(cumulative), dtype=[('name', '|S20'), ('value', float)])
+            summaryVal['value'] = cumulative
             for i, Hval in enumerate(Hvals):
                 summaryVal['name'][i] = 'H <= %f' % (Hval)
         else:
-            summaryVal = np.empty(len(completeness), dtype=[('name', '|S20'), ('value', float)])
-            summaryVal['value'] = completeness
+            summaryVal = np.empty(len(differential), dtype=[('name', '|S20'), ('value', float)])
+            summaryVal['value'] = differential
             for i, Hval in enumerate(Hvals):
                 summaryVal['name'][i] = 'H = %f' % (Hval)
         return summaryVal
@@ -225,20 +314,33 @@ class MoCompletenessAtTimeMetric(BaseMoMetric):
         if len(Hvals) != discoveryTimes.shape[1]:
             warnings.warn("This summary metric expects cloned H distribution. Cannot calculate summary.")
             return
-        nSsos = discoveryTimes.shape[0]
-        timesinH = discoveryTimes.swapaxes(0, 1)
-        completenessH = np.empty([len(Hvals), len(self.times)], float)
-        for i, H in enumerate(Hvals):
-            n, b = np.histogram(timesinH[i], bins=self.times)
-            completenessH[i][0] = 0
-            completenessH[i][1:] = n.cumsum()
-        completenessH = completenessH / float(nSsos)
-        completeness = completenessH.swapaxes(0, 1)
+        differential, cumulative = completenessAtTime(discoveryTimes, Hvals, self.times, self.Hindex)
+        return self.summarize(differential, cumulative, Hvals)
+
+    def summarize(self, differential, cumulative, Hvals):
+        """Return the summary value, given the differential and cumulative completeness at each time and H.
+
+        Parameters
+        ----------
+        differential : numpy.ndarray
+            The differential completeness at each time and H value (as from completenessAtTime).
+        cumulative : numpy.ndarray
+            The cumulative completeness at each time and H value (as from completenessAtTime).
+        Hvals : numpy.ndarray
+            The H values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Structured array of the (name, value) of the completeness at Hval, at each time.
+        """
         if self.cumulative:
-            for i, t in enumerate(self.times):
-                completeness[i] = integrateOverH(completeness[i], Hvals)
+            completeness = cumulative
+        else:
+            completeness = differential
         summaryVal = np.empty(len(completeness), dtype=[('name', '|S20'), ('value', float)])
-        summaryVal['value'] = completeness
+        # Interpolate to the completeness at Hval, at each time.
+        summaryVal['value'] = [np.interp(self.Hval, Hvals, c) for c in completeness]
         for i, time in enumerate(self.times):
             summaryVal['name'][i] = '%s @ %.2f' % (self.units, time)
         return summaryVal
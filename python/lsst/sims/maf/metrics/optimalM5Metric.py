@@ -66,8 +66,8 @@ class OptimalM5Metric(BaseMetric):
         if np.size(filters) > 1:
             warnings.warn("OptimalM5Metric does not make sense mixing filters. Currently using filters " +
                           str(filters))
-        regularDepth = self.coaddRegular.run(dataSlice)
-        optimalDepth = self.coaddOptimal.run(dataSlice)
+        regularDepth = self.coaddRegular.run(dataSlice, slicePoint)
+        optimalDepth = self.coaddOptimal.run(dataSlice, slicePoint)
         if self.magDiff:
             return optimalDepth-regularDepth
 
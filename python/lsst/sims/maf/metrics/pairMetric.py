@@ -2,6 +2,7 @@ __all__ = ['PairMetric']
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 
 
 class PairMetric(BaseMetric):
@@ -25,12 +26,13 @@ class PairMetric(BaseMetric):
         self.match_max = match_max / 60. / 24.
         super(PairMetric, self).__init__(col=mjdCol, metricName=metricName,
                                          units='N Pairs', **kwargs)
+        self.requiresSorted = self.mjdCol
 
     def run(self, dataSlice, slicePoint=None):
-        bins = np.arange(dataSlice[self.mjdCol].min(),
-                         dataSlice[self.mjdCol].max() + self.binsize, self.binsize)
+        times = getSliceContext(dataSlice, slicePoint).sortedCol(self.mjdCol, self.mjdCol)
+        bins = np.arange(times[0], times[-1] + self.binsize, self.binsize)
 
-        hist, bin_edges = np.histogram(dataSlice[self.mjdCol], bins=bins)
+        hist, bin_edges = np.histogram(times, bins=bins)
         nbin_min = np.round(self.match_min / self.binsize)
         nbin_max = np.round(self.match_max / self.binsize)
         bins_to_check = np.arange(nbin_min, nbin_max+1, 1)
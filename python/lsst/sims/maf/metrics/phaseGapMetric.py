@@ -1,7 +1,37 @@
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import stackSlices
 
-__all__ = ['PhaseGapMetric']
+__all__ = ['PhaseGapMetric', 'phaseGaps']
+
+
+def phaseGaps(times, periods):
+    """Find the largest gap in phase coverage of times, folded at each of the periods.
+
+    All of the periods are folded at once, as a (periods x visits) array which is sorted along
+    the visits axis. times may also be 2-d (one row per slicepoint, all with the same number of
+    visits), in which case the result has one row per slicepoint.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The times of the visits (days). 1-d, or 2-d (slicepoints x visits).
+    periods : numpy.ndarray
+        The periods to fold the times at (days).
+
+    Returns
+    -------
+    numpy.ndarray
+        The largest phase gap (fraction of the period) for each period; shape (..., len(periods)).
+    """
+    times = np.asarray(times, dtype=float)
+    periods = np.asarray(periods, dtype=float)[:, np.newaxis]
+    phases = (times[..., np.newaxis, :] % periods) / periods
+    phases.sort(axis=-1)
+    # The largest gap is either between consecutive phases, or wrapping from the end to the start.
+    maxGap = np.diff(phases, axis=-1).max(axis=-1, initial=0.)
+    start_to_end = 1.0 - phases[..., -1] + phases[..., 0]
+    return np.maximum(maxGap, start_to_end)
 
 
 class PhaseGapMetric(BaseMetric):
@@ -30,6 +60,16 @@ class PhaseGapMetric(BaseMetric):
         self.nVisitsMin = nVisitsMin
         super(PhaseGapMetric, self).__init__(col, metricName=metricName, units='Fraction, 0-1', **kwargs)
 
+    def _periods(self):
+        # Create 'nPeriods' evenly spaced periods within range of min to max.
+        step = (self.periodMax - self.periodMin) / self.nPeriods
+        if step == 0:
+            periods = np.array([self.periodMin])
+        else:
+            periods = np.arange(self.nPeriods)
+            periods = periods / np.max(periods) * (self.periodMax - self.periodMin) + self.periodMin
+        return periods
+
     def run(self, dataSlice, slicePoint=None):
         """Run the PhaseGapMetric.
 
@@ -39,26 +79,30 @@ class PhaseGapMetric(BaseMetric):
         """
         if len(dataSlice) < self.nVisitsMin:
             return self.badval
-        # Create 'nPeriods' evenly spaced periods within range of min to max.
-        step = (self.periodMax - self.periodMin) / self.nPeriods
-        if step == 0:
-            periods = np.array([self.periodMin])
-        else:
-            periods = np.arange(self.nPeriods)
-            periods = periods / np.max(periods) * (self.periodMax - self.periodMin) + self.periodMin
+        periods = self._periods()
         maxGap = np.zeros(self.nPeriods, float)
+        maxGap[:len(periods)] = phaseGaps(dataSlice[self.colname], periods)
+        return {'periods': periods, 'maxGaps': maxGap}
 
-        for i, period in enumerate(periods):
-            # For each period, calculate the phases.
-            phases = (dataSlice[self.colname] % period) / period
-            phases = np.sort(phases)
-            # Find the largest gap in coverage.
-            gaps = np.diff(phases)
-            start_to_end = np.array([1.0 - phases[-1] + phases[0]], float)
-            gaps = np.concatenate([gaps, start_to_end])
-            maxGap[i] = np.max(gaps)
+    def runMany(self, dataSlices):
+        """Run the PhaseGapMetric on many dataSlices at once.
 
-        return {'periods': periods, 'maxGaps': maxGap}
+        The dataSlices with the same number of visits are folded together, in a single call to phaseGaps.
+
+        :param dataSlices: List of the data for each slice.
+        :return: a list of the metric values (as returned by run) for each dataSlice.
+        """
+        periods = self._periods()
+        results = [self.badval] * len(dataSlices)
+        for indexes, times in stackSlices(dataSlices, self.colname):
+            if times.shape[1] < self.nVisitsMin:
+                continue
+            maxGaps = phaseGaps(times, periods)
+            for i, gaps in zip(indexes, maxGaps):
+                maxGap = np.zeros(self.nPeriods, float)
+                maxGap[:len(periods)] = gaps
+                results[i] = {'periods': periods, 'maxGaps': maxGap}
+        return results
 
     def reduceMeanGap(self, metricVal):
         """At each slicepoint, return the mean gap value.
@@ -7,6 +7,7 @@ __all__ = ['PassMetric', 'Coaddm5Metric', 'MaxMetric', 'MeanMetric', 'MedianMetr
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 
 
 # A collection of commonly used simple metrics, operating on a single column and returning a float.
@@ -37,7 +38,8 @@ class Coaddm5Metric(BaseMetric):
         super(Coaddm5Metric, self).__init__(col=m5Col, metricName=metricName, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        return 1.25 * np.log10(np.sum(10.**(.8*dataSlice[self.colname])))
+        # The summed flux is shared with the other coadded depth metrics at this slicePoint.
+        return 1.25 * np.log10(getSliceContext(dataSlice, slicePoint).coaddFlux(self.colname))
 
 
 class MaxMetric(BaseMetric):
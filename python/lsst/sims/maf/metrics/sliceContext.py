@@ -0,0 +1,313 @@
+from builtins import object
+import numpy as np
+
+__all__ = ['SliceContext', 'getSliceContext']
+
+
+class SliceContext(object):
+    """Memoize intermediate values derived from a single dataSlice.
+
+    Many metrics in a compatible list recompute the same quantities from the same dataSlice
+    (the visits sorted in time, the unique nights, the time between visits, etc.).
+    The MetricBundleGroup creates one SliceContext per slicePoint and passes it to each metric
+    in the slicePoint dictionary (under the key 'sliceContext'), so that these values are computed
+    only once per slicePoint rather than once per metric.
+
+    All of the order-dependent values returned by the SliceContext refer to the dataSlice sorted
+    on the requested time column. If the dataSlice is not already in that order, a sorted *copy* is
+    made (once), so metrics should use sortedSlice rather than sorting the dataSlice in place.
+
+    Parameters
+    ----------
+    dataSlice : numpy.ndarray
+        Numpy structured array containing the data related to the visits provided by the slicer.
+    sortedOn : str, optional
+        The column the dataSlice is already known to be sorted on (such as when the MetricBundleGroup
+        presorts simData), so that no check or sort is required for this column. This is only trusted
+        for a SliceContext without a parent: the order of a dataSlice taken from a slicer is always
+        checked (once), as the slicer may not return the indexes of each slice in increasing order.
+        Default None.
+    parent : SliceContext, optional
+        A SliceContext for the full simData that dataSlice was sliced from. Values computed once
+        over the full simData (such as the state change index) are shared through the parent
+        with every slicePoint whose data is a contiguous block of the sorted simData. Default None.
+    idxs : numpy.ndarray or list, optional
+        The indexes of dataSlice within the parent's data (as returned by the slicer). Default None.
+    incompleteCols : list of str, optional
+        Columns of dataSlice which are not yet calculated for every row (such as the columns of
+        deferred stackers, see StackerEngine). Values over the full data are not shared through this
+        SliceContext (as a parent) for these columns. Default None.
+    """
+    def __init__(self, dataSlice, sortedOn=None, parent=None, idxs=None, incompleteCols=None):
+        self.dataSlice = dataSlice
+        self.sortedOn = sortedOn
+        self.parent = parent
+        self.idxs = idxs
+        self.incompleteCols = set(incompleteCols) if incompleteCols is not None else set()
+        self._cache = {}
+
+    def memo(self, key, func, *args):
+        """Return the cached value for 'key', calculating it with func(*args) if needed.
+
+        Metrics can use this to share arbitrary intermediate values; the key should be
+        unique to the calculation (such as a tuple of a name and the columns used).
+
+        Parameters
+        ----------
+        key : hashable
+            The key identifying the value in the cache.
+        func : callable
+            The function used to calculate the value, if it is not already in the cache.
+
+        Returns
+        -------
+        object
+            The (possibly cached) value.
+        """
+        if key not in self._cache:
+            self._cache[key] = func(*args)
+        return self._cache[key]
+
+    def sortedSlice(self, timeCol='expMJD'):
+        """Return the dataSlice sorted (stably) on timeCol.
+
+        Parameters
+        ----------
+        timeCol : str, optional
+            The column to sort on. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        # Checking the order is much cheaper than sorting (and copying) the records.
+        if self.isSorted(timeCol):
+            return self.dataSlice
+
+        def _sort():
+            order = np.argsort(self.dataSlice[timeCol], kind='mergesort')
+            return self.dataSlice[order]
+        return self.memo(('sortedSlice', timeCol), _sort)
+
+    def isSorted(self, timeCol='expMJD'):
+        """Return True if the dataSlice is already sorted on timeCol.
+
+        Parameters
+        ----------
+        timeCol : str, optional
+            The column to check. Default expMJD.
+
+        Returns
+        -------
+        bool
+        """
+        if timeCol == self.sortedOn and self.parent is None:
+            return True
+
+        def _check():
+            times = self.dataSlice[timeCol]
+            return bool(np.all(times[1:] >= times[:-1]))
+        return self.memo(('isSorted', timeCol), _check)
+
+    def sortedCol(self, col, timeCol='expMJD'):
+        """Return the values of 'col' in timeCol order.
+
+        Parameters
+        ----------
+        col : str
+            The column to return.
+        timeCol : str, optional
+            The column to sort on. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        return self.sortedSlice(timeCol)[col]
+
+    def dtimes(self, timeCol='expMJD'):
+        """Return the time between consecutive visits (np.diff of the sorted times).
+
+        Parameters
+        ----------
+        timeCol : str, optional
+            The column containing the time of each visit. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        return self.memo(('dtimes', timeCol), lambda: np.diff(self.sortedCol(timeCol, timeCol)))
+
+    def unique(self, col):
+        """Return the unique values of 'col' (as np.unique).
+
+        Parameters
+        ----------
+        col : str
+            The column to find the unique values of.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        return self.memo(('unique', col), np.unique, self.dataSlice[col])
+
+    def nightBounds(self, nightCol='night', timeCol='expMJD'):
+        """Return the unique nights, and the first and last index of each night in the sorted dataSlice.
+
+        This assumes that nightCol increases monotonically with timeCol (as in opsim outputs).
+
+        Parameters
+        ----------
+        nightCol : str, optional
+            The column containing the night of each visit. Default night.
+        timeCol : str, optional
+            The column containing the time of each visit. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            The unique nights, the index of the first visit in each night and the index of the
+            last visit in each night (indexes refer to the timeCol-sorted dataSlice).
+        """
+        def _bounds():
+            nights = self.sortedCol(nightCol, timeCol)
+            unights = self.unique(nightCol)
+            firstOfNight = np.searchsorted(nights, unights)
+            lastOfNight = np.searchsorted(nights, unights, side='right') - 1
+            return unights, firstOfNight, lastOfNight
+        return self.memo(('nightBounds', nightCol, timeCol), _bounds)
+
+    def coaddFlux(self, m5Col='fiveSigmaDepth'):
+        """Return the summed flux (sum of 10**(0.8*m5)) of the visits.
+
+        The coadded m5 value is then 1.25 * log10(coaddFlux).
+
+        Parameters
+        ----------
+        m5Col : str, optional
+            The column containing the five sigma limiting depth of each visit. Default fiveSigmaDepth.
+
+        Returns
+        -------
+        float
+        """
+        return self.memo(('coaddFlux', m5Col), lambda: np.sum(10.**(.8*self.dataSlice[m5Col])))
+
+    def _parentSegment(self, timeCol):
+        """Return the (start, end) of dataSlice within the timeCol-sorted parent data, or None.
+
+        This is only possible if the parent data is sorted on timeCol and dataSlice is a contiguous,
+        increasing block of it (as for a OneDSlicer on night or a UniSlicer over presorted simData).
+        """
+        if self.parent is None or self.idxs is None or len(self.dataSlice) == 0:
+            return None
+        if not self.parent.isSorted(timeCol):
+            return None
+        idxs = np.asarray(self.idxs)
+        if idxs.dtype == bool:
+            if idxs.size == len(self.parent.dataSlice) and idxs.all():
+                return 0, idxs.size
+            return None
+        if idxs[-1] - idxs[0] != idxs.size - 1 or np.any(idxs[1:] <= idxs[:-1]):
+            return None
+        return idxs[0], idxs[-1] + 1
+
+    def stateChangeIndex(self, changeCol, timeCol='expMJD'):
+        """Return the positions (in the timeCol-sorted dataSlice) of the visits where changeCol changes.
+
+        Parameters
+        ----------
+        changeCol : str
+            The column which changes state (such as 'filter').
+        timeCol : str, optional
+            The column containing the time of each visit. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+            The index of each visit whose value of changeCol differs from the previous visit.
+        """
+        def _index():
+            values = self.sortedCol(changeCol, timeCol)
+            return np.where(values[1:] != values[:-1])[0] + 1
+        return self.memo(('stateChangeIndex', changeCol, timeCol), _index)
+
+    def stateChangeTimes(self, changeCol, timeCol='expMJD'):
+        """Return the times of the visits where changeCol changes state.
+
+        When this dataSlice is a contiguous block of sorted simData, the changes are looked up in
+        the state change index of the parent (calculated once for the full simData), rather than
+        being recalculated for each slicePoint. This is not done if changeCol is one of the
+        incompleteCols of the parent.
+
+        Parameters
+        ----------
+        changeCol : str
+            The column which changes state (such as 'filter').
+        timeCol : str, optional
+            The column containing the time of each visit. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+            The time of each visit whose value of changeCol differs from the previous visit.
+        """
+        def _times():
+            segment = self._parentSegment(timeCol)
+            if segment is None or changeCol in self.parent.incompleteCols:
+                return self.sortedCol(timeCol, timeCol)[self.stateChangeIndex(changeCol, timeCol)]
+            start, end = segment
+            changeIdx = self.parent.stateChangeIndex(changeCol, timeCol)
+            lo = np.searchsorted(changeIdx, start, side='right')
+            hi = np.searchsorted(changeIdx, end, side='left')
+            return self.parent.sortedCol(timeCol, timeCol)[changeIdx[lo:hi]]
+        return self.memo(('stateChangeTimes', changeCol, timeCol), _times)
+
+    def stateChangeDtimes(self, changeCol, timeCol='expMJD'):
+        """Return the time between successive changes of state in changeCol.
+
+        The first interval is measured from the first visit in the dataSlice.
+
+        Parameters
+        ----------
+        changeCol : str
+            The column which changes state (such as 'filter').
+        timeCol : str, optional
+            The column containing the time of each visit. Default expMJD.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        def _dtimes():
+            changetimes = self.stateChangeTimes(changeCol, timeCol)
+            prevchangetime = np.concatenate(([self.dataSlice[timeCol].min()], changetimes[:-1]))
+            return changetimes - prevchangetime
+        return self.memo(('stateChangeDtimes', changeCol, timeCol), _dtimes)
+
+
+def getSliceContext(dataSlice, slicePoint=None):
+    """Return the SliceContext for this dataSlice.
+
+    If the slicePoint carries a SliceContext built from this dataSlice, that is returned;
+    otherwise (such as when a metric is run directly on a dataSlice) a new SliceContext is created.
+
+    Parameters
+    ----------
+    dataSlice : numpy.ndarray
+        Numpy structured array containing the data related to the visits provided by the slicer.
+    slicePoint : dict, optional
+        Dictionary containing information about the slicepoint currently active in the slicer.
+
+    Returns
+    -------
+    SliceContext
+    """
+    if slicePoint is not None:
+        context = slicePoint.get('sliceContext')
+        if context is not None and context.dataSlice is dataSlice:
+            return context
+    return SliceContext(dataSlice)
+
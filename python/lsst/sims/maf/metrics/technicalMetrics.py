@@ -1,6 +1,8 @@
-from builtins import zip
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
+from lsst.sims.maf.utils import windowCounts
+from lsst.sims.maf.stackers.filterStackers import filterNames, filterIndex, filterLookup, getFilterIdx
 
 __all__ = ['NChangesMetric',
            'MinTimeBetweenStatesMetric', 'NStateChangesFasterThanMetric',
@@ -18,11 +20,10 @@ class NChangesMetric(BaseMetric):
         self.col = col
         self.orderBy = orderBy
         super(NChangesMetric, self).__init__(col=[col, orderBy], units='#', **kwargs)
+        self.requiresSorted = self.orderBy
 
     def run(self, dataSlice, slicePoint=None):
-        idxs = np.argsort(dataSlice[self.orderBy])
-        diff = (dataSlice[self.col][idxs][1:] != dataSlice[self.col][idxs][:-1])
-        return np.size(np.where(diff == True)[0])
+        return getSliceContext(dataSlice, slicePoint).stateChangeTimes(self.col, self.orderBy).size
 
 
 class MinTimeBetweenStatesMetric(BaseMetric):
@@ -42,17 +43,12 @@ class MinTimeBetweenStatesMetric(BaseMetric):
             metricName = 'Minimum time between %s changes minutes' % (changeCol)
         super(MinTimeBetweenStatesMetric, self).__init__(col=[changeCol, timeCol], metricName=metricName,
                                                          units='minutes', **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
-        # Sort on time, to be sure we've got filter (or other col) changes in the right order.
-        idxs = np.argsort(dataSlice[self.timeCol])
-        changes = (dataSlice[self.changeCol][idxs][1:] != dataSlice[self.changeCol][idxs][:-1])
-        condition = np.where(changes == True)[0]
-        changetimes = dataSlice[self.timeCol][idxs][1:][condition]
-        prevchangetime = np.concatenate((np.array([dataSlice[self.timeCol][idxs][0]]),
-                                         dataSlice[self.timeCol][idxs][1:][condition][:-1]))
-        dtimes = changetimes - prevchangetime
-        dtimes *= 24*60
+        # The state changes are found (in time order) once per slicePoint and shared between metrics.
+        dtimes = getSliceContext(dataSlice, slicePoint).stateChangeDtimes(self.changeCol, self.timeCol)
+        dtimes = dtimes * 24 * 60
         if dtimes.size == 0:
             return self.badval
         return dtimes.min()
@@ -77,16 +73,11 @@ class NStateChangesFasterThanMetric(BaseMetric):
         self.cutoff = cutoff/24.0/60.0  # Convert cutoff from minutes to days.
         super(NStateChangesFasterThanMetric, self).__init__(col=[changeCol, timeCol],
                                                             metricName=metricName, units='#', **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
-        # Sort on time, to be sure we've got filter (or other col) changes in the right order.
-        idxs = np.argsort(dataSlice[self.timeCol])
-        changes = (dataSlice[self.changeCol][idxs][1:] != dataSlice[self.changeCol][idxs][:-1])
-        condition = np.where(changes == True)[0]
-        changetimes = dataSlice[self.timeCol][idxs][1:][condition]
-        prevchangetime = np.concatenate((np.array([dataSlice[self.timeCol][idxs][0]]),
-                                         dataSlice[self.timeCol][idxs][1:][condition][:-1]))
-        dtimes = changetimes - prevchangetime
+        # The state changes are found (in time order) once per slicePoint and shared between metrics.
+        dtimes = getSliceContext(dataSlice, slicePoint).stateChangeDtimes(self.changeCol, self.timeCol)
         return np.where(dtimes < self.cutoff)[0].size
 
 
@@ -109,6 +100,7 @@ class MaxStateChangesWithinMetric(BaseMetric):
         self.timespan = timespan/24./60.  # Convert timespan from minutes to days.
         super(MaxStateChangesWithinMetric, self).__init__(col=[changeCol, timeCol],
                                                           metricName=metricName, units='#', **kwargs)
+        self.requiresSorted = self.timeCol
 
     def run(self, dataSlice, slicePoint=None):
         # This operates slightly differently from the metrics above; those calculate only successive times
@@ -116,19 +108,13 @@ class MaxStateChangesWithinMetric(BaseMetric):
         # Check if there was only one observation (and return 0 if so).
         if dataSlice[self.changeCol].size == 1:
             return 0
-        # Sort on time, to be sure we've got filter (or other col) changes in the right order.
-        idxs = np.argsort(dataSlice[self.timeCol])
-        changes = (dataSlice[self.changeCol][idxs][:-1] != dataSlice[self.changeCol][idxs][1:])
-        condition = np.where(changes == True)[0]
-        changetimes = dataSlice[self.timeCol][idxs][1:][condition]
+        # The state changes are found (in time order) once per slicePoint and shared between metrics.
+        changetimes = getSliceContext(dataSlice, slicePoint).stateChangeTimes(self.changeCol, self.timeCol)
         # If there are 0 filter changes ...
         if changetimes.size == 0:
             return 0
         # Otherwise ..
-        ct_plus = changetimes + self.timespan
-        indx2 = np.searchsorted(changetimes, ct_plus, side='right')
-        indx1 = np.arange(changetimes.size)
-        nchanges = indx2-indx1
+        nchanges = windowCounts(changetimes, self.timespan, side='right')
         return nchanges.max()
 
 
@@ -155,11 +141,8 @@ class TeffMetric(BaseMetric):
                        'comparing the achieved m5 depth to a fiducial m5 value.'
 
     def run(self, dataSlice, slicePoint=None):
-        filters = np.unique(dataSlice[self.filterCol])
-        teff = 0.0
-        for f in filters:
-            match = np.where(dataSlice[self.filterCol] == f)[0]
-            teff += (10.0**(0.8*(dataSlice[self.m5Col][match] - self.depth[f]))).sum()
+        depth = filterLookup(self.depth, dataSlice, self.filterCol)
+        teff = (10.0**(0.8*(dataSlice[self.m5Col] - depth))).sum()
         teff *= self.teffBase
         if self.normed:
             # Normalize by the t_eff if each observation was at the fiducial depth.
@@ -224,10 +207,10 @@ class CompletenessMetric(BaseMetric):
         """
         Compute the completeness for each filter, and then the minimum (joint) completeness for each slice.
         """
-        allCompleteness = []
-        for f, nVis in zip(self.filters, self.nvisitsRequested):
-            filterVisits = np.size(np.where(dataSlice[self.filterCol] == f)[0])
-            allCompleteness.append(filterVisits/np.float(nVis))
+        # Count the visits in each filter (the first count is for any other filters).
+        nVisits = np.bincount(getFilterIdx(dataSlice, self.filterCol) + 1, minlength=len(filterNames) + 1)
+        filterVisits = nVisits[filterIndex(self.filters) + 1]
+        allCompleteness = list(filterVisits / self.nvisitsRequested.astype(float))
         allCompleteness.append(np.min(np.array(allCompleteness)))
         return np.array(allCompleteness)
 
@@ -2,6 +2,7 @@ __all__ = ['TgapsMetric']
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 
 
 class TgapsMetric(BaseMetric):
@@ -27,18 +28,20 @@ class TgapsMetric(BaseMetric):
         self.timesCol = timesCol
         super(TgapsMetric, self).__init__(col=[self.timesCol], metricDtype='object', units=units, **kwargs)
         self.allGaps = allGaps
+        self.requiresSorted = self.timesCol
 
     def run(self, dataSlice, slicePoint=None):
         if dataSlice.size < 2:
             return self.badval
-        times = np.sort(dataSlice[self.timesCol])
+        context = getSliceContext(dataSlice, slicePoint)
+        times = context.sortedCol(self.timesCol, self.timesCol)
         if self.allGaps:
             allDiffs = []
             for i in np.arange(1, times.size, 1):
                 allDiffs.append((times - np.roll(times, i))[i:])
             dts = np.concatenate(allDiffs)
         else:
-            dts = np.diff(times)
+            dts = context.dtimes(self.timesCol)
         result, bins = np.histogram(dts, self.bins)
         return result
 
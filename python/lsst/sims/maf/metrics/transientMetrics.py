@@ -3,6 +3,7 @@ __all__ = ['TransientMetric']
 from builtins import zip
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.stackers.filterStackers import filterIndex, filterTable, getFilterIdx
 
 
 class TransientMetric(BaseMetric):
@@ -105,7 +106,7 @@ class TransientMetric(BaseMetric):
         time : numpy.ndarray
             The times of the observations.
         filters : numpy.ndarray
-            The filters of the observations.
+            The filters of the observations (the filter names, or their filterIdx values).
 
         Returns
         -------
@@ -117,9 +118,10 @@ class TransientMetric(BaseMetric):
         lcMags[rise] += self.riseSlope * time[rise] - self.riseSlope * self.peakTime
         decline = np.where(time > self.peakTime)
         lcMags[decline] += self.declineSlope * (time[decline] - self.peakTime)
-        for key in self.peaks:
-            fMatch = np.where(filters == key)
-            lcMags[fMatch] += self.peaks[key]
+        filters = np.asarray(filters)
+        if filters.dtype.kind not in ('i', 'u'):
+            filters = filterIndex(filters)
+        lcMags += filterTable(self.peaks, default=0.)[filters]
         return lcMags
 
     def run(self, dataSlice, slicePoint=None):
@@ -159,7 +161,8 @@ class TransientMetric(BaseMetric):
             # Which lightcurve does each point belong to
             lcNumber = np.floor((dataSlice[self.mjdCol] - surveyStart) / self.transDuration)
 
-            lcMags = self.lightCurve(time, dataSlice[self.filterCol])
+            filterIdx = getFilterIdx(dataSlice, self.filterCol)
+            lcMags = self.lightCurve(time, filterIdx)
 
             # How many criteria needs to be passed
             detectThresh = 0
@@ -174,6 +177,7 @@ class TransientMetric(BaseMetric):
                 detectThresh += 1
                 ord = np.argsort(dataSlice[self.mjdCol])
                 dataSlice = dataSlice[ord]
+                filterIdx = filterIdx[ord]
                 detected = detected[ord]
                 lcNumber = lcNumber[ord]
                 time = time[ord]
@@ -195,6 +199,7 @@ class TransientMetric(BaseMetric):
                 # make sure things are sorted by time
                 ord = np.argsort(dataSlice[self.mjdCol])
                 dataSlice = dataSlice[ord]
+                filterIdx = filterIdx[ord]
                 detected = detected[ord]
                 lcNumber = lcNumber[ord]
                 time = time[ord]
@@ -205,10 +210,10 @@ class TransientMetric(BaseMetric):
 
                 for le, ri in zip(left, right):
                     points = np.where(detected[le:ri] > 0)
-                    ufilters = np.unique(dataSlice[self.filterCol][le:ri][points])
+                    lcFilters = filterIdx[le:ri][points]
                     phaseSections = np.floor(time[le:ri][points] / self.transDuration * self.nPerLC)
-                    for filtName in ufilters:
-                        good = np.where(dataSlice[self.filterCol][le:ri][points] == filtName)
+                    for filtIdx in np.unique(lcFilters):
+                        good = np.where(lcFilters == filtIdx)
                         if np.size(np.unique(phaseSections[good])) >= self.nPerLC:
                             detected[le:ri] += 1
 
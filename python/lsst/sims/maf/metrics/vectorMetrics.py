@@ -3,6 +3,7 @@ __all__ = ['HistogramMetric', 'AccumulateMetric', 'AccumulateCountMetric',
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
 from scipy import stats
 
 
@@ -14,6 +15,7 @@ class VectorMetric(BaseMetric):
         self.bins = bins
         self.binCol = binCol
         self.shape = np.size(bins)-1
+        self.requiresSorted = self.binCol
 
 
 class HistogramMetric(VectorMetric):
@@ -27,7 +29,7 @@ class HistogramMetric(VectorMetric):
                                               metricDtype=metricDtype, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
         result, binEdges, binNumber = stats.binned_statistic(dataSlice[self.binCol],
                                                              dataSlice[self.col],
                                                              bins=self.bins,
@@ -46,7 +48,7 @@ class AccumulateMetric(VectorMetric):
         self.col = col
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
 
         result = self.function.accumulate(dataSlice[self.col])
         indices = np.searchsorted(dataSlice[self.binCol], self.bins[1:], side='right')
@@ -60,7 +62,7 @@ class AccumulateCountMetric(AccumulateMetric):
     """Calculate the number of visits over time.
     """
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
         toCount = np.ones(dataSlice.size, dtype=int)
         result = self.function.accumulate(toCount)
         indices = np.searchsorted(dataSlice[self.binCol], self.bins[1:], side='right')
@@ -82,7 +84,7 @@ class HistogramM5Metric(HistogramMetric):
         self.m5Col = m5Col
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
         flux = 10.**(.8*dataSlice[self.m5Col])
         result, binEdges, binNumber = stats.binned_statistic(dataSlice[self.binCol], flux,
                                                              bins=self.bins, statistic='sum')
@@ -102,7 +104,7 @@ class AccumulateM5Metric(AccumulateMetric):
                                                  metricName=metricName, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
         flux = 10.**(.8*dataSlice[self.m5Col])
 
         result = np.add.accumulate(flux)
@@ -128,7 +130,7 @@ class AccumulateUniformityMetric(AccumulateMetric):
         self.surveyLength = surveyLength
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = getSliceContext(dataSlice, slicePoint).sortedSlice(self.binCol)
         if dataSlice.size == 1:
             return np.ones(self.bins.size-1, dtype=float)
 
@@ -8,6 +8,8 @@ from builtins import zip
 
 import numpy as np
 from .baseMetric import BaseMetric
+from .sliceContext import getSliceContext
+from lsst.sims.maf.utils import windowEnds, windowSums
 
 
 class VisitGroupsMetric(BaseMetric):
@@ -36,6 +38,7 @@ class VisitGroupsMetric(BaseMetric):
         self.minNNights = int(minNNights)
         super(VisitGroupsMetric, self).__init__(col=[self.times, self.nights],
                                                 metricName=metricName, **kwargs)
+        self.requiresSorted = self.times
         self.reduceOrder = {'Median': 0, 'NNightsWithNVisits': 1, 'NVisitsInWindow': 2,
                             'NNightsInWindow': 3, 'NLunations': 4, 'MaxSeqLunations': 5}
         self.comment = 'Evaluation of the number of visits within a night, with separations between '
@@ -75,13 +78,14 @@ class VisitGroupsMetric(BaseMetric):
         than deltaTmin, the two would be counted as 1.5 visits together (if only 1 and 2 existed,
         then there would be 0 visits as none would be within the qualifying time interval).
         """
-        uniquenights = np.unique(dataSlice[self.nights])
+        context = getSliceContext(dataSlice, slicePoint)
+        uniquenights, firstOfNight, lastOfNight = context.nightBounds(self.nights, self.times)
+        sortedTimes = context.sortedCol(self.times, self.times)
         nights = []
         visitNum = []
         # Find the nights with visits within deltaTmin/max of one another and count the number of visits
-        for n in uniquenights:
-            condition = (dataSlice[self.nights] == n)
-            times = np.sort(dataSlice[self.times][condition])
+        for n, first, last in zip(uniquenights, firstOfNight, lastOfNight):
+            times = sortedTimes[first:last + 1]
             nvisits = 0
             ntooclose = 0
             # Calculate difference between each visit and time of previous visit (tnext- tnow)
@@ -132,83 +136,73 @@ class VisitGroupsMetric(BaseMetric):
         condition = (metricval['visits'] >= self.minNVisits)
         return len(metricval['visits'][condition])
 
-    def _inWindow(self, visits, nights, night, window, minNVisits):
-        condition = ((nights >= night) & (nights < night+window))
-        condition2 = (visits[condition] >= minNVisits)
-        return visits[condition][condition2], nights[condition][condition2]
+    def _goodNightsInWindow(self, metricval):
+        """Return the total visits on nights with more than minNVisits, and the number of those nights,
+        within the window starting on each night."""
+        nights = metricval['nights']
+        visits = metricval['visits']
+        good = visits >= self.minNVisits
+        ends = windowEnds(nights, self.window)
+        starts = np.arange(len(nights))
+        return windowSums(np.where(good, visits, 0), starts, ends), windowSums(good, starts, ends)
 
     def reduceNVisitsInWindow(self, metricval):
         """Reduce to max number of total visits on all nights with more than minNVisits,
         within any 'window' (default=30 nights)."""
-        maxnvisits = 0
-        for n in metricval['nights']:
-            vw, nw = self._inWindow(metricval['visits'], metricval['nights'], n, self.window, self.minNVisits)
-            maxnvisits = max((vw.sum(), maxnvisits))
-        return maxnvisits
+        nvisits, nnights = self._goodNightsInWindow(metricval)
+        return max(nvisits.max(), 0)
 
     def reduceNNightsInWindow(self, metricval):
         """Reduce to max number of nights with more than minNVisits, within 'window' over all windows."""
-        maxnights = 0
-        for n in metricval['nights']:
-            vw, nw = self._inWindow(metricval['visits'], metricval['nights'], n, self.window, self.minNVisits)
-            maxnights = max(len(nw), maxnights)
-        return maxnights
+        nvisits, nnights = self._goodNightsInWindow(metricval)
+        return max(nnights.max(), 0)
 
-    def _inLunation(self, visits, nights, lunationStart, lunationLength):
-        condition = ((nights >= lunationStart) & (nights < lunationStart+lunationLength))
-        return visits[condition], nights[condition]
+    def _lunationGroups(self, metricval, lunationLength=30):
+        """Find the lunations (unique 30 day windows, starting at the first night) which contain
+        at least one 'group', and those in which the first night starts a group.
+
+        A group starts on a night if there are at least minNNights nights with more than minNVisits
+        within 'window' of that night and within the same lunation.
+        """
+        nights = metricval['nights']
+        nLunations = len(np.arange(nights[0], nights[-1] + lunationLength / 2.0, lunationLength))
+        lunation = ((nights - nights[0]) // lunationLength).astype(int)
+        lunationEnd = nights[0] + (lunation + 1) * lunationLength
+        # The window starting on each night is truncated at the end of its lunation.
+        width = np.minimum(self.window, lunationEnd - nights)
+        ends = windowEnds(nights, width)
+        good = metricval['visits'] >= self.minNVisits
+        isGroup = windowSums(good, np.arange(len(nights)), ends) >= self.minNNights
+        hasGroup = np.bincount(lunation[isGroup], minlength=nLunations) > 0
+        firstIsGroup = np.zeros(nLunations, bool)
+        lunationsWithNights, firstNight = np.unique(lunation, return_index=True)
+        firstIsGroup[lunationsWithNights] = isGroup[firstNight]
+        return hasGroup, firstIsGroup
 
     def reduceNLunations(self, metricval):
         """Reduce to number of lunations (unique 30 day windows) that contain at least one 'group':
         a set of more than minNVisits per night, with more than minNNights of visits
         within 'window' time period.
         """
-        lunationLength = 30
-        lunations = np.arange(metricval['nights'][0],
-                              metricval['nights'][-1] + lunationLength / 2.0,
-                              lunationLength)
-        nLunations = 0
-        for l in lunations:
-            # Find visits within lunation.
-            vl, nl = self._inLunation(metricval['visits'], metricval['nights'], l, lunationLength)
-            for n in nl:
-                # Find visits which are in groups within the lunation.
-                vw, nw = self._inWindow(vl, nl, n, self.window, self.minNVisits)
-                if len(nw) >= self.minNNights:
-                    nLunations += 1
-                    break
-        return nLunations
+        hasGroup, firstIsGroup = self._lunationGroups(metricval)
+        return int(hasGroup.sum())
 
     def reduceMaxSeqLunations(self, metricval):
         """Count the max number of sequential lunations (unique 30 day windows) that contain
         at least one 'group': a set of more than minNVisits per night, with more than minNNights of
         visits within 'window' time period.
         """
-        lunationLength = 30
-        lunations = np.arange(metricval['nights'][0],
-                              metricval['nights'][-1] + lunationLength / 2.0,
-                              lunationLength)
+        hasGroup, firstIsGroup = self._lunationGroups(metricval)
         maxSequence = 0
         curSequence = 0
-        for l in lunations:
-            # Find visits within lunation.
-            vl, nl = self._inLunation(metricval['visits'], metricval['nights'], l, lunationLength)
-            # If no visits this lunation:
-            if len(vl) == 0:
+        for group, first in zip(hasGroup, firstIsGroup):
+            # A lunation without a group ends the sequence. A lunation whose first night does not
+            # start a group also ends the previous sequence, but starts a new one if it has a group.
+            if not first:
                 maxSequence = max(maxSequence, curSequence)
                 curSequence = 0
-            # Else, look to see if groups can be made from the visits.
-            for n in nl:
-                # Find visits which are in groups within the lunation.
-                vw, nw = self._inWindow(vl, nl, n, self.window, self.minNVisits)
-                # If there was a group within this lunation:
-                if len(nw) >= self.minNNights:
-                    curSequence += 1
-                    break
-                # Otherwise we're not in a sequence (anymore, or still).
-                else:
-                    maxSequence = max(maxSequence, curSequence)
-                    curSequence = 0
+            if group:
+                curSequence += 1
         # Pick up last sequence if were in a sequence at last lunation.
         maxSequence = max(maxSequence, curSequence)
         return maxSequence
@@ -123,8 +123,8 @@ class BaseSpatialSlicer(BaseSlicer):
             else:
                 sx, sy, sz = self._treexyz(self.slicePoints['ra'][islice],
                                            self.slicePoints['dec'][islice])
-                # Query against tree.
-                indices = self.opsimtree.query_ball_point((sx, sy, sz), self.rad)
+                # Query against tree (sorting the indexes, so the slice keeps the order of simData).
+                indices = sorted(self.opsimtree.query_ball_point((sx, sy, sz), self.rad))
 
             # Loop through all the slicePoint keys. If the first dimension of slicepoint[key] has
             # the same shape as the slicer, assume it is information per slicepoint.
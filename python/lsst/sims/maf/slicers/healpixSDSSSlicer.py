@@ -34,7 +34,7 @@ class HealpixSDSSSlicer(HealpixSlicer):
             (slicepoint=lonCol/latCol value .. usually ra/dec)."""
             sx, sy, sz = self._treexyz(self.slicePoints['ra'][islice], self.slicePoints['dec'][islice])
             # Query against tree.
-            initIndices = self.opsimtree.query_ball_point((sx, sy, sz), self.rad)
+            initIndices = sorted(self.opsimtree.query_ball_point((sx, sy, sz), self.rad))
             # Loop through all the images and check if the slicepoint is inside the corners of the chip
             # XXX--should check if there's a better/faster way to do this.
             # Maybe in the setupSlicer loop through each image, and use the contains_points method to test all the
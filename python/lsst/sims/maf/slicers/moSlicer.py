@@ -4,6 +4,7 @@ import pandas as pd
 import warnings
 
 from .baseSlicer import BaseSlicer
+from lsst.sims.maf.utils import readColumnCache, writeColumnCache, RaggedMetricValues
 from lsst.sims.maf.plots.moPlotters import MetricVsH, MetricVsOrbit
 
 from .orbits import Orbits
@@ -20,15 +21,18 @@ class MoObjSlicer(BaseSlicer):
     """
     def __init__(self, verbose=True, badval=0):
         super(MoObjSlicer, self).__init__(verbose=verbose, badval=badval)
+        self.chunkSize = None
+        self.obsColumns = None
+        self._orbitRecords = None
         # Set default plotFuncs.
         self.plotFuncs = [MetricVsH(),
                           MetricVsOrbit(xaxis='q', yaxis='e'),
                           MetricVsOrbit(xaxis='q', yaxis='inc')]
 
-    def readOrbits(self, orbitFile, Hrange, delim=None, skiprows=None):
+    def readOrbits(self, orbitFile, Hrange, delim=None, skiprows=None, cache=False, cacheDir=None):
         # Use sims_movingObjects to read orbit files.
         orb = Orbits()
-        orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows)
+        orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows, cache=cache, cacheDir=cacheDir)
         self.orbits = orb.orbits
         # Then go on as previously. Need to refactor this into 'setupSlicer' style.
         self.nSso = len(self.orbits)
@@ -46,38 +50,163 @@ class MoObjSlicer(BaseSlicer):
         # Set the rest of the slicePoint information once
         self.nslice = self.shape[0] * self.shape[1]
 
-    def readObs(self, obsfile):
+    def readObs(self, obsfile, chunkSize=None, readRows=1000000, cache=False, cacheDir=None):
         """
         Read observations created by moObs.
+
+        Parameters
+        ----------
+        obsfile : str
+            The file containing the observations of each object.
+        chunkSize : int, optional
+            If None (default), all of the observations are read into memory now.
+            Otherwise, the observations are streamed from obsfile in chunks of chunkSize objects
+            by iterObsChunks (the MoMetricBundleGroup then calculates the metrics one chunk at a time).
+            This requires the observations of each object to be contiguous in obsfile, as written by moObs.
+        readRows : int, optional
+            The number of lines to read from obsfile at a time, when streaming. Default 1000000.
+        cache : bool, optional
+            If True, use a binary columnar copy of obsfile (sorted by objId, including the derived columns)
+            if one exists and is newer than obsfile. Otherwise, when reading all of the observations,
+            write the copy for next time. Streaming with a copy memory-maps it rather than parsing the text.
+            Default False.
+        cacheDir : str, optional
+            The directory for the binary copy. Default None (the directory of obsfile).
         """
-        # For now, just read all the observations (should be able to chunk this though).
         self.obsfile = obsfile
-        self.allObs = pd.read_table(obsfile, delim_whitespace=True)
+        self.chunkSize = chunkSize
+        self.readRows = readRows
+        self.obsColumns = None
+        if cache:
+            self.obsColumns = readColumnCache(obsfile, cacheDir=cacheDir)
+        if self.chunkSize is not None:
+            # Observations are read (and subset) chunk by chunk, in iterObsChunks.
+            self.allObs = None
+            self.pandasConstraint = None
+            return
+        if self.obsColumns is not None:
+            self.allObs = pd.DataFrame(self.obsColumns)
+        else:
+            self.allObs = self._addObsColumns(pd.read_table(obsfile, delim_whitespace=True))
+            if cache:
+                writeColumnCache(self.allObs, obsfile, cacheDir=cacheDir, sortCol='objId')
+        self.subsetObs()
+
+    def _addObsColumns(self, obs):
+        """
+        Fix up the column names of the observations read from disk and add the derived columns.
+        """
         # We may have to rename the first column from '#objId' to 'objId'.
-        if self.allObs.columns.values[0].startswith('#'):
-            newcols = self.allObs.columns.values
+        if obs.columns.values[0].startswith('#'):
+            newcols = obs.columns.values
             newcols[0] = newcols[0].replace('#', '')
-            self.allObs.columns = newcols
-        if 'magFilter' not in self.allObs.columns.values:
-            self.allObs['magFilter'] = self.allObs['magV'] + self.allObs['dmagColor']
-        if 'velocity' not in self.allObs.columns.values:
-            self.allObs['velocity'] = np.sqrt(self.allObs['dradt']**2 + self.allObs['ddecdt']**2)
-        if 'visitExpTime' not in self.allObs.columns.values:
-            self.allObs['visitExpTime'] = np.zeros(len(self.allObs['objId']), float) + 30.0
+            obs.columns = newcols
+        if 'magFilter' not in obs.columns.values:
+            obs['magFilter'] = obs['magV'] + obs['dmagColor']
+        if 'velocity' not in obs.columns.values:
+            obs['velocity'] = np.sqrt(obs['dradt']**2 + obs['ddecdt']**2)
+        if 'visitExpTime' not in obs.columns.values:
+            obs['visitExpTime'] = np.zeros(len(obs['objId']), float) + 30.0
         # If we created intermediate data products by pandas, we may have an inadvertent 'index'
         #  column. Since this creates problems later, drop it here.
-        if 'index' in self.allObs.columns.values:
-            self.allObs.drop('index', axis=1, inplace=True)
-        self.subsetObs()
+        if 'index' in obs.columns.values:
+            obs.drop('index', axis=1, inplace=True)
+        return obs
 
     def subsetObs(self, pandasConstraint=None):
         """
         Choose a subset of all the observations, such as those in a particular time period.
         """
+        if self.chunkSize is not None:
+            # Streaming: the constraint is applied to each chunk as it is read.
+            self.pandasConstraint = pandasConstraint
+            return
         if pandasConstraint is None:
             self.obs = self.allObs
         else:
             self.obs = self.allObs.query(pandasConstraint)
+        self._indexObs()
+
+    def _setObsChunk(self, obs):
+        if self.pandasConstraint is not None:
+            obs = obs.query(self.pandasConstraint)
+        self.obs = obs
+        self._indexObs()
+
+    def iterObsChunks(self):
+        """
+        Iterate through the observations, a chunk of objects at a time.
+
+        For each chunk, this sets the observations used by the slicer (self.obs) to the
+        observations of (only) the objects in the chunk, and yields the indexes of the orbits
+        in the chunk. If the observations were not streamed (chunkSize is None), there is a single
+        chunk containing all the orbits.
+        Orbits without any observations do not appear in any chunk.
+
+        Yields
+        ------
+        numpy.ndarray
+            The indexes of the orbits whose observations are currently loaded.
+        """
+        if self.chunkSize is None:
+            yield np.arange(self.nSso)
+            return
+        orbitIds = self.orbits['objId'].values
+        if self.obsColumns is not None:
+            # The cached observations are sorted by objId, so each chunk is a contiguous block of rows.
+            objIds = self.obsColumns['objId']
+            objStarts = np.concatenate([[0], np.where(objIds[1:] != objIds[:-1])[0] + 1, [len(objIds)]])
+            for c in range(0, len(objStarts) - 1, self.chunkSize):
+                start = objStarts[c]
+                end = objStarts[min(c + self.chunkSize, len(objStarts) - 1)]
+                obs = pd.DataFrame(dict((col, np.array(values[start:end]))
+                                        for col, values in self.obsColumns.items()),
+                                   index=np.arange(start, end))
+                self._setObsChunk(obs)
+                yield np.where(np.in1d(orbitIds, self.obsIds))[0]
+            return
+        reader = pd.read_table(self.obsfile, delim_whitespace=True, chunksize=self.readRows)
+        buffered = None
+        for obs in reader:
+            obs = self._addObsColumns(obs)
+            if buffered is not None:
+                obs = pd.concat([buffered, obs])
+            # The last object in this block may continue in the next block, so hold it back.
+            objIds = obs['objId'].values
+            newObj = np.concatenate([[True], objIds[1:] != objIds[:-1]])
+            objStarts = np.where(newObj)[0]
+            if len(objStarts) <= self.chunkSize:
+                buffered = obs
+                continue
+            # Hand out chunks of chunkSize complete objects.
+            nComplete = len(objStarts) - 1
+            for c in range(0, nComplete - nComplete % self.chunkSize, self.chunkSize):
+                self._setObsChunk(obs.iloc[objStarts[c]:objStarts[c + self.chunkSize]])
+                yield np.where(np.in1d(orbitIds, self.obsIds))[0]
+            buffered = obs.iloc[objStarts[nComplete - nComplete % self.chunkSize]:]
+        if buffered is not None and len(buffered) > 0:
+            self._setObsChunk(buffered)
+            yield np.where(np.in1d(orbitIds, self.obsIds))[0]
+
+    def _indexObs(self):
+        """
+        Sort the observations by objId (keeping the original order of each object's observations),
+        convert them to a recarray once, and record where each object's observations start and end.
+        """
+        order = np.argsort(self.obs['objId'].values, kind='mergesort')
+        self.obsRecords = self.obs.iloc[order].to_records()
+        self.obsIds = self.obsRecords['objId']
+
+    def orbitRecords(self):
+        """Return the orbits as a numpy record array (cached, while self.orbits is unchanged).
+
+        Returns
+        -------
+        numpy.recarray
+        """
+        if self._orbitRecords is None or self._orbitRecords[0] is not self.orbits:
+            self._orbitRecords = (self.orbits, self.orbits.to_records(index=False))
+        return self._orbitRecords[1]
 
     def _sliceObs(self, idx):
         """
@@ -85,20 +214,18 @@ class MoObjSlicer(BaseSlicer):
         For now this works for any ssoId; in the future, this might only work as ssoId is
          progressively iterated through the series of ssoIds (so we can 'chunk' the reading).
         """
-        # Find the matching orbit.
-        orb = self.orbits.iloc[idx]
-        # Find the matching observations.
-        if self.obs['objId'].dtype == 'object':
-            obs = self.obs.query('objId == "%s"' %(orb['objId']))
-        else:
-            obs = self.obs.query('objId == %d' %(orb['objId']))
+        # Find the matching orbit (a numpy record, which is much faster to access than a pandas row).
+        orb = self.orbitRecords()[idx]
+        # Find the matching observations (a contiguous block of the objId-sorted observations).
+        start = np.searchsorted(self.obsIds, orb['objId'], side='left')
+        end = np.searchsorted(self.obsIds, orb['objId'], side='right')
         # Return the values for H to consider for metric.
         if self.Hrange is not None:
             Hvals = self.Hrange
         else:
             Hvals = np.array([orb['H']], float)
         # Note that ssoObs / obs is a recarray not Dataframe!
-        return {'obs': obs.to_records(),
+        return {'obs': self.obsRecords[start:end],
                 'orbit': orb,
                 'Hvals': Hvals}
 
@@ -141,12 +268,25 @@ class MoObjSlicer(BaseSlicer):
         Cheap and dirty write to disk.
         Need to expand to include writing summary statistics to disk and info about slicer.
         """
+        outfilename = outfilename.replace('.npz', '.h5')
+        if isinstance(metricValues, RaggedMetricValues):
+            # Write the H values alongside the flat arrays of the ragged metric values.
+            pd.Series(self.Hrange).to_hdf(outfilename, 'Hrange', mode='w')
+            metricValues.toHdf(outfilename)
+            return
         df = pd.DataFrame(metricValues, columns=self.Hrange, index=None)
-        df.to_hdf(outfilename.replace('.npz', '.h5'), 'df_with_missing')
+        df.to_hdf(outfilename, 'df_with_missing')
 
     def readData(self, infilename):
         "Cheap and dirty read."
         slicer = MoObjSlicer()
+        if RaggedMetricValues.inHdf(infilename):
+            slicer.Hrange = pd.read_hdf(infilename, 'Hrange').values
+            slicer.slicePoints['H'] = slicer.Hrange
+            slicer.orbits = None
+            metricValues = RaggedMetricValues.fromHdf(infilename, fill_value=slicer.badval)
+            slicer.shape = list(metricValues.shape)
+            return metricValues, slicer
         df = pd.read_hdf(infilename, 'df_with_missing')
         slicer.Hrange = df.columns.values
         slicer.slicePoints['H'] = slicer.Hrange
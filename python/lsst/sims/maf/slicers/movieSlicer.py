@@ -124,7 +124,8 @@ class MovieSlicer(BaseSlicer):
                 #this is the important part. The ids here define the pieces of data that get
                 #passed on to subsequent slicers
                 #cumulative version of 1D slicing
-                idxs = self.simIdxs[0:self.left[islice+1]]
+                # Sort the indexes, so the slice keeps the order of simData.
+                idxs = np.sort(self.simIdxs[0:self.left[islice+1]])
                 return {'idxs':idxs,
                         'slicePoint':{'sid':islice, 'binLeft':self.bins[0], 'binRight':self.bins[islice+1]}}
             setattr(self, '_sliceSimData', _sliceSimData)
@@ -134,7 +135,8 @@ class MovieSlicer(BaseSlicer):
                 """
                 Slice simData on oneD sliceCol, to return relevant indexes for slicepoint.
                 """
-                idxs = self.simIdxs[self.left[islice]:self.left[islice+1]]
+                # Sort the indexes, so the slice keeps the order of simData.
+                idxs = np.sort(self.simIdxs[self.left[islice]:self.left[islice+1]])
                 return {'idxs':idxs,
                         'slicePoint':{'sid':islice, 'binLeft':self.bins[islice], 'binRight':self.bins[islice+1]}}
             setattr(self, '_sliceSimData', _sliceSimData)
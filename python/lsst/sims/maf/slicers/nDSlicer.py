@@ -102,7 +102,7 @@ class NDSlicer(BaseSlicer):
             binIdxs = self.slicePoints['binIdxs'][islice]
             for d, i in zip(list(range(self.nD)), binIdxs):
                 simIdxsList.append(set(self.simIdxs[d][self.lefts[d][i]:self.lefts[d][i+1]]))
-            idxs = list(set.intersection(*simIdxsList))
+            idxs = sorted(set.intersection(*simIdxsList))
             return {'idxs':idxs,
                     'slicePoint':{'sid':islice,
                                   'binLeft':self.slicePoints['bins'][islice],
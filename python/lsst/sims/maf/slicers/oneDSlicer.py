@@ -105,7 +105,8 @@ class OneDSlicer(BaseSlicer):
         @wraps(self._sliceSimData)
         def _sliceSimData(islice):
             """Slice simData on oneD sliceCol, to return relevant indexes for slicepoint."""
-            idxs = self.simIdxs[self.left[islice]:self.left[islice+1]]
+            # Sort the indexes, so the slice keeps the order of simData (sliceCol need not follow it).
+            idxs = np.sort(self.simIdxs[self.left[islice]:self.left[islice+1]])
             return {'idxs':idxs,
                     'slicePoint':{'sid':islice, 'binLeft':self.bins[islice]}}
         setattr(self, '_sliceSimData', _sliceSimData)
@@ -98,7 +98,8 @@ class OpsimFieldSlicer(BaseSpatialSlicer):
         self.nslice = len(self.slicePoints['sid'])
         self._runMaps(maps)
         # Set up data slicing.
-        self.simIdxs = np.argsort(simData[self.simDataFieldIDColName])
+        # Use a stable sort: each slice is a single fieldID, so its indexes are then in increasing order.
+        self.simIdxs = np.argsort(simData[self.simDataFieldIDColName], kind='mergesort')
         simFieldsSorted = np.sort(simData[self.simDataFieldIDColName])
         self.left = np.searchsorted(simFieldsSorted, self.slicePoints['sid'], 'left')
         self.right = np.searchsorted(simFieldsSorted, self.slicePoints['sid'], 'right')
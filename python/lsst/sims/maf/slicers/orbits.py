@@ -1,6 +1,7 @@
 import warnings
 import numpy as np
 import pandas as pd
+from lsst.sims.maf.utils import readColumnCache, writeColumnCache
 
 __all__ = ['Orbits']
 
@@ -11,6 +12,7 @@ class Orbits(object):
     def __init__(self):
         self.orbits = None
         self.format = None
+        self._records = None
 
         # Specify the required columns/values in the self.orbits dataframe.
         # Which columns are required depends on self.format.
@@ -24,15 +26,18 @@ class Orbits(object):
         return len(self.orbits)
 
     def __getitem__(self, i):
+        # The orbits are already validated, so just copy the format rather than calling setOrbits.
+        orbits = self.orbits.iloc[i]
+        if isinstance(orbits, pd.Series):
+            orbits = self.orbits.iloc[[i]]
         orb = Orbits()
-        orb.setOrbits(self.orbits.iloc[i])
+        orb.orbits = orbits
+        orb.format = self.format
         return orb
 
     def __iter__(self):
-        for i, orbit in self.orbits.iterrows():
-            orb = Orbits()
-            orb.setOrbits(orbit)
-            yield orb
+        for i in range(len(self.orbits)):
+            yield self[i]
 
     def __eq__(self, otherOrbits):
         if isinstance(otherOrbits, Orbits):
@@ -52,6 +57,27 @@ class Orbits(object):
         else:
             return True
 
+    def records(self):
+        """Return the orbits as a numpy record array.
+
+        This is a lightweight way to access the values of a single orbit (records()[i] is a numpy record,
+        and records()[i]['q'] is a scalar), or to iterate over a large population without the overhead
+        of creating a (validated) Orbits object for each orbit. The record array is cached,
+        until the orbits are changed with setOrbits.
+
+        Returns
+        -------
+        numpy.recarray
+        """
+        if self._records is None or self._records[0] is not self.orbits:
+            self._records = (self.orbits, self.orbits.to_records(index=False))
+        return self._records[1]
+
+    def iterRecords(self):
+        """Iterate over the orbits, yielding a numpy record (rather than an Orbits object) for each orbit."""
+        for orbit in self.records():
+            yield orbit
+
     def setOrbits(self, orbits):
         """Set and validate orbital parameters contain all required values.
 
@@ -137,16 +163,21 @@ class Orbits(object):
                           ' - was this intended? (continuing).')
         # All is good.
         self.orbits = orbits
+        self._records = None
 
     def assignSed(self, orbits, randomSeed=None):
         """Assign either a C or S type SED, depending on the semi-major axis of the object.
         P(C type) = 0 (a<2); 0.5*a - 1 (2<a<4); 1 (a > 4),
         based on figure 23 from Ivezic et al 2001 (AJ, 122, 2749).
 
+        The SED types of all of the objects are assigned at once.
+
         Parameters
         ----------
         orbits : pandas.DataFrame, pandas.Series or numpy.ndarray
            Array-like object containing orbital parameter information.
+        randomSeed : int, optional
+           If set, use a random state seeded with randomSeed (rather than the global numpy random state).
 
         Returns
         -------
@@ -160,22 +191,26 @@ class Orbits(object):
         #  p(C) = 1 for a>4
         # where a is semi-major axis, and p(C) is the probability that
         # an asteroid is C type, with p(S)=1-p(C) for S types.
-        if 'a' in orbits:
-            a = orbits['a']
-        elif 'q' in orbits:
-            a = orbits['q'] / (1 - orbits['e'])
+        if isinstance(orbits, np.ndarray):
+            cols = orbits.dtype.names
+        else:
+            cols = orbits
+        if 'a' in cols:
+            a = np.atleast_1d(np.asarray(orbits['a'], dtype=float))
+        elif 'q' in cols:
+            a = np.atleast_1d(np.asarray(orbits['q'], dtype=float) / (1 - np.asarray(orbits['e'], dtype=float)))
         else:
             raise ValueError('Need either a or q (plus e) in orbit data frame.')
-        sedvals = np.empty(len(orbits), dtype=str)
         if randomSeed is not None:
-            np.random.seed(randomSeed)
-        chance = np.random.random(len(orbits))
+            random = np.random.RandomState(randomSeed)
+        else:
+            random = np.random
+        chance = random.random_sample(len(a))
         prob_c = 0.5 * a - 1.0
-        # if chance <= prob_c:
         sedvals = np.where(chance <= prob_c, 'C.dat', 'S.dat')
         return sedvals
 
-    def readOrbits(self, orbitfile, delim=None, skiprows=None):
+    def readOrbits(self, orbitfile, delim=None, skiprows=None, cache=False, cacheDir=None):
         """Read orbits from a file, generating a pandas dataframe containing columns matching
         dataCols, for the appropriate orbital parameter format (currently accepts COM or KEP formats).
 
@@ -190,7 +225,17 @@ class Orbits(object):
             The delimiter for the input orbit file -- default = None will use delim_whitespace=True.
         skiprows : int, optional
             The number of rows to skip before reading the header information for pandas.
+        cache : bool, optional
+            If True, read the orbits from a binary columnar copy of orbitfile if one exists
+            (and is newer than orbitfile); otherwise parse orbitfile and write the copy. Default False.
+        cacheDir : str, optional
+            The directory for the binary copy. Default None (the directory of orbitfile).
         """
+        if cache:
+            columns = readColumnCache(orbitfile, cacheDir=cacheDir)
+            if columns is not None:
+                self.setOrbits(pd.DataFrame(columns))
+                return
         names = None
         if skiprows is None:
             skiprows = 0
@@ -279,3 +324,6 @@ class Orbits(object):
         orbits.columns = ssoCols
         # Validate and assign orbits to self.
         self.setOrbits(orbits)
+        if cache:
+            # Cache the validated orbits (including any generated objId, H, g and sed_filename values).
+            writeColumnCache(self.orbits, orbitfile, cacheDir=cacheDir)
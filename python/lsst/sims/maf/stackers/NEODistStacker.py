@@ -1,26 +1,39 @@
+import multiprocessing
 import numpy as np
 from .baseStacker import BaseStacker
+from .filterStackers import filterTable, getFilterIdx
 
 
 __all__ = ['NEODistStacker']
 
+
+def _solveChunk(args):
+    # Module level function, so it can be used with multiprocessing.
+    stacker, elongRad, v5 = args
+    return stacker._maxGeoDist(elongRad, v5)
+
+
 class NEODistStacker(BaseStacker):
     """
     For each observation, find the max distance to a ~144 km NEO,
     also stack on the x,y position of the object.
     """
+    perVisit = True
 
     def __init__(self, m5Col='fiveSigmaDepth',
                  stepsize=.001, maxDist=3.,minDist=.3, H=22, elongCol='solarElong',
-                 filterCol='filter',sunAzCol='sunAz', azCol='azimuth'):
+                 filterCol='filter',sunAzCol='sunAz', azCol='azimuth', chunkSize=1000, nProcesses=1):
 
         """
         stepsize:  The stepsize to use when solving (in AU)
         maxDist: How far out to try and measure (in AU)
         H: Asteroid magnitude
+        chunkSize: The number of visits to solve at once (bounds the memory used, as each
+            chunk of visits is solved over the full grid of distances at once)
+        nProcesses: The number of processes to use to solve the chunks of visits
 
         Adds columns:
-        MaxGeoDist:  Geocentric distance to the NEO
+        MaxGeoDist:  Geocentric distance to the NEO (NaN if it is bright enough out to maxDist)
         NEOHelioX: Heliocentric X (with Earth at x,y,z (0,1,0))
         NEOHelioY: Heliocentric Y (with Earth at (0,1,0))
         """
@@ -35,6 +48,8 @@ class NEODistStacker(BaseStacker):
         self.elongCol = elongCol
         self.filterCol = filterCol
         self.azCol = azCol
+        self.chunkSize = int(chunkSize)
+        self.nProcesses = int(nProcesses)
 
         self.H = H
         # Magic numbers (Ivezic '15, private comm.)that convert an asteroid
@@ -51,34 +66,66 @@ class NEODistStacker(BaseStacker):
         self.b2 = 1.22
 
 
-    def run(self,simData):
-
-        simData=self._addStackers(simData)
-
-        elongRad = np.radians(simData[self.elongCol])
-        v5 = np.zeros(simData.size, dtype=float) + simData[self.m5Col]
-        for filterName in self.limitingAdjust:
-            fmatch = np.where(simData[self.filterCol] == filterName)
-            v5[fmatch] += self.limitingAdjust[filterName]
-
-        for i,elong in enumerate(elongRad):
-            # Law of cosines:
-            # Heliocentric Radius of the object
-            R = np.sqrt(1.+self.deltas**2-2.*self.deltas*np.cos(elong) )
-            # Angle between sun and earth as seen by NEO
-            alphas = np.arccos( (1.-R**2-self.deltas**2)/(-2.*self.deltas*R) )
-            ta2 = np.tan(alphas/2.)
-            phi1 = np.exp(-self.a1*ta2**self.b1)
-            phi2 = np.exp(-self.a2*ta2**self.b2)
-
-            alpha_term = 2.5*np.log10( (1.- self.G)*phi1+self.G*phi2)
-            appmag = self.H+5.*np.log10(R*self.deltas)-alpha_term
+    def _appmag(self, cosElong, deltas):
+        """Calculate the apparent magnitude of the NEO at geocentric distances deltas
+        (for the solar elongations with cosine cosElong).
+        """
+        # Law of cosines:
+        # Heliocentric Radius of the object
+        R = np.sqrt(1.+deltas**2-2.*deltas*cosElong)
+        # Angle between sun and earth as seen by NEO
+        alphas = np.arccos((1.-R**2-deltas**2)/(-2.*deltas*R))
+        ta2 = np.tan(alphas/2.)
+        phi1 = np.exp(-self.a1*ta2**self.b1)
+        phi2 = np.exp(-self.a2*ta2**self.b2)
+
+        alpha_term = 2.5*np.log10((1.-self.G)*phi1+self.G*phi2)
+        return self.H+5.*np.log10(R*deltas)-alpha_term
+
+    def _maxGeoDist(self, elongRad, v5, blockSize=64):
+        """Find the first distance (in self.deltas) at which the NEO is fainter than v5,
+        for each of a chunk of visits at once.
+
+        The (nVisits x nDeltas) grid is evaluated in blocks of blockSize distances, and only for the
+        visits where the NEO has not already been found to be too faint at a smaller distance.
+        """
+        maxGeoDist = np.zeros(len(elongRad), float) + np.nan
+        todo = np.arange(len(elongRad))
+        cosElong = np.cos(elongRad)[:, np.newaxis]
+        for start in range(0, len(self.deltas), blockSize):
+            if len(todo) == 0:
+                break
+            deltas = self.deltas[start:start+blockSize]
+            appmag = self._appmag(cosElong[todo], deltas)
             # There can be some local minima/maxima when solving, so
             # need to find the *1st* spot where it is too faint, not the
             # last spot it is bright enough.
-            tooFaint = np.where(appmag > v5[i])
-
-            simData['MaxGeoDist'][i] = np.min(self.deltas[tooFaint])
+            tooFaint = appmag > v5[todo, np.newaxis]
+            first = np.argmax(tooFaint, axis=1)
+            found = tooFaint[np.arange(len(todo)), first]
+            maxGeoDist[todo[found]] = deltas[first[found]]
+            todo = todo[~found]
+        return maxGeoDist
+
+    def _run(self, simData):
+        elongRad = np.radians(simData[self.elongCol])
+        filterIdx = getFilterIdx(simData, self.filterCol)
+        v5 = simData[self.m5Col] + filterTable(self.limitingAdjust, default=0.)[filterIdx]
+
+        # Solve in chunks of visits, to bound the size of the (nVisits x nDeltas) arrays.
+        starts = np.arange(0, simData.size, self.chunkSize)
+        chunks = [(self, elongRad[start:start+self.chunkSize], v5[start:start+self.chunkSize])
+                  for start in starts]
+        if self.nProcesses > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(min(self.nProcesses, len(chunks)))
+            try:
+                results = pool.map(_solveChunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_solveChunk(chunk) for chunk in chunks]
+        simData['MaxGeoDist'] = np.concatenate(results)
 
         # Make coords in heliocentric
         interior = np.where(elongRad <= np.pi/2.)
@@ -8,3 +8,5 @@ from .NEODistStacker import *
 from .moStackers import *
 from .getColInfo import *
 from .m5OptimalStacker import *
+from .filterStackers import *
+from .stackerEngine import *
@@ -48,6 +48,11 @@ class StackerRegistry(type):
 
 class BaseStacker(with_metaclass(StackerRegistry, object)):
     """Base MAF Stacker: add columns generated at run-time to the simdata array."""
+    # Set perVisit in stackers whose added columns depend only on the other columns of the same visit
+    # (and not on the rest of simData), so that the StackerEngine can cache their values for each visit.
+    perVisit = False
+    # Optional: the dtypes of the columns added (default float).
+    colsAddedDtypes = None
 
     def __init__(self):
         """
@@ -78,7 +83,7 @@ class BaseStacker(with_metaclass(StackerRegistry, object)):
         # We have to delve a little further, and compare the kwargs & attributes for each stacker.
         stateNow = dir(self)
         for key in stateNow:
-            if not key.startswith('_') and key != 'registry' and key != 'run' and key != 'next':
+            if not key.startswith('_') and key not in ('registry', 'run', 'runH', 'next'):
                 if not hasattr(otherStacker, key):
                     return False
                 # If the attribute is from numpy, assume it's an array and test it
@@ -105,11 +110,14 @@ class BaseStacker(with_metaclass(StackerRegistry, object)):
         If columns already present in simData, just allows 'run' method to overwrite.
         Returns simData array with these columns added (so 'run' method can set their values).
         """
-        if not hasattr(self, 'colsAddedDtypes') or self.colsAddedDtypes is None:
-            self.colsAddedDtypes = [float for col in self.colsAdded]
+        # Don't set the default dtypes on the stacker itself, so that it still compares equal to
+        # an identical stacker which has not been run.
+        colsAddedDtypes = self.colsAddedDtypes
+        if colsAddedDtypes is None:
+            colsAddedDtypes = [float for col in self.colsAdded]
         # Create description of new recarray.
         newdtype = simData.dtype.descr
-        for col, dtype in zip(self.colsAdded, self.colsAddedDtypes):
+        for col, dtype in zip(self.colsAdded, colsAddedDtypes):
             if col in simData.dtype.names:
                 warnings.warn('Warning - column %s already present in simData, will be overwritten.'
                               % (col))
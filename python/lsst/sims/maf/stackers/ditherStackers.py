@@ -1,9 +1,10 @@
 from builtins import zip
 from builtins import range
+from collections import OrderedDict
 import numpy as np
 from .baseStacker import BaseStacker
 
-__all__ = ['wrapRADec', 'wrapRA', 'inHexagon', 'polygonCoords',
+__all__ = ['wrapRADec', 'wrapRA', 'inHexagon', 'polygonCoords', 'randomDitherOffsets',
            'RandomDitherFieldPerVisitStacker', 'RandomDitherFieldPerNightStacker',
            'RandomDitherPerNightStacker',
            'SpiralDitherFieldPerVisitStacker', 'SpiralDitherFieldPerNightStacker',
@@ -131,6 +132,157 @@ def polygonCoords(nside, radius, rotationAngle):
     return list(zip(xCoords, yCoords))
 
 
+# Pools of random dither offsets, keyed by (randomSeed, maxDither, inHex).
+# Each pool holds [RandomState, xOff, yOff]; offsets are only ever appended, so that the first
+# n offsets for a given key are the same however many offsets were requested before.
+_offsetPools = OrderedDict()
+# The maximum total number of offsets held in the pools; the least recently used pools are dropped first.
+_offsetPoolSize = 10000000
+
+
+def _drawRandomOffsets(rng, noffsets, maxDither, inHex=True, maxTries=100):
+    """Draw at least noffsets random offsets within maxDither (and within the hexagon, if inHex).
+
+    Offsets are drawn as (radius, angle) pairs from rng, accepting the pairs which fall within the
+    hexagon, so the accepted offsets do not depend on how many offsets were requested at a time.
+    All of the accepted offsets are returned (which may be more than noffsets).
+    """
+    xOut = []
+    yOut = []
+    nOut = 0
+    tries = 0
+    # The fraction of the maxDither circle covered by the inscribed hexagon.
+    acceptance = 3. * np.sqrt(3.) / (2. * np.pi) if inHex else 1.
+    while (nOut < noffsets) and (tries < maxTries):
+        ndraw = int((noffsets - nOut) / acceptance * 1.05) + 10
+        pairs = rng.rand(ndraw, 2)
+        dithersRad = np.sqrt(pairs[:, 0]) * maxDither
+        dithersTheta = pairs[:, 1] * np.pi * 2.0
+        xOff = dithersRad * np.cos(dithersTheta)
+        yOff = dithersRad * np.sin(dithersTheta)
+        if inHex:
+            # Constrain dither offsets to be within hexagon.
+            idx = inHexagon(xOff, yOff, maxDither)
+            xOff = xOff[idx]
+            yOff = yOff[idx]
+        xOut.append(xOff)
+        yOut.append(yOff)
+        nOut += len(xOff)
+        tries += 1
+    if nOut < noffsets:
+        raise ValueError('Could not find enough random points within the hexagon in %d tries. '
+                         'Try another random seed?' % (maxTries))
+    return np.concatenate(xOut + [np.zeros(0)]), np.concatenate(yOut + [np.zeros(0)])
+
+
+def randomDitherOffsets(noffsets, maxDither, inHex=True, randomSeed=None):
+    """Generate noffsets random dither offsets, uniformly distributed within maxDither.
+
+    If randomSeed is set, the offsets are generated with a local numpy RandomState (the global numpy
+    random state is not changed) and kept in a pool shared by every stacker with the same
+    (randomSeed, maxDither, inHex); later requests reuse (and, if needed, extend) these offsets.
+    The first n offsets for a given randomSeed are the same however many offsets are requested.
+    If randomSeed is None, the offsets are drawn from the global numpy random state and not kept.
+
+    Parameters
+    ----------
+    noffsets : int
+        The number of offsets to return.
+    maxDither : float
+        The radius of the maximum dither offset (in the units of the returned offsets).
+    inHex : bool, optional
+        If True, offsets are constrained to lie within a hexagon inscribed within the maxDither circle.
+        Default True.
+    randomSeed : int, optional
+        The seed for the random offsets. Default None.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The x and y offsets.
+    """
+    noffsets = int(noffsets)
+    if randomSeed is None:
+        xOff, yOff = _drawRandomOffsets(np.random, noffsets, maxDither, inHex)
+        return xOff[0:noffsets], yOff[0:noffsets]
+    key = (randomSeed, maxDither, inHex)
+    pool = _offsetPools.pop(key, None)
+    if pool is None:
+        pool = [np.random.RandomState(randomSeed), np.zeros(0), np.zeros(0)]
+    if len(pool[1]) < noffsets:
+        xOff, yOff = _drawRandomOffsets(pool[0], noffsets - len(pool[1]), maxDither, inHex)
+        pool[1] = np.concatenate([pool[1], xOff])
+        pool[2] = np.concatenate([pool[2], yOff])
+    # Copy the offsets, so that the pool is not changed if the offsets are.
+    xOff = pool[1][0:noffsets].copy()
+    yOff = pool[2][0:noffsets].copy()
+    # Keep the most recently used pools, within the size limit.
+    _offsetPools[key] = pool
+    total = sum([len(p[1]) for p in _offsetPools.values()])
+    while total > _offsetPoolSize and len(_offsetPools) > 0:
+        oldKey, oldPool = _offsetPools.popitem(last=False)
+        total -= len(oldPool[1])
+    return xOff, yOff
+
+
+def _fieldVisitIndex(fieldIds):
+    """Count the visits to each field: return the index of each visit among the visits to its field
+    (in the order of the data).
+
+    Parameters
+    ----------
+    fieldIds : numpy.ndarray
+        The field identifier of each visit.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    fieldIds = np.asarray(fieldIds)
+    index = np.zeros(len(fieldIds), int)
+    if len(fieldIds) == 0:
+        return index
+    # A stable sort keeps the visits to each field in the order of the data.
+    order = np.argsort(fieldIds, kind='mergesort')
+    sortedIds = fieldIds[order]
+    newField = np.concatenate([[True], sortedIds[1:] != sortedIds[:-1]])
+    position = np.arange(len(fieldIds))
+    fieldStart = np.maximum.accumulate(np.where(newField, position, 0))
+    index[order] = position - fieldStart
+    return index
+
+
+def _fieldNightIndex(fieldIds, nights):
+    """Count the nights each field is observed: return the index of the night of each visit among
+    the (sorted) unique nights on which its field was observed.
+
+    Parameters
+    ----------
+    fieldIds : numpy.ndarray
+        The field identifier of each visit.
+    nights : numpy.ndarray
+        The night of each visit.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    fieldIds = np.asarray(fieldIds)
+    nights = np.asarray(nights)
+    index = np.zeros(len(fieldIds), int)
+    if len(fieldIds) == 0:
+        return index
+    order = np.lexsort((nights, fieldIds))
+    sortedIds = fieldIds[order]
+    sortedNights = nights[order]
+    newField = np.concatenate([[True], sortedIds[1:] != sortedIds[:-1]])
+    newNight = newField | np.concatenate([[True], sortedNights[1:] != sortedNights[:-1]])
+    nightCount = np.cumsum(newNight) - 1
+    fieldStart = np.maximum.accumulate(np.where(newField, nightCount, 0))
+    index[order] = nightCount - fieldStart
+    return index
+
+
 class RandomDitherFieldPerVisitStacker(BaseStacker):
     """
     Randomly dither the RA and Dec pointings up to maxDither degrees from center,
@@ -175,33 +327,10 @@ class RandomDitherFieldPerVisitStacker(BaseStacker):
         self.colsReq = [self.raCol, self.decCol]
 
     def _generateRandomOffsets(self, noffsets):
-        xOut = np.array([], float)
-        yOut = np.array([], float)
-        maxTries = 100
-        tries = 0
-        while (len(xOut) < noffsets) and (tries < maxTries):
-            dithersRad = np.sqrt(np.random.rand(noffsets * 2)) * self.maxDither
-            dithersTheta = np.random.rand(noffsets * 2) * np.pi * 2.0
-            xOff = dithersRad * np.cos(dithersTheta)
-            yOff = dithersRad * np.sin(dithersTheta)
-            if self.inHex:
-                # Constrain dither offsets to be within hexagon.
-                idx = inHexagon(xOff, yOff, self.maxDither)
-                xOff = xOff[idx]
-                yOff = yOff[idx]
-            xOut = np.concatenate([xOut, xOff])
-            yOut = np.concatenate([yOut, yOff])
-            tries += 1
-        if len(xOut) < noffsets:
-            raise ValueError('Could not find enough random points within the hexagon in %d tries. '
-                             'Try another random seed?' % (maxTries))
-        self.xOff = xOut[0:noffsets]
-        self.yOff = yOut[0:noffsets]
+        self.xOff, self.yOff = randomDitherOffsets(noffsets, self.maxDither, inHex=self.inHex,
+                                                   randomSeed=self.randomSeed)
 
     def _run(self, simData):
-        # Generate random numbers for dither, using defined seed value if desired.
-        if self.randomSeed is not None:
-            np.random.seed(self.randomSeed)
         # Generate the random dither values.
         noffsets = len(simData[self.raCol])
         self._generateRandomOffsets(noffsets)
@@ -264,29 +393,14 @@ class RandomDitherFieldPerNightStacker(RandomDitherFieldPerVisitStacker):
         self.colsReq = [self.raCol, self.decCol, self.nightCol, self.fieldIdCol]
 
     def _run(self, simData):
-        # Generate random numbers for dither, using defined seed value if desired.
-        if self.randomSeed is not None:
-            np.random.seed(self.randomSeed)
-        # Generate the random dither values, one per night per field.
-        fields = np.unique(simData[self.fieldIdCol])
-        nights = np.unique(simData[self.nightCol])
-        self._generateRandomOffsets(len(fields) * len(nights))
-        # counter to ensure new random numbers are chosen every time
-        delta = 0
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply dithers, increasing each night.
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % len(self.xOff)
-            # ensure that the same xOff/yOff entries are not chosen
-            delta = delta + len(vertexIdxs)
-            simData['randomDitherFieldPerNightRa'][match] = (simData[self.raCol][match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(simData[self.decCol][match]))
-            simData['randomDitherFieldPerNightDec'][match] = (simData[self.decCol][match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply dithers, increasing each night the field is observed.
+        vertexIdxs = _fieldNightIndex(simData[self.fieldIdCol], simData[self.nightCol])
+        # Generate the random dither values, one per night for the most often observed field.
+        noffsets = vertexIdxs.max() + 1 if len(vertexIdxs) > 0 else 0
+        self._generateRandomOffsets(noffsets)
+        simData['randomDitherFieldPerNightRa'] = (simData[self.raCol] +
+                                                  self.xOff[vertexIdxs] / np.cos(simData[self.decCol]))
+        simData['randomDitherFieldPerNightDec'] = simData[self.decCol] + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['randomDitherFieldPerNightRa'], simData['randomDitherFieldPerNightDec'] = \
             wrapRADec(simData['randomDitherFieldPerNightRa'], simData['randomDitherFieldPerNightDec'])
@@ -337,9 +451,6 @@ class RandomDitherPerNightStacker(RandomDitherFieldPerVisitStacker):
         self.colsReq = [self.raCol, self.decCol, self.nightCol]
 
     def _run(self, simData):
-        # Generate random numbers for dither, using defined seed value if desired.
-        if self.randomSeed is not None:
-            np.random.seed(self.randomSeed)
         # Generate the random dither values, one per night.
         nights = np.unique(simData[self.nightCol])
         self._generateRandomOffsets(len(nights))
@@ -433,16 +544,12 @@ class SpiralDitherFieldPerVisitStacker(BaseStacker):
         # Generate the spiral offset vertices.
         self._generateSpiralOffsets()
         # Now apply to observations.
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply sequential dithers, increasing with each visit.
-            vertexIdxs = np.arange(0, len(match), 1)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['spiralDitherFieldPerVisitRa'][match] = (simData[self.raCol][match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(simData[self.decCol][match]))
-            simData['spiralDitherFieldPerVisitDec'][match] = (simData[self.decCol][match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply sequential dithers, increasing with each visit to the field.
+        vertexIdxs = _fieldVisitIndex(simData[self.fieldIdCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['spiralDitherFieldPerVisitRa'] = (simData[self.raCol] +
+                                                  self.xOff[vertexIdxs] / np.cos(simData[self.decCol]))
+        simData['spiralDitherFieldPerVisitDec'] = simData[self.decCol] + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['spiralDitherFieldPerVisitRa'], simData['spiralDitherFieldPerVisitDec'] = \
             wrapRADec(simData['spiralDitherFieldPerVisitRa'], simData['spiralDitherFieldPerVisitDec'])
@@ -500,18 +607,12 @@ class SpiralDitherFieldPerNightStacker(SpiralDitherFieldPerVisitStacker):
 
     def _run(self, simData):
         self._generateSpiralOffsets()
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply a sequential dither, increasing each night.
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['spiralDitherFieldPerNightRa'][match] = (simData[self.raCol][match] +
-                                                             self.xOff[vertexIdxs] /
-                                                             np.cos(simData[self.decCol][match]))
-            simData['spiralDitherFieldPerNightDec'][match] = (simData[self.decCol][match] +
-                                                              self.yOff[vertexIdxs])
+        # Apply a sequential dither, increasing each night the field is observed.
+        vertexIdxs = _fieldNightIndex(simData[self.fieldIdCol], simData[self.nightCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['spiralDitherFieldPerNightRa'] = (simData[self.raCol] +
+                                                  self.xOff[vertexIdxs] / np.cos(simData[self.decCol]))
+        simData['spiralDitherFieldPerNightDec'] = simData[self.decCol] + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['spiralDitherFieldPerNightRa'], simData['spiralDitherFieldPerNightDec'] = \
             wrapRADec(simData['spiralDitherFieldPerNightRa'], simData['spiralDitherFieldPerNightDec'])
@@ -655,16 +756,12 @@ class HexDitherFieldPerVisitStacker(BaseStacker):
 
     def _run(self, simData):
         self._generateHexOffsets()
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply sequential dithers, increasing with each visit.
-            vertexIdxs = np.arange(0, len(match), 1)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['hexDitherFieldPerVisitRa'][match] = (simData[self.raCol][match] +
-                                                          self.xOff[vertexIdxs] /
-                                                          np.cos(simData[self.decCol][match]))
-            simData['hexDitherFieldPerVisitDec'][match] = simData[self.decCol][match] + self.yOff[vertexIdxs]
+        # Apply sequential dithers, increasing with each visit to the field.
+        vertexIdxs = _fieldVisitIndex(simData[self.fieldIdCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['hexDitherFieldPerVisitRa'] = (simData[self.raCol] +
+                                               self.xOff[vertexIdxs] / np.cos(simData[self.decCol]))
+        simData['hexDitherFieldPerVisitDec'] = simData[self.decCol] + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['hexDitherFieldPerVisitRa'], simData['hexDitherFieldPerVisitDec'] = \
             wrapRADec(simData['hexDitherFieldPerVisitRa'], simData['hexDitherFieldPerVisitDec'])
@@ -714,19 +811,12 @@ class HexDitherFieldPerNightStacker(HexDitherFieldPerVisitStacker):
 
     def _run(self, simData):
         self._generateHexOffsets()
-        for fieldid in np.unique(simData[self.fieldIdCol]):
-            # Identify observations of this field.
-            match = np.where(simData[self.fieldIdCol] == fieldid)[0]
-            # Apply a sequential dither, increasing each night.
-            vertexIdxs = np.arange(0, len(match), 1)
-            nights = simData[self.nightCol][match]
-            vertexIdxs = np.searchsorted(np.unique(nights), nights)
-            vertexIdxs = vertexIdxs % self.numPoints
-            simData['hexDitherFieldPerNightRa'][match] = (simData[self.raCol][match] +
-                                                          self.xOff[vertexIdxs] /
-                                                          np.cos(simData[self.decCol][match]))
-            simData['hexDitherFieldPerNightDec'][match] = (simData[self.decCol][match] +
-                                                           self.yOff[vertexIdxs])
+        # Apply a sequential dither, increasing each night the field is observed.
+        vertexIdxs = _fieldNightIndex(simData[self.fieldIdCol], simData[self.nightCol])
+        vertexIdxs = vertexIdxs % self.numPoints
+        simData['hexDitherFieldPerNightRa'] = (simData[self.raCol] +
+                                               self.xOff[vertexIdxs] / np.cos(simData[self.decCol]))
+        simData['hexDitherFieldPerNightDec'] = simData[self.decCol] + self.yOff[vertexIdxs]
         # Wrap into expected range.
         simData['hexDitherFieldPerNightRa'], simData['hexDitherFieldPerNightDec'] = \
             wrapRADec(simData['hexDitherFieldPerNightRa'], simData['hexDitherFieldPerNightDec'])
@@ -0,0 +1,148 @@
+import numpy as np
+from .baseStacker import BaseStacker
+
+__all__ = ['filterNames', 'filterIndex', 'filterTable', 'getFilterIdx', 'filterLookup', 'FilterIdxStacker']
+
+# The filters, in the order of their filterIdx values.
+filterNames = ['u', 'g', 'r', 'i', 'z', 'y']
+
+
+def filterIndex(filters):
+    """Return the index in filterNames of each filter name in filters, as int8 (-1 for other filters).
+
+    Single character filter names (as in opsim) are looked up by their character code, without any
+    string comparisons; otherwise only the unique filter names are compared.
+
+    Parameters
+    ----------
+    filters : numpy.ndarray
+        The filter names (str or bytes).
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    filters = np.asarray(filters)
+    if filters.size == 0:
+        return np.zeros(filters.shape, np.int8)
+    if (filters.dtype.kind == 'U' and filters.dtype.itemsize == 4) or \
+            (filters.dtype.kind == 'S' and filters.dtype.itemsize == 1):
+        chars = np.ascontiguousarray(filters).view('u%d' % filters.dtype.itemsize)
+        lookup = np.zeros(256, np.int8) - 1
+        for i, f in enumerate(filterNames):
+            lookup[ord(f)] = i
+        return np.where(chars < 256, lookup[np.minimum(chars, 255)], -1).astype(np.int8)
+    ufilters, inverse = np.unique(filters, return_inverse=True)
+    codes = np.zeros(len(ufilters), np.int8)
+    for i, f in enumerate(ufilters):
+        if isinstance(f, bytes):
+            f = f.decode('utf-8')
+        f = str(f)
+        codes[i] = filterNames.index(f) if f in filterNames else -1
+    return codes[inverse].reshape(filters.shape)
+
+
+def filterTable(values, default=np.nan):
+    """Return a lookup table of per-filter values, to be indexed with filterIdx values.
+
+    The values for a set of visits are then a single gather (filterTable(values)[filterIdx])
+    rather than a loop over filters. The last entry of the table is the default, so
+    filters which are not in filterNames (filterIdx -1) get the default value.
+
+    Parameters
+    ----------
+    values : dict
+        The value for each filter name (such as {'u': 0.5, 'g': 0.2, ...}).
+        The values can also be tuples (such as RGB colors), giving a 2-d table.
+    default : float or tuple, optional
+        The value for filters which are not in values. Default numpy.nan.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    return np.array([values.get(f, default) for f in filterNames] + [default])
+
+
+def getFilterIdx(simData, filterCol='filter'):
+    """Return the filterIdx values for simData.
+
+    The filterIdx column is used if it is present in simData and filterCol is 'filter' (the column it
+    is added from when the data is queried); otherwise the index is calculated from filterCol.
+
+    Parameters
+    ----------
+    simData : numpy.ndarray
+        The visits (a numpy structured array).
+    filterCol : str, optional
+        The column containing the filter names. Default filter.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if filterCol == 'filter' and simData.dtype.names is not None and 'filterIdx' in simData.dtype.names:
+        return simData['filterIdx']
+    return filterIndex(simData[filterCol])
+
+
+def filterLookup(values, simData, filterCol='filter', filterIdx=None):
+    """Return the value in values for the filter of each visit in simData.
+
+    This is equivalent to [values[f] for f in simData[filterCol]], but is calculated with a single
+    gather from filterTable(values). As for the dictionary lookup, a KeyError is raised if the filter
+    of any visit is not in values (rather than returning NaN for these visits).
+
+    Parameters
+    ----------
+    values : dict
+        The value for each filter name (such as {'u': 0.5, 'g': 0.2, ...}).
+        The values can also be tuples (such as RGB colors), giving a 2-d array.
+    simData : numpy.ndarray
+        The visits (a numpy structured array).
+    filterCol : str, optional
+        The column containing the filter names. Default filter.
+    filterIdx : numpy.ndarray, optional
+        The filterIdx values of simData, if already calculated (see getFilterIdx). Default None.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if filterIdx is None:
+        filterIdx = getFilterIdx(simData, filterCol)
+    known = np.array([f in values for f in filterNames] + [False])[filterIdx]
+    if not known.all():
+        f = simData[filterCol][np.where(~known)[0][0]]
+        if isinstance(f, bytes):
+            f = f.decode('utf-8')
+        raise KeyError(str(f))
+    default = np.nan
+    if len(values) > 0:
+        default = np.full(np.shape(next(iter(values.values()))), np.nan)
+    return filterTable(values, default=default)[filterIdx]
+
+
+class FilterIdxStacker(BaseStacker):
+    """Add the index of the filter of each visit in filterNames, as an int8 column (filterIdx).
+
+    Filters which are not in filterNames have a filterIdx of -1.
+    Per-filter values can then be looked up for all visits at once, with filterTable.
+
+    Parameters
+    ----------
+    filterCol : str, optional
+        The column containing the filter names. Default filter.
+    """
+    perVisit = True
+
+    def __init__(self, filterCol='filter'):
+        self.filterCol = filterCol
+        self.units = ['']
+        self.colsAdded = ['filterIdx']
+        self.colsReq = [self.filterCol]
+        self.colsAddedDtypes = [np.int8]
+
+    def _run(self, simData):
+        simData['filterIdx'] = filterIndex(simData[self.filterCol])
+        return simData
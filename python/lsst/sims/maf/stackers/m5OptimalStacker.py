@@ -2,6 +2,7 @@ from __future__ import print_function
 import warnings
 import numpy as np
 from .baseStacker import BaseStacker
+from .filterStackers import filterLookup, getFilterIdx
 from lsst.sims.utils import Site
 
 __all__ = ['M5OptimalStacker', 'generate_sky_slopes']
@@ -61,6 +62,7 @@ class M5OptimalStacker(BaseStacker):
         Adds a column to that is approximately what the five-sigma depth would have
         been if the observation had been taken on the meridian.
     """
+    perVisit = True
 
     def __init__(self, airmassCol='airmass', decCol='fieldDec',
                  skyBrightCol='filtSkyBrightness', seeingCol='FWHMeff',
@@ -94,16 +96,16 @@ class M5OptimalStacker(BaseStacker):
                      'y': -0.69635091524779691, 'z': -0.69652846002009128}
         min_z_possible = np.abs(simData[self.decCol] - self.site.latitude_rad)
         min_airmass_possible = 1./np.cos(min_z_possible)
-        for filterName in np.unique(simData[self.filterCol]):
-            deltaSky = skySlopes[filterName]*(simData[self.airmassCol] - min_airmass_possible)
-            deltaSky[np.where((simData[self.moonAltCol] > 0) |
-                              (simData[self.sunAltCol] >  np.radians(-18.)))] = 0
-            # Using Approximation that FWHM~X^0.6. So seeing term in m5 of: 0.25 * log (7.0/FWHMeff )
-            # Goes to 0.15 log(FWHM_min / FWHM_eff) in the difference
-            m5Optimal = simData[self.m5Col] - \
-                        0.5*deltaSky - \
-                        0.15*np.log10(min_airmass_possible / simData[self.airmassCol]) - \
-                        kAtm[filterName]*(min_airmass_possible - simData[self.airmassCol])
-            good = np.where(simData[self.filterCol] == filterName)
-            simData['m5Optimal'][good] = m5Optimal[good]
+        # Look up the per-filter values for each visit.
+        filterIdx = getFilterIdx(simData, self.filterCol)
+        skySlope = filterLookup(skySlopes, simData, self.filterCol, filterIdx)
+        deltaSky = skySlope*(simData[self.airmassCol] - min_airmass_possible)
+        deltaSky[np.where((simData[self.moonAltCol] > 0) |
+                          (simData[self.sunAltCol] >  np.radians(-18.)))] = 0
+        # Using Approximation that FWHM~X^0.6. So seeing term in m5 of: 0.25 * log (7.0/FWHMeff )
+        # Goes to 0.15 log(FWHM_min / FWHM_eff) in the difference
+        simData['m5Optimal'] = simData[self.m5Col] - \
+                               0.5*deltaSky - \
+                               0.15*np.log10(min_airmass_possible / simData[self.airmassCol]) - \
+                               filterLookup(kAtm, simData, self.filterCol, filterIdx)*(min_airmass_possible - simData[self.airmassCol])
         return simData
@@ -1,5 +1,6 @@
 __all__ = ['BaseMoStacker', 'MoMagStacker', 'EclStacker']
 
+import zlib
 import numpy as np
 from .baseStacker import BaseStacker
 import warnings
@@ -9,6 +10,9 @@ class BaseMoStacker(BaseStacker):
     """Base class for moving object stackers.
 
     Provided to add moving-object specific API for 'run' method of moving object stackers."""
+    # Set Hdependent in stackers whose added columns depend on the H value.
+    Hdependent = False
+
     def run(self, ssoObs, Href, Hval=None):
         # Redefine this here, as the API does not match BaseStacker.
         if Hval is None:
@@ -22,6 +26,56 @@ class BaseMoStacker(BaseStacker):
         ssoObs = self._addStackers(ssoObs)
         return self._run(ssoObs, Href, Hval)
 
+    def runH(self, ssoObs, Href, Hvals):
+        """Add the stacker columns for all of the H values in Hvals at once.
+
+        Parameters
+        ----------
+        ssoObs : np.ndarray
+            The observations of the object.
+        Href : float
+            The H value of the orbit (used to generate ssoObs).
+        Hvals : np.ndarray
+            The H values to calculate the columns for.
+
+        Returns
+        -------
+        np.ndarray, dict
+            ssoObs (with the new columns added), and a dictionary of the values of the H-dependent columns
+            for each H value, as 2-d arrays (nH x nObs). If the stacker is not Hdependent, its columns
+            are filled in ssoObs and the dictionary is empty.
+        """
+        if len(ssoObs) == 0:
+            return ssoObs, {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ssoObs = self._addStackers(ssoObs)
+        if not self.Hdependent:
+            return self._run(ssoObs, Href, Href), {}
+        Hvals = np.asarray(Hvals, float)
+        if not self._hasRunH():
+            # A subclass which overrides _run (but not _runH) is calculated for one H value at a time.
+            return ssoObs, BaseMoStacker._runH(self, ssoObs, Href, Hvals)
+        return ssoObs, self._runH(ssoObs, Href, Hvals)
+
+    def _hasRunH(self):
+        """Return True if the _runH method of this stacker matches its _run method."""
+        for cls in type(self).__mro__:
+            if '_runH' in cls.__dict__:
+                return True
+            if '_run' in cls.__dict__:
+                return False
+        return False
+
+    def _runH(self, ssoObs, Href, Hvals):
+        # Calculate the columns for one H value at a time; stackers can override this with a vectorized version.
+        Hcols = dict((col, np.empty((len(Hvals), len(ssoObs)), float)) for col in self.colsAdded)
+        for j, Hval in enumerate(Hvals):
+            tmp = self._run(ssoObs.copy(), Href, Hval)
+            for col in self.colsAdded:
+                Hcols[col][j] = tmp[col]
+        return Hcols
+
 
 class MoMagStacker(BaseMoStacker):
     """Add columns relevant to moving object apparent magnitudes and visibility to the slicer ssoObs
@@ -52,9 +106,17 @@ class MoMagStacker(BaseMoStacker):
         Default 0.12.
         The probabilistic prediction of visibility is based on Fermi-Dirac completeness formula (see SDSS,
         eqn 24, Stripe82 analysis: http://iopscience.iop.org/0004-637X/794/2/120/pdf/apj_794_2_120.pdf).
+    randomSeed : int, opt
+        If set, the random numbers used to determine visibility come from a separate random stream for
+        each object (seeded by randomSeed and the object's objId, plus the H value when run for a single H),
+        so results are reproducible and do not depend on the order (or process) in which objects are run.
+        Default None, which uses the global numpy random state.
+    objIdCol : str, opt
+        Name of the column with the object id, used to seed the random stream for each object. Default objId.
     """
     def __init__(self, vMagCol='magV', colorCol='dmagColor', magFilterCol='magFilter',
-                 lossCol='dmagDetect', m5Col='fiveSigmaDepth', gamma=0.038, sigma=0.12):
+                 lossCol='dmagDetect', m5Col='fiveSigmaDepth', gamma=0.038, sigma=0.12,
+                 randomSeed=None, objIdCol='objId'):
         self.vMagCol = vMagCol
         self.colorCol = colorCol
         self.magFilterCol = magFilterCol
@@ -62,20 +124,66 @@ class MoMagStacker(BaseMoStacker):
         self.lossCol = lossCol
         self.gamma = gamma
         self.sigma = sigma
+        self.randomSeed = randomSeed
+        self.objIdCol = objIdCol
         self.colsReq = [self.magFilterCol, self.m5Col, self.lossCol]
         self.colsAdded = ['appMagV', 'appMag', 'SNR', 'vis']
         self.units = ['mag', 'mag', 'SNR', '']
+        self.Hdependent = True
+
+    def _randomState(self, ssoObs, Hval=None):
+        """Return the random state to use for the visibility of this object (and H value)."""
+        if self.randomSeed is None or len(ssoObs) == 0:
+            return np.random
+        # Use crc32 rather than hash, as string hashes are not reproducible between python processes.
+        seed = [self.randomSeed, zlib.crc32(str(ssoObs[self.objIdCol][0]).encode('utf-8')) & 0xffffffff]
+        if Hval is not None:
+            seed.append(zlib.crc32(('%.6f' % Hval).encode('utf-8')) & 0xffffffff)
+        return np.random.RandomState(seed)
+
+    def _snr(self, xval):
+        """Calculate the SNR, given xval = 10**(0.5*(appMag - m5))."""
+        return 1.0 / np.sqrt(xval * ((0.04 - self.gamma) + self.gamma * xval))
+
+    def _visThreshold(self, probability):
+        """Return the largest appMag - m5 for which each observation is visible, given its random draw.
+
+        The observation is visible if probability <= 1 / (1 + exp((appMag - m5) / sigma)),
+        which is equivalent to (appMag - m5) <= sigma * log(1 / probability - 1).
+        """
+        with np.errstate(divide='ignore'):
+            return self.sigma * (np.log1p(-probability) - np.log(probability))
 
     def _run(self, ssoObs, Href, Hval):
         ssoObs['appMagV'] = ssoObs[self.vMagCol] + Hval - Href + ssoObs[self.lossCol]
         ssoObs['appMag'] = ssoObs[self.magFilterCol] + Hval - Href + ssoObs[self.lossCol]
-        xval = np.power(10, 0.5 * (ssoObs['appMag'] - ssoObs[self.m5Col]))
-        ssoObs['SNR'] = 1.0 / np.sqrt((0.04 - self.gamma) * xval + self.gamma * xval * xval)
-        completeness = 1.0 / (1 + np.exp((ssoObs['appMag'] - ssoObs[self.m5Col])/self.sigma))
-        probability = np.random.random_sample(len(ssoObs['appMag']))
-        ssoObs['vis'] = np.where(probability <= completeness, 1, 0)
+        dmag = ssoObs['appMag'] - ssoObs[self.m5Col]
+        ssoObs['SNR'] = self._snr(np.power(10, 0.5 * dmag))
+        probability = self._randomState(ssoObs, Hval).random_sample(len(ssoObs['appMag']))
+        ssoObs['vis'] = np.where(dmag <= self._visThreshold(probability), 1, 0)
         return ssoObs
 
+    def _runH(self, ssoObs, Href, Hvals):
+        # The apparent magnitudes change with H only by an additive offset, so all H values are
+        # calculated at once as (nH x nObs) arrays. The SNR and visibility depend only on appMag - m5,
+        # so the transcendental functions are evaluated once per observation (and once per H value)
+        # rather than for every observation and H value.
+        dH = Hvals - Href
+        magFilter = ssoObs[self.magFilterCol] + ssoObs[self.lossCol]
+        dmag = magFilter - ssoObs[self.m5Col]
+        Hcols = {}
+        Hcols['appMagV'] = (ssoObs[self.vMagCol] + ssoObs[self.lossCol]) + dH[:, np.newaxis]
+        Hcols['appMag'] = magFilter + dH[:, np.newaxis]
+        # 10**(0.5*(dmag + dH)) = 10**(0.5*dmag) * 10**(0.5*dH).
+        xval = np.outer(np.power(10, 0.5 * dH), np.power(10, 0.5 * dmag))
+        Hcols['SNR'] = self._snr(xval)
+        # A single random draw per observation is shared by all H values, so that the visible
+        # observations at fainter H are always a subset of those at brighter H.
+        probability = self._randomState(ssoObs).random_sample(len(ssoObs))
+        # The observation is visible for all H with dH <= threshold - dmag.
+        Hcols['vis'] = np.where(dH[:, np.newaxis] <= (self._visThreshold(probability) - dmag), 1, 0)
+        return Hcols
+
 
 class EclStacker(BaseMoStacker):
     """Add ecliptic latitude/longitude (ecLat/ecLon) to the slicer ssoObs (in degrees).
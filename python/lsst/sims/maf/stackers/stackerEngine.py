@@ -0,0 +1,257 @@
+from builtins import object
+import warnings
+import numpy as np
+
+__all__ = ['orderStackers', 'StackerEngine']
+
+
+def orderStackers(stackerList):
+    """Order stackers so that each stacker runs after the stackers which add the columns it requires.
+
+    The dependencies are found from the colsReq and colsAdded of each stacker. Stackers which do not
+    depend on each other keep their order in stackerList.
+
+    Parameters
+    ----------
+    stackerList : list of Stackers
+        The stackers to order.
+
+    Returns
+    -------
+    list of Stackers
+        The stackers, in an order in which they can be run.
+    """
+    stackerList = list(stackerList)
+    # The stackers which each stacker depends on (by index in stackerList).
+    upstream = []
+    for i, s in enumerate(stackerList):
+        deps = set()
+        for j, other in enumerate(stackerList):
+            if j != i and len(set(s.colsReq) & set(other.colsAdded)) > 0:
+                deps.add(j)
+        upstream.append(deps)
+    ordered = []
+    done = set()
+    while len(ordered) < len(stackerList):
+        ready = [i for i in range(len(stackerList)) if i not in done and upstream[i] <= done]
+        if len(ready) == 0:
+            cycle = [stackerList[i].__class__.__name__ for i in range(len(stackerList)) if i not in done]
+            raise ValueError('Stackers %s have circular column dependencies.' % (', '.join(cycle)))
+        # Take the first stacker which is ready, so independent stackers keep their order.
+        ordered.append(ready[0])
+        done.add(ready[0])
+    return [stackerList[i] for i in ordered]
+
+
+class StackerEngine(object):
+    """Run stackers in dependency order, caching the columns added by per-visit stackers.
+
+    The columns added by a stacker with perVisit = True depend only on the other columns of the same
+    visit, so they are the same for every subset of visits (such as the visits matching different
+    constraints, or each compatible list of metric bundles). The engine keeps the values of these
+    columns for every visit it has seen, keyed by visitIdCol; when the same stacker is run again, the
+    cached values are gathered for the visits already calculated, and the stacker is only run on the
+    new visits. Over a series of constraints, each per-visit stacker is then run once over the union
+    of the visits.
+
+    Stackers which are not per-visit (such as the dither stackers, whose offsets depend on the other
+    visits to the same field) and stackers which depend on them are always run on the full simData.
+
+    Per-visit stackers can also be deferred (see run and fill): their columns are then only calculated
+    for the rows of simData which are actually used (such as the visits in each dataSlice), when they
+    are first used. Cached values are gathered for all of the visits when the stacker is deferred, and
+    the rows calculated by fill are only added to the cache (in one step) by cacheDeferred.
+
+    Parameters
+    ----------
+    visitIdCol : str, optional
+        The column which uniquely identifies each visit. If None, or if this column is not in simData
+        (or its values are not unique), nothing is cached. Default expMJD.
+    """
+    def __init__(self, visitIdCol='expMJD'):
+        self.visitIdCol = visitIdCol
+        # List of [stacker, sorted visit ids, dict of column values (in the order of the visit ids)].
+        self._cache = []
+        # List of [stacker, boolean array of the rows of simData already calculated,
+        #  boolean array of the rows already in the cache] for deferred stackers.
+        self._deferred = []
+        self._deferredCache = False
+
+    def clear(self):
+        """Remove all cached stacker columns."""
+        self._cache = []
+
+    def _lookup(self, stacker):
+        for entry in self._cache:
+            if entry[0] is stacker or entry[0] == stacker:
+                return entry
+        return None
+
+    @property
+    def deferredCols(self):
+        """The columns added by the deferred stackers (which may not be calculated for every row yet)."""
+        cols = []
+        for stacker, computed, cached in self._deferred:
+            cols += list(stacker.colsAdded)
+        return cols
+
+    def _canCache(self, simData):
+        if self.visitIdCol is None or self.visitIdCol not in simData.dtype.names:
+            return False
+        ids = simData[self.visitIdCol]
+        return len(np.unique(ids)) == len(ids)
+
+    def run(self, simData, stackerList, eagerCols=None):
+        """Run the stackers on simData, gathering cached values where possible.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The visits (a numpy structured array).
+        stackerList : list of Stackers
+            The stackers to run.
+        eagerCols : list of str, optional
+            If set, the per-visit stackers whose columns are not in eagerCols (and are not required by any
+            stacker which is run now) are deferred: their columns are added to simData (filled with NaN
+            for float columns), but only calculated for the rows passed to fill.
+            Default None (run all of the stackers now).
+
+        Returns
+        -------
+        numpy.ndarray
+            simData, with the stacker columns added.
+        """
+        stackerList = orderStackers(stackerList)
+        self._deferred = []
+        if len(simData) == 0:
+            return simData
+        canCache = self._canCache(simData)
+        # Find the stackers whose columns depend only on the visit itself.
+        nonVisitCols = set()
+        perVisit = []
+        for stacker in stackerList:
+            perVisit.append(getattr(stacker, 'perVisit', False) and
+                            len(set(stacker.colsReq) & nonVisitCols) == 0)
+            if not perVisit[-1]:
+                nonVisitCols.update(stacker.colsAdded)
+        # Find the per-visit stackers which can be deferred, working back from the columns needed now.
+        defer = [False] * len(stackerList)
+        if eagerCols is not None:
+            needed = set(eagerCols)
+            for i in range(len(stackerList) - 1, -1, -1):
+                stacker = stackerList[i]
+                defer[i] = perVisit[i] and len(set(stacker.colsAdded) & needed) == 0
+                if not defer[i]:
+                    needed.update(stacker.colsReq)
+        for stacker, cacheable, deferred in zip(stackerList, perVisit, defer):
+            if deferred:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    simData = stacker._addStackers(simData)
+                for col in stacker.colsAdded:
+                    if simData[col].dtype.kind == 'f':
+                        simData[col] = np.nan
+                computed = np.zeros(len(simData), bool)
+                entry = self._lookup(stacker) if canCache else None
+                if entry is not None:
+                    # Gather the values of the visits which are already cached.
+                    idx, computed = self._match(entry, simData[self.visitIdCol])
+                    for col in stacker.colsAdded:
+                        simData[col][computed] = entry[2][col][idx[computed]]
+                self._deferred.append([stacker, computed, computed.copy()])
+            elif cacheable and canCache:
+                simData = self._runCached(simData, stacker)
+            else:
+                simData = stacker.run(simData)
+        self._deferredCache = canCache
+        return simData
+
+    def fill(self, simData, idxs):
+        """Calculate the columns of the deferred stackers for the rows idxs of simData (in place).
+
+        Rows which have already been calculated (or were gathered from the cache) are not recalculated.
+        The new rows are not added to the cache until cacheDeferred is called.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The visits, as returned by run.
+        idxs : numpy.ndarray or list
+            The indexes (or boolean mask) of the rows of simData which will be used.
+        """
+        if len(self._deferred) == 0:
+            return
+        idxs = np.asarray(idxs)
+        if idxs.dtype == bool:
+            idxs = np.where(idxs)[0]
+        idxs = idxs.astype(int)
+        for stacker, computed, cached in self._deferred:
+            rows = idxs[~computed[idxs]]
+            if len(rows) == 0:
+                continue
+            with warnings.catch_warnings():
+                # The (deferred) columns are already present in simData.
+                warnings.simplefilter('ignore')
+                subset = stacker.run(simData[rows])
+            for col in stacker.colsAdded:
+                simData[col][rows] = subset[col]
+            computed[rows] = True
+
+    def cacheDeferred(self, simData):
+        """Add the rows of simData calculated by fill to the cache.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The visits, as passed to fill.
+        """
+        if not self._deferredCache:
+            return
+        for deferred in self._deferred:
+            stacker, computed, cached = deferred
+            new = computed & ~cached
+            if new.any():
+                self._addToCache(stacker, simData[new])
+            deferred[2] = computed.copy()
+
+    def _match(self, entry, ids):
+        """Return the position of each of ids in the cache entry, and whether it is in the cache."""
+        cachedIds = entry[1]
+        idx = np.clip(np.searchsorted(cachedIds, ids), 0, len(cachedIds) - 1)
+        return idx, cachedIds[idx] == ids
+
+    def _addToCache(self, stacker, simData):
+        """Add the stacker columns of simData (visits which are not yet cached) to the cache."""
+        ids = simData[self.visitIdCol]
+        entry = self._lookup(stacker)
+        if entry is None:
+            order = np.argsort(ids)
+            values = dict([(col, simData[col][order]) for col in stacker.colsAdded])
+            self._cache.append([stacker, ids[order], values])
+            return
+        cachedIds = np.concatenate([entry[1], ids])
+        order = np.argsort(cachedIds)
+        for col in stacker.colsAdded:
+            entry[2][col] = np.concatenate([entry[2][col], simData[col]])[order]
+        entry[1] = cachedIds[order]
+
+    def _runCached(self, simData, stacker):
+        ids = simData[self.visitIdCol]
+        entry = self._lookup(stacker)
+        if entry is None:
+            simData = stacker.run(simData)
+            self._addToCache(stacker, simData)
+            return simData
+        idx, known = self._match(entry, ids)
+        if not known.all():
+            # Run the stacker on the visits which have not been seen before, and add them to the cache.
+            self._addToCache(stacker, stacker.run(simData[~known]))
+            idx = np.searchsorted(entry[1], ids)
+        values = entry[2]
+        with warnings.catch_warnings():
+            # The columns may already be present, if a stacker is run again (as by BaseStacker.run).
+            warnings.simplefilter('ignore')
+            simData = stacker._addStackers(simData)
+        for col in stacker.colsAdded:
+            simData[col] = values[col][idx]
+        return simData
@@ -3,3 +3,8 @@ from .getDateVersion import *
 from .outputUtils import *
 from .opsimUtils import *
 from .astrometryUtils import *
+from .almanac import *
+from .windowUtils import *
+from .columnCache import *
+from .raggedValues import *
+from .sliceUtils import *
@@ -0,0 +1,163 @@
+from builtins import zip
+from builtins import range
+from builtins import object
+import os
+import warnings
+import numpy as np
+
+__all__ = ['Almanac']
+
+
+class Almanac(object):
+    """Per-night table of local midnight, twilight times and moon phase at a site.
+
+    The sun and moon events are found with pyephem root-finding, which is slow; the almanac
+    computes each night once (in blocks of 'blockSize' days), caches the blocks in memory and
+    optionally on disk, and then answers lookups for arrays of times with np.searchsorted.
+
+    Each row of the almanac table holds (all times in MJD):
+    'midnight' (the time of the sun's antitransit), 'moonPer' (the moon phase, percent illuminated,
+    at midnight), and 'twi6_rise', 'twi6_set', 'twi12_rise', 'twi12_set', 'twi18_rise', 'twi18_set'
+    (the next sunrise and previous sunset, with the sun center at -6, -12 and -18 degrees).
+
+    Parameters
+    ----------
+    latitude : float
+        The latitude of the site, in radians.
+    longitude : float
+        The longitude of the site, in radians.
+    height : float
+        The elevation of the site, in meters.
+    cacheDir : str, optional
+        Directory in which to save (and look for) almanac blocks. If None, the almanac is only
+        cached in memory. Default None.
+    blockSize : int, optional
+        The number of days to compute (and save) at a time. Default 1000.
+    """
+    names = ['midnight', 'moonPer', 'twi6_rise', 'twi6_set', 'twi12_rise',
+             'twi12_set', 'twi18_rise', 'twi18_set']
+    horizons = ['-6', '-12', '-18']
+    keys = ['twi6', 'twi12', 'twi18']
+
+    def __init__(self, latitude, longitude, height, cacheDir=None, blockSize=1000):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.height = height
+        self.cacheDir = cacheDir
+        self.blockSize = int(blockSize)
+        self.blocks = {}
+        self.table = np.zeros(0, dtype=list(zip(self.names, [float]*len(self.names))))
+
+    def _cacheFile(self, block):
+        filename = 'almanac_%.5f_%.5f_%.0f_%d_%d.npz' % (np.degrees(self.latitude), np.degrees(self.longitude),
+                                                         self.height, self.blockSize, block)
+        return os.path.join(self.cacheDir, filename)
+
+    def _computeBlock(self, block):
+        """Calculate the almanac for the midnights falling within block."""
+        import ephem
+        # pyephem uses 1899/12/31 12:00 as its zero-day, and MJD has Nov 17 1858 as zero-day.
+        doff = ephem.Date(0) - ephem.Date('1858/11/17')
+        obsList = []
+        for h in [None] + self.horizons:
+            obs = ephem.Observer()
+            obs.lat, obs.lon, obs.elevation = self.latitude, self.longitude, self.height
+            if h is not None:
+                obs.horizon = h
+            obsList.append(obs)
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        start = block * self.blockSize - doff
+        end = start + self.blockSize
+        midnights = []
+        midnight = obsList[0].next_antitransit(sun, start=start)
+        while midnight < end:
+            midnights.append(float(midnight))
+            midnight = obsList[0].next_antitransit(sun, start=midnight + 0.5)
+        table = np.zeros(len(midnights), dtype=self.table.dtype)
+        for i, midnight in enumerate(midnights):
+            table['midnight'][i] = midnight + doff
+            moon.compute(midnight)
+            table['moonPer'][i] = moon.phase
+            for key, obs in zip(self.keys, obsList[1:]):
+                try:
+                    table[key + '_rise'][i] = obs.next_rising(sun, start=midnight, use_center=True) + doff
+                    table[key + '_set'][i] = obs.previous_setting(sun, start=midnight, use_center=True) + doff
+                except (ephem.AlwaysUpError, ephem.NeverUpError):
+                    table[key + '_rise'][i] = np.nan
+                    table[key + '_set'][i] = np.nan
+        return table
+
+    def _loadBlock(self, block):
+        """Read block from the disk cache if possible, otherwise calculate it (and save it)."""
+        if self.cacheDir is not None:
+            cacheFile = self._cacheFile(block)
+            if os.path.isfile(cacheFile):
+                return np.load(cacheFile)['almanac']
+        table = self._computeBlock(block)
+        if self.cacheDir is not None:
+            try:
+                if not os.path.isdir(self.cacheDir):
+                    os.makedirs(self.cacheDir)
+                np.savez(cacheFile, almanac=table)
+            except (IOError, OSError) as e:
+                warnings.warn('Could not save almanac to %s: %s' % (cacheFile, e))
+        return table
+
+    def setRange(self, mjdMin, mjdMax):
+        """Make sure the almanac covers mjdMin to mjdMax (with a day to spare on either side).
+
+        Parameters
+        ----------
+        mjdMin : float
+            The earliest time to cover.
+        mjdMax : float
+            The latest time to cover.
+        """
+        blockMin = int(np.floor((mjdMin - 1.) / self.blockSize))
+        blockMax = int(np.floor((mjdMax + 1.) / self.blockSize))
+        newBlocks = False
+        for block in range(blockMin, blockMax + 1):
+            if block not in self.blocks:
+                self.blocks[block] = self._loadBlock(block)
+                newBlocks = True
+        if newBlocks:
+            self.table = np.concatenate([self.blocks[b] for b in sorted(self.blocks)])
+
+    def nearestNight(self, mjd):
+        """Find the almanac row with the midnight nearest to each time in mjd.
+
+        Parameters
+        ----------
+        mjd : float or numpy.ndarray
+            The times (MJD) to look up.
+
+        Returns
+        -------
+        int or numpy.ndarray
+            The index of the nearest night in self.table.
+        """
+        mjd = np.asarray(mjd)
+        if mjd.size > 0:
+            self.setRange(mjd.min(), mjd.max())
+        midnights = self.table['midnight']
+        idx = np.clip(np.searchsorted(midnights, mjd), 1, midnights.size - 1)
+        previous = (mjd - midnights[idx - 1]) < (midnights[idx] - mjd)
+        return np.where(previous, idx - 1, idx)
+
+    def getNights(self, mjd):
+        """Return the almanac rows with the midnight nearest to each time in mjd.
+
+        Parameters
+        ----------
+        mjd : float or numpy.ndarray
+            The times (MJD) to look up.
+
+        Returns
+        -------
+        numpy.ndarray
+            The almanac rows (a numpy structured array).
+        """
+        # Find the indexes first, as this may extend the almanac table.
+        idx = self.nearestNight(mjd)
+        return self.table[idx]
@@ -0,0 +1,87 @@
+import os
+import warnings
+import numpy as np
+
+__all__ = ['readColumnCache', 'writeColumnCache']
+
+
+def _cachePath(filename, cacheDir=None):
+    """Return the directory holding the column cache for filename."""
+    if cacheDir is None:
+        cacheDir = os.path.dirname(os.path.abspath(filename))
+    return os.path.join(cacheDir, os.path.basename(filename) + '.columns')
+
+
+def readColumnCache(filename, cacheDir=None):
+    """Read the binary columnar copy of a text file, if it exists and is newer than the text file.
+
+    Parameters
+    ----------
+    filename : str
+        The text file which was cached.
+    cacheDir : str, optional
+        The directory containing the cache. Default None (the directory of filename).
+
+    Returns
+    -------
+    dict or None
+        A dictionary of column name: memory-mapped numpy array, in the original column order,
+        or None if there is no valid cache.
+    """
+    cachePath = _cachePath(filename, cacheDir)
+    indexFile = os.path.join(cachePath, 'columns.txt')
+    if not os.path.isfile(indexFile):
+        return None
+    # Invalidate the cache if the source file has been modified since the cache was written.
+    if os.path.isfile(filename) and os.path.getmtime(filename) > os.path.getmtime(indexFile):
+        return None
+    with open(indexFile, 'r') as f:
+        names = [line.rstrip('\n') for line in f]
+    columns = {}
+    for i, name in enumerate(names):
+        columns[name] = np.load(os.path.join(cachePath, '%d.npy' % i), mmap_mode='r')
+    return columns
+
+
+def writeColumnCache(data, filename, cacheDir=None, sortCol=None):
+    """Write a binary columnar copy of the data read from a text file (one .npy file per column).
+
+    Later reads of filename can then memory-map the columns with readColumnCache, rather than
+    parsing the text again. String (object) columns are stored as fixed width unicode.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data read from filename.
+    filename : str
+        The text file the data was read from.
+    cacheDir : str, optional
+        The directory to write the cache into. Default None (the directory of filename).
+    sortCol : str, optional
+        If set, the rows are (stably) sorted on this column before they are written. Default None.
+    """
+    cachePath = _cachePath(filename, cacheDir)
+    indexFile = os.path.join(cachePath, 'columns.txt')
+    if sortCol is not None:
+        order = np.argsort(data[sortCol].values, kind='mergesort')
+    else:
+        order = None
+    try:
+        if not os.path.isdir(cachePath):
+            os.makedirs(cachePath)
+        # Remove the old index first, so that a partially written cache is never used.
+        if os.path.isfile(indexFile):
+            os.remove(indexFile)
+        names = [str(name) for name in data.columns]
+        for i, name in enumerate(data.columns):
+            values = data[name].values
+            if values.dtype == object:
+                values = values.astype(str)
+            if order is not None:
+                values = values[order]
+            np.save(os.path.join(cachePath, '%d.npy' % i), values)
+        with open(indexFile, 'w') as f:
+            for name in names:
+                f.write('%s\n' % name)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not write column cache for %s to %s: %s' % (filename, cachePath, e))
@@ -4,6 +4,7 @@ from __future__ import print_function
 import os
 import numpy as np
 from .outputUtils import printDict
+from lsst.sims.maf.stackers import StackerEngine, FilterIdxStacker
 import warnings
 
 __all__ = ['connectOpsimDb', 'writeConfigs', 'createSQLWhere',
@@ -150,10 +151,13 @@ def getFieldData(opsimDb, sqlconstraint):
     return fieldData
 
 def getSimData(opsimDb, sqlconstraint, dbcols, stackers=None, tableName='Summary', distinctExpMJD=True,
-               groupBy='expMJD'):
+               groupBy='expMJD', stackerEngine=None):
     """
     Query an opsim database for the needed data columns and run any required stackers.
 
+    If the filter column is queried, the integer filterIdx column is also added (see FilterIdxStacker),
+    so that per-filter values can be looked up without comparing filter names.
+
     Parameters
     ----------
     opsimDb : OpsimDatabase
@@ -169,22 +173,29 @@ def getSimData(opsimDb, sqlconstraint, dbcols, stackers=None, tableName='Summary
         Only select observations with a distinct expMJD value. This is overriden if groupBy is not expMJD.
     groupBy : str
         Column name to group SQL results by.
+    stackerEngine : StackerEngine, opt
+        The StackerEngine used to run the stackers (in dependency order, reusing any columns it has
+        cached for these visits). Default None, which uses a new StackerEngine.
 
     Returns
     -------
     numpy.ndarray
-        A numpy structured array with columns resulting from dbcols + stackers, for observations matching
-        the SQLconstraint.
+        A numpy structured array with columns resulting from dbcols + stackers (and filterIdx),
+        for observations matching the SQLconstraint.
     """
     # Get data from database.
     simData = opsimDb.fetchMetricData(dbcols, sqlconstraint, tableName=tableName,
                                       distinctExpMJD=distinctExpMJD, groupBy=groupBy)
     if len(simData) == 0:
         raise UserWarning('No data found matching sqlconstraint %s' %(sqlconstraint))
+    # Add the filter index once, here, rather than comparing filter names in each stacker and metric.
+    if 'filter' in simData.dtype.names and 'filterIdx' not in simData.dtype.names:
+        simData = FilterIdxStacker().run(simData)
     # Now add the stacker columns.
     if stackers is not None:
-        for s in stackers:
-            simData = s.run(simData)
+        if stackerEngine is None:
+            stackerEngine = StackerEngine()
+        simData = stackerEngine.run(simData, stackers)
     return simData
 
 
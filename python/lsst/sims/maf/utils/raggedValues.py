@@ -0,0 +1,207 @@
+from builtins import zip
+from builtins import object
+import numpy as np
+import numpy.ma as ma
+
+__all__ = ['RaggedMetricValues']
+
+
+class RaggedMetricValues(object):
+    """Compact storage for metric values which are a dictionary of arrays of varying length
+    (such as the 'start', 'end' and 'trackletNights' returned by the DiscoveryMetric).
+
+    Instead of an object-dtype masked array holding a python dictionary for each (object, H value),
+    the values of each column are appended to a single flat array, and the first index and length
+    of each value are kept in (nSso x nH) index arrays. A value which is set for several H values
+    (the same dictionary object, set consecutively) is only stored once.
+
+    The values can be set and retrieved with values[i, j] (returning a dictionary of arrays, or
+    numpy.ma.masked), and the values for a subset of objects with values[rows].
+    The 'mask' attribute is a boolean numpy array (as for a numpy masked array).
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the metric values (nSso x nH).
+    cols : list of (str, dtype)
+        The names and dtypes of the columns to store (other keys in the values are not stored).
+    fill_value : object, optional
+        The value reported for masked values (as for a masked array). Default None.
+    """
+    def __init__(self, shape, cols, fill_value=None):
+        self.shape = tuple(shape)
+        self.cols = [(name, np.dtype(dt)) for name, dt in cols]
+        self.fill_value = fill_value
+        # Values which have not been set are masked.
+        self.mask = np.ones(self.shape, bool)
+        self._first = {}
+        self._length = {}
+        self._chunks = {}
+        self._flat = {}
+        for name, dt in self.cols:
+            self._first[name] = np.zeros(self.shape, np.int64)
+            self._length[name] = np.zeros(self.shape, np.int32)
+            self._chunks[name] = []
+            self._flat[name] = np.zeros(0, dt)
+        self._size = dict([(name, 0) for name, dt in self.cols])
+        self._last = None
+
+    @property
+    def names(self):
+        return [name for name, dt in self.cols]
+
+    def _flatValues(self, name):
+        """Return the flat array of the values of column name (joining any values appended since last time)."""
+        if len(self._chunks[name]) > 0:
+            self._flat[name] = np.concatenate([self._flat[name]] + self._chunks[name])
+            self._chunks[name] = []
+        return self._flat[name]
+
+    def _append(self, name, values):
+        values = np.asarray(values, dtype=self._flat[name].dtype)
+        first = self._size[name]
+        self._chunks[name].append(values)
+        self._size[name] += len(values)
+        return first, len(values)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple):
+            if value is ma.masked:
+                self.mask[key] = True
+                return
+            # Reuse the stored values if this is the same value as was last set (such as for consecutive H values).
+            if self._last is not None and self._last[0] is value:
+                spans = self._last[1]
+            else:
+                spans = dict([(name, self._append(name, value[name])) for name in self.names])
+                self._last = (value, spans)
+            for name in self.names:
+                self._first[name][key], self._length[name][key] = spans[name]
+            self.mask[key] = False
+        else:
+            # Set the values for a set of objects from another RaggedMetricValues (as returned by values[rows]).
+            for name in self.names:
+                first, length = self._append(name, value._flatValues(name))
+                self._first[name][key] = value._first[name] + first
+                self._length[name][key] = value._length[name]
+            self.mask[key] = value.mask
+            self._last = None
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if self.mask[key]:
+                return ma.masked
+            result = {}
+            for name in self.names:
+                first = self._first[name][key]
+                result[name] = self._flatValues(name)[first:first + self._length[name][key]]
+            return result
+        return self._take(key)
+
+    def _take(self, rows):
+        """Return a new RaggedMetricValues holding (a compact copy of) the values for the objects in rows."""
+        mask = self.mask[rows]
+        subset = RaggedMetricValues(mask.shape, self.cols, fill_value=self.fill_value)
+        subset.mask = mask.copy()
+        for name in self.names:
+            first = np.where(mask, 0, self._first[name][rows])
+            length = np.where(mask, 0, self._length[name][rows])
+            # Values shared between H values are stored once, so copy each distinct value only once.
+            ufirst, inverse = np.unique(first, return_inverse=True)
+            ulength = np.zeros(len(ufirst), np.int64)
+            np.maximum.at(ulength, inverse, length.ravel())
+            offsets = np.concatenate([[0], np.cumsum(ulength)[:-1]]).astype(np.int64)
+            idx = np.repeat(ufirst - offsets, ulength) + np.arange(ulength.sum())
+            subset._flat[name] = self._flatValues(name)[idx]
+            subset._size[name] = len(idx)
+            subset._first[name] = offsets[inverse].reshape(mask.shape)
+            subset._length[name] = length.astype(np.int32)
+        return subset
+
+    def filled(self, fill_value=None):
+        """Return the values as an object-dtype array of dictionaries, with masked values set to fill_value.
+
+        Parameters
+        ----------
+        fill_value : object, optional
+            The value to use for masked values. Default None (use self.fill_value).
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        if fill_value is None:
+            fill_value = self.fill_value
+        data = np.empty(self.shape, 'object')
+        data[self.mask] = fill_value
+        for idx in zip(*np.where(~self.mask)):
+            data[idx] = self[idx]
+        return data
+
+    def toMaskedArray(self):
+        """Return the values as an object-dtype masked array of dictionaries.
+
+        Returns
+        -------
+        numpy.ma.MaskedArray
+        """
+        return ma.MaskedArray(data=self.filled(), mask=self.mask.copy(), fill_value=self.fill_value)
+
+    def toHdf(self, filename, key='ragged'):
+        """Write the values to an HDF5 file (adding to any other data in the file).
+
+        Parameters
+        ----------
+        filename : str
+            The HDF5 file.
+        key : str, optional
+            The group in the file in which to store the values. Default 'ragged'.
+        """
+        import pandas as pd
+        compact = self._take(slice(None))
+        with pd.HDFStore(filename, 'a') as store:
+            store.put('%s/shape' % key, pd.Series(np.array(self.shape)))
+            store.put('%s/names' % key, pd.Series(self.names))
+            store.put('%s/mask' % key, pd.Series(compact.mask.ravel()))
+            for name in self.names:
+                store.put('%s/%s/first' % (key, name), pd.Series(compact._first[name].ravel()))
+                store.put('%s/%s/length' % (key, name), pd.Series(compact._length[name].ravel()))
+                store.put('%s/%s/values' % (key, name), pd.Series(compact._flat[name]))
+
+    @classmethod
+    def fromHdf(cls, filename, key='ragged', fill_value=None):
+        """Read values written with toHdf.
+
+        Parameters
+        ----------
+        filename : str
+            The HDF5 file.
+        key : str, optional
+            The group in the file in which the values are stored. Default 'ragged'.
+        fill_value : object, optional
+            The value reported for masked values. Default None.
+
+        Returns
+        -------
+        RaggedMetricValues
+        """
+        import pandas as pd
+        with pd.HDFStore(filename, 'r') as store:
+            shape = tuple(store['%s/shape' % key].values)
+            names = list(store['%s/names' % key].values)
+            values = dict([(name, store['%s/%s/values' % (key, name)].values) for name in names])
+            ragged = cls(shape, [(name, values[name].dtype) for name in names], fill_value=fill_value)
+            ragged.mask = store['%s/mask' % key].values.reshape(shape).astype(bool)
+            for name in names:
+                ragged._first[name] = store['%s/%s/first' % (key, name)].values.reshape(shape)
+                ragged._length[name] = store['%s/%s/length' % (key, name)].values.reshape(shape)
+                ragged._flat[name] = values[name]
+                ragged._size[name] = len(values[name])
+        return ragged
+
+    @staticmethod
+    def inHdf(filename, key='ragged'):
+        """Return True if filename contains values written with toHdf."""
+        import pandas as pd
+        with pd.HDFStore(filename, 'r') as store:
+            return ('/%s/mask' % key) in store.keys()
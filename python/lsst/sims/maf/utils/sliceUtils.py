@@ -0,0 +1,33 @@
+import numpy as np
+
+__all__ = ['stackSlices']
+
+
+def stackSlices(dataSlices, col):
+    """Group dataSlices with the same number of visits, stacking the values of col for each group.
+
+    Metrics which can be calculated along the last axis of an array (such as an FFT or a sort)
+    can then be run on every dataSlice in a group with a single numpy call.
+
+    Parameters
+    ----------
+    dataSlices : list of numpy.ndarray
+        The dataSlices (numpy structured arrays) to group.
+    col : str
+        The column to stack.
+
+    Returns
+    -------
+    list of (numpy.ndarray, numpy.ndarray)
+        For each distinct length, the indexes of the dataSlices (in the input list) of that length
+        and a 2-d array of their values of col (one row per dataSlice).
+    """
+    lengths = np.array([len(dataSlice) for dataSlice in dataSlices], int)
+    groups = []
+    for length in np.unique(lengths):
+        indexes = np.where(lengths == length)[0]
+        values = np.empty((len(indexes), length), dtype=float)
+        for row, i in enumerate(indexes):
+            values[row] = dataSlices[i][col]
+        groups.append((indexes, values))
+    return groups
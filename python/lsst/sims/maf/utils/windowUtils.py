@@ -0,0 +1,69 @@
+import numpy as np
+
+__all__ = ['windowEnds', 'windowCounts', 'windowSums']
+
+
+def windowEnds(values, width, side='left'):
+    """Find the end of the window [values[i], values[i] + width) starting at each value.
+
+    This replaces a loop selecting the values within each window (which is quadratic in the number
+    of values) with a single search of the sorted values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values (such as times or nights), sorted in increasing order.
+    width : float or numpy.ndarray
+        The width of the window starting at each value (a float, or an array with one width per value).
+    side : str, optional
+        'left' if the end of the window is excluded (values[i] + width is not in the window) or
+        'right' if it is included. Default 'left'.
+
+    Returns
+    -------
+    numpy.ndarray
+        The index one past the last value within the window starting at each value.
+    """
+    values = np.asarray(values)
+    return np.searchsorted(values, values + width, side=side)
+
+
+def windowCounts(values, width, side='left'):
+    """Count the number of values within the window [values[i], values[i] + width) starting at each value.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values, sorted in increasing order.
+    width : float or numpy.ndarray
+        The width of the window starting at each value.
+    side : str, optional
+        'left' to exclude values[i] + width from the window, 'right' to include it. Default 'left'.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of values in each window (including values[i] itself).
+    """
+    return windowEnds(values, width, side=side) - np.arange(len(values))
+
+
+def windowSums(weights, starts, ends):
+    """Sum weights[starts[i]:ends[i]] for each window, using a cumulative sum.
+
+    Parameters
+    ----------
+    weights : numpy.ndarray
+        The value to sum for each point.
+    starts : numpy.ndarray
+        The index of the first point in each window.
+    ends : numpy.ndarray
+        The index one past the last point in each window (as returned by windowEnds).
+
+    Returns
+    -------
+    numpy.ndarray
+        The sum of the weights within each window.
+    """
+    cumulative = np.concatenate([[0], np.cumsum(weights)])
+    return cumulative[ends] - cumulative[starts]
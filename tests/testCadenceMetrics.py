@@ -44,6 +44,46 @@ class TestCadenceMetrics(unittest.TestCase):
         assert(worstPeriod == 0.25)
         assert(largestGap == 1.)
 
+    def testPhaseGapRunMany(self):
+        """
+        Test the phase gap metric gives the same results for a batch of dataSlices.
+        """
+        rng = np.random.RandomState(42)
+        dataSlices = []
+        for nvisits in [1, 2, 10, 25, 10, 25, 7]:
+            data = np.zeros(nvisits, dtype=list(zip(['expMJD'], [float])))
+            data['expMJD'] = rng.rand(nvisits) * 100.
+            dataSlices.append(data)
+        pgm = metrics.PhaseGapMetric(nPeriods=5, periodMin=0.5, periodMax=4.)
+        results = pgm.runMany(dataSlices)
+        for data, result in zip(dataSlices, results):
+            expected = pgm.run(data)
+            if len(data) < pgm.nVisitsMin:
+                self.assertEqual(result, pgm.badval)
+                continue
+            np.testing.assert_equal(result['periods'], expected['periods'])
+            np.testing.assert_allclose(result['maxGaps'], expected['maxGaps'])
+            # Check against the phases folded one period at a time.
+            for period, maxGap in zip(expected['periods'], expected['maxGaps']):
+                phases = np.sort((data['expMJD'] % period) / period)
+                gaps = np.concatenate([np.diff(phases), [1.0 - phases[-1] + phases[0]]])
+                self.assertAlmostEqual(maxGap, gaps.max())
+
+    def testFftRunMany(self):
+        """
+        Test the FFT metric gives the same results for a batch of dataSlices.
+        """
+        rng = np.random.RandomState(42)
+        dataSlices = []
+        for nvisits in [20, 30, 20, 5]:
+            data = np.zeros(nvisits, dtype=list(zip(['expmjd'], [float])))
+            data['expmjd'] = np.sort(rng.rand(nvisits) * 100.)
+            dataSlices.append(data)
+        fftMetric = metrics.FftMetric(nCoeffs=10)
+        results = fftMetric.runMany(dataSlices)
+        for data, result in zip(dataSlices, results):
+            np.testing.assert_allclose(result, fftMetric.run(data))
+
     def testTemplateExists(self):
         """
         Test the TemplateExistsMetric.
@@ -0,0 +1,79 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import unittest
+import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.maps as maps
+import lsst.utils.tests
+
+
+class TestCrowdingMetric(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.bins = np.arange(15., 30.1, 0.5)
+        magVector = self.bins[1:]
+        # Luminosity functions for a few pixels, with a range of stellar densities.
+        self.lumFunc = (10.**(0.3 * (magVector - 15.)))[np.newaxis, :] * \
+            (10.**rng.uniform(0, 4, size=5))[:, np.newaxis]
+        self.seeing = rng.uniform(0.5, 1.5, size=5)
+
+    def _oldCrowdMag(self, metric, lumFunc, seeing):
+        # The original calculation, at a single slicepoint.
+        magVector = self.bins[1:]
+        lumVector = 10**(-0.4 * magVector)
+        coeff = np.sqrt(np.pi / metric.lumAreaArcsec) * seeing / 2.
+        integral = (np.add.accumulate((lumVector**2 * lumFunc)[::-1]))[::-1]
+        crowdError = coeff * np.sqrt(integral) / lumVector
+        aboveCrowd = np.where(crowdError >= metric.crowding_error)[0]
+        if np.size(aboveCrowd) == 0:
+            return max(magVector)
+        return magVector[max(aboveCrowd[0] - 1, 0)]
+
+    def testCrowdingMetric(self):
+        """Test the crowding magnitude, with and without the precomputed table."""
+        metric = metrics.CrowdingMetric(crowding_error=0.1)
+        crowdTerm = maps.crowdingIntegral(self.bins[1:], self.lumFunc)
+        expected = [self._oldCrowdMag(metric, lf, s) for lf, s in zip(self.lumFunc, self.seeing)]
+        for i in range(len(self.seeing)):
+            data = np.core.records.fromarrays([np.array([self.seeing[i], self.seeing[i] + 0.2])],
+                                              names=['finSeeing'])
+            slicePoint = {'starMapBins': self.bins, 'starLumFunc': self.lumFunc[i]}
+            self.assertEqual(metric.run(data, slicePoint), expected[i])
+            slicePoint['starCrowdTerm'] = crowdTerm[i]
+            self.assertEqual(metric.run(data, slicePoint), expected[i])
+        # All pixels at once.
+        np.testing.assert_equal(metric.crowdingMag(self.bins[1:], crowdTerm, self.seeing), expected)
+
+    def testCrowdingMagUncertMetric(self):
+        """Test the crowding uncertainty is the same with the precomputed table."""
+        metric = metrics.CrowdingMagUncertMetric(rmag=22.)
+        crowdTerm = maps.crowdingIntegral(self.bins[1:], self.lumFunc)
+        data = np.core.records.fromarrays([self.seeing], names=['finSeeing'])
+        slicePoint = {'starMapBins': self.bins, 'starLumFunc': self.lumFunc[0]}
+        result = metric.run(data, slicePoint)
+        slicePoint['starCrowdTerm'] = crowdTerm[0]
+        self.assertAlmostEqual(metric.run(data, slicePoint), result)
+        self.assertGreater(result, 0)
+        # Compare to the mean of the crowding errors of each visit, interpolated to rmag.
+        expected = np.mean(metric._compCrowdError(self.bins[1:], self.lumFunc[0], self.seeing, singleMag=22.))
+        self.assertAlmostEqual(result, expected)
+        magVector = self.bins[1:]
+        coeff = np.sqrt(np.pi / metric.lumAreaArcsec) * self.seeing / 2.
+        self.assertAlmostEqual(result, np.mean(coeff * np.interp(22., magVector, crowdTerm[0])))
+        # The magnitude must be within the luminosity function.
+        metric = metrics.CrowdingMagUncertMetric(rmag=35.)
+        self.assertRaises(ValueError, metric.run, data, slicePoint)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
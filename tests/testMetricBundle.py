@@ -1,6 +1,9 @@
 import unittest
+import warnings
 import matplotlib
 matplotlib.use("Agg")
+import numpy as np
+import numpy.lib.recfunctions
 
 import lsst.sims.maf.metrics as metrics
 import lsst.sims.maf.slicers as slicers
@@ -63,6 +66,143 @@ class TestMetricBundle(unittest.TestCase):
             shutil.rmtree(self.outDir)
 
 
+class TestPresort(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = 'TMBpresort'
+        rng = np.random.RandomState(42)
+        nights = np.sort(rng.randint(0, 100, 500))
+        times = nights + rng.rand(nights.size) * 0.3
+        filters = rng.choice(['g', 'r', 'i'], nights.size)
+        airmass = rng.rand(nights.size) + 1.
+        order = rng.permutation(nights.size)
+        self.simData = np.core.records.fromarrays([times[order], nights[order], filters[order], airmass[order]],
+                                                  names=['expMJD', 'night', 'filter', 'airmass'])
+
+    def _runGroup(self, presortCol, sliceColName='night', bins=np.arange(0, 101, 10)):
+        slicer = slicers.OneDSlicer(sliceColName=sliceColName, bins=bins)
+        metricList = [metrics.InterNightGapsMetric(), metrics.IntraNightGapsMetric(),
+                      metrics.NRevisitsMetric(), metrics.AccumulateCountMetric(bins=np.arange(0, 101, 10)),
+                      metrics.TgapsMetric(), metrics.NChangesMetric(col='filter')]
+        bundleList = [metricBundles.MetricBundle(m, slicer, '') for m in metricList]
+        bundleDict = metricBundles.makeBundlesDictFromList(bundleList)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir, saveEarly=False,
+                                                     verbose=False, presortCol=presortCol)
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=self.simData.copy())
+        return [b.metricValues for b in bundleList]
+
+    def testPresort(self):
+        """Test that presorting simData does not change the metric values."""
+        for m1, m2 in zip(self._runGroup(None), self._runGroup('expMJD')):
+            np.testing.assert_equal(m1.mask, m2.mask)
+            for v1, v2 in zip(m1.compressed(), m2.compressed()):
+                np.testing.assert_almost_equal(v1, v2)
+
+    def testPresortUnorderedSlices(self):
+        """Test presorting when slicing on a column which is not in time order."""
+        bins = np.arange(1, 2.01, 0.1)
+        for m1, m2 in zip(self._runGroup(None, 'airmass', bins), self._runGroup('expMJD', 'airmass', bins)):
+            np.testing.assert_equal(m1.mask, m2.mask)
+            for v1, v2 in zip(m1.compressed(), m2.compressed()):
+                np.testing.assert_almost_equal(v1, v2)
+
+    def testLazyStackers(self):
+        """Test that deferring the stackers does not change the metric values."""
+        rng = np.random.RandomState(43)
+        simData = np.lib.recfunctions.append_fields(self.simData, 'fieldDec',
+                                                    rng.choice([-0.5, -0.2], len(self.simData)),
+                                                    usemask=False, asrecarray=True)
+        # Use a few distinct airmasses, so that the normalized airmass does not change at every visit.
+        simData['airmass'] = rng.choice([1.1, 1.3], len(simData))
+        values = []
+        for lazyStackers in (False, True):
+            slicer = slicers.OneDSlicer(sliceColName='night', bins=np.arange(0, 101, 10))
+            bundleList = [metricBundles.MetricBundle(metrics.NChangesMetric(col='normairmass'), slicer, '',
+                                                     stackerList=[stackers.NormAirmassStacker()]),
+                          metricBundles.MetricBundle(metrics.MeanMetric('filterIdx'), slicer, '',
+                                                     stackerList=[stackers.FilterIdxStacker()])]
+            bundleDict = metricBundles.makeBundlesDictFromList(bundleList)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir,
+                                                         saveEarly=False, verbose=False, presortCol='expMJD',
+                                                         lazyStackers=lazyStackers)
+                bgroup.setCurrent('')
+                bgroup.runCurrent('', simData=simData.copy())
+            values.append([b.metricValues for b in bundleList])
+        for m1, m2 in zip(values[0], values[1]):
+            np.testing.assert_equal(m1.mask, m2.mask)
+            np.testing.assert_array_equal(m1.compressed(), m2.compressed())
+
+    def testRequiresSorted(self):
+        """Test that metrics which need data sorted on a column other than presortCol are reported."""
+        slicer = slicers.UniSlicer()
+        bundleList = [metricBundles.MetricBundle(metrics.TgapsMetric(), slicer, ''),
+                      metricBundles.MetricBundle(metrics.TgapsMetric(timesCol='night'), slicer, '')]
+        bundleDict = metricBundles.makeBundlesDictFromList(bundleList)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir, saveEarly=False,
+                                                     verbose=False, presortCol='expMJD')
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=self.simData.copy())
+        messages = [str(warning.message) for warning in w if 'requires data sorted' in str(warning.message)]
+        self.assertEqual(len(messages), 1)
+        self.assertTrue('night' in messages[0])
+
+    def testStackerCache(self):
+        """Test that the stacker cache is not reused for new simData with the same visits."""
+        rng = np.random.RandomState(44)
+        simData = np.lib.recfunctions.append_fields(self.simData, 'fieldDec',
+                                                    rng.rand(len(self.simData)) - 0.5,
+                                                    usemask=False, asrecarray=True)
+        slicer = slicers.UniSlicer()
+        bundle = metricBundles.MetricBundle(metrics.MeanMetric('normairmass'), slicer, '',
+                                            stackerList=[stackers.NormAirmassStacker()])
+        bundleDict = metricBundles.makeBundlesDictFromList([bundle])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir, saveEarly=False,
+                                                     verbose=False, stackerCacheCol='expMJD')
+            bgroup.setCurrent('')
+            for airmass in (1.2, 2.0):
+                simData['airmass'] = airmass
+                bgroup.runCurrent('', simData=simData.copy())
+                expected = stackers.NormAirmassStacker().run(simData.copy())['normairmass'].mean()
+                self.assertAlmostEqual(bundle.metricValues[0], expected)
+
+    def testRunMany(self):
+        """Test that metrics with runMany give the same values as running at each slicePoint."""
+        slicer = slicers.OneDSlicer(sliceColName='night', bins=np.arange(0, 101, 5))
+        metric = metrics.PhaseGapMetric(nVisitsMin=5)
+        bundle = metricBundles.MetricBundle(metric, slicer, '')
+        bundleDict = metricBundles.makeBundlesDictFromList([bundle])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            bgroup = metricBundles.MetricBundleGroup(bundleDict, None, outDir=self.outDir, saveEarly=False,
+                                                     verbose=False, presortCol='expMJD')
+            # Use small batches, so the dataSlices are split over several calls to runMany.
+            bgroup.runManyBatchSize = 7
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=self.simData.copy())
+        simData = np.sort(self.simData, order='expMJD')
+        slicer.setupSlicer(simData)
+        for i, slice_i in enumerate(slicer):
+            expected = metric.run(simData[slice_i['idxs']])
+            if expected is metric.badval:
+                self.assertTrue(bundle.metricValues.mask[i])
+            else:
+                self.assertFalse(bundle.metricValues.mask[i])
+                np.testing.assert_almost_equal(bundle.metricValues.data[i]['maxGaps'], expected['maxGaps'])
+
+    def tearDown(self):
+        if os.path.isdir(self.outDir):
+            shutil.rmtree(self.outDir)
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -2,6 +2,8 @@ import numpy as np
 import pandas as pd
 import unittest
 import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.stackers as stackers
+from lsst.sims.maf.metricBundles.moMetricBundle import _hasRunH
 
 
 class TestMoMetrics1(unittest.TestCase):
@@ -74,6 +76,114 @@ class TestMoMetrics1(unittest.TestCase):
         arc = arcMetric.run(self.ssoObs, self.orb, self.Hval)
         self.assertEqual(arc, self.ssoObs['expMJD'][-1] - self.ssoObs['expMJD'][5])
 
+    def testRunH(self):
+        """Test that calculating all H values at once matches calculating each H value."""
+        nObs = len(self.ssoObs)
+        Hvals = np.array([7.0, 8.0, 9.0, 10.0])
+        Hcols = {'vis': np.array([np.ones(nObs), self.ssoObs['vis'], self.ssoObs['vis'], np.zeros(nObs)]),
+                 'SNR': np.array([np.zeros(nObs) + 10., self.ssoObs['SNR'], self.ssoObs['SNR'], np.zeros(nObs)])}
+        metricList = [metrics.NObsMetric(), metrics.NObsMetric(snrLimit=5), metrics.NObsNoSinglesMetric(),
+                      metrics.NNightsMetric(), metrics.ObsArcMetric(snrLimit=5),
+                      metrics.DiscoveryMetric(tMin=0, tMax=0.3)]
+        for metric in metricList:
+            valuesH = metric.runH(self.ssoObs, self.orb, Hvals, Hcols)
+            for j, Hval in enumerate(Hvals):
+                ssoObs = self.ssoObs.copy()
+                for col in Hcols:
+                    ssoObs[col] = Hcols[col][j]
+                expected = metric.run(ssoObs, self.orb, Hval)
+                if isinstance(expected, dict):
+                    for key in expected:
+                        np.testing.assert_equal(valuesH[j][key], expected[key])
+                else:
+                    self.assertEqual(valuesH[j], expected)
+        # Equivalent stackers still compare as equal.
+        self.assertEqual(stackers.MoMagStacker(), stackers.MoMagStacker())
+        # Metrics without a vectorized version return None.
+        self.assertTrue(metrics.PeakVMagMetric().runH(self.ssoObs, self.orb, Hvals, Hcols) is None)
+
+    def testRunHSubclass(self):
+        """Test that subclasses which only override run (or _run) are calculated for each H value."""
+        class BrighterMagStacker(stackers.MoMagStacker):
+            def _run(self, ssoObs, Href, Hval):
+                ssoObs = super(BrighterMagStacker, self)._run(ssoObs, Href, Hval)
+                ssoObs['appMag'] -= 1.0
+                return ssoObs
+
+        class CountMetric(metrics.NObsMetric):
+            def run(self, ssoObs, orb, Hval):
+                return len(ssoObs)
+
+        nObs = 20
+        ssoObs = np.recarray([nObs], dtype=[('objId', int), ('magV', float), ('magFilter', float),
+                                            ('dmagDetect', float), ('fiveSigmaDepth', float)])
+        ssoObs['objId'] = 3
+        ssoObs['magV'] = 20.0
+        ssoObs['magFilter'] = np.arange(nObs) * 0.1 + 20.0
+        ssoObs['dmagDetect'] = 0.0
+        ssoObs['fiveSigmaDepth'] = 21.0
+        Hvals = np.array([0.0, 0.5])
+        ssoObs, Hcols = BrighterMagStacker(randomSeed=42).runH(ssoObs, 0.0, Hvals)
+        ssoObs, expected = stackers.MoMagStacker(randomSeed=42).runH(ssoObs, 0.0, Hvals)
+        np.testing.assert_allclose(Hcols['appMag'], expected['appMag'] - 1.0)
+        self.assertFalse(_hasRunH(CountMetric()))
+        self.assertTrue(_hasRunH(metrics.NObsMetric()))
+        self.assertFalse(_hasRunH(metrics.PeakVMagMetric()))
+
+    def testRandomSeed(self):
+        """Test that a seeded MoMagStacker gives reproducible visibilities for each object."""
+        nObs = 200
+        ssoObs = np.recarray([nObs], dtype=[('objId', int), ('magV', float), ('magFilter', float),
+                                            ('dmagDetect', float), ('fiveSigmaDepth', float)])
+        ssoObs['objId'] = 3
+        ssoObs['magV'] = 20.0
+        ssoObs['magFilter'] = 20.0
+        ssoObs['dmagDetect'] = 0.0
+        ssoObs['fiveSigmaDepth'] = 20.0
+        Hvals = np.array([0.0, 0.1])
+        stacker = stackers.MoMagStacker(randomSeed=42)
+        ssoObs, Hcols = stacker.runH(ssoObs, 0.0, Hvals)
+        # The global random state does not affect (and is not affected by) the seeded stacker.
+        np.random.seed(1)
+        ssoObs, Hcols2 = stackers.MoMagStacker(randomSeed=42).runH(ssoObs, 0.0, Hvals)
+        np.testing.assert_equal(Hcols['vis'], Hcols2['vis'])
+        self.assertTrue(0 < Hcols['vis'][0].sum() < nObs)
+        # A different object (or seed) gets a different random stream.
+        ssoObs['objId'] = 4
+        ssoObs, Hcols3 = stacker.runH(ssoObs, 0.0, Hvals)
+        self.assertFalse(np.all(Hcols['vis'] == Hcols3['vis']))
+        ssoObs['objId'] = 3
+        ssoObs, Hcols4 = stackers.MoMagStacker(randomSeed=43).runH(ssoObs, 0.0, Hvals)
+        self.assertFalse(np.all(Hcols['vis'] == Hcols4['vis']))
+
+    def testMagStackerValues(self):
+        """Test the SNR and visibility of the MoMagStacker against the direct calculation."""
+        rng = np.random.RandomState(7)
+        nObs = 500
+        ssoObs = np.recarray([nObs], dtype=[('objId', int), ('magV', float), ('magFilter', float),
+                                            ('dmagDetect', float), ('fiveSigmaDepth', float)])
+        ssoObs['objId'] = 3
+        ssoObs['magV'] = rng.uniform(18, 26, nObs)
+        ssoObs['magFilter'] = ssoObs['magV'] + 0.2
+        ssoObs['dmagDetect'] = rng.uniform(0, 0.3, nObs)
+        ssoObs['fiveSigmaDepth'] = rng.uniform(22, 25, nObs)
+        Hvals = np.arange(12, 20, 0.5)
+        stacker = stackers.MoMagStacker(randomSeed=42)
+        ssoObs, Hcols = stacker.runH(ssoObs, 15.0, Hvals)
+        dmag = ssoObs['magFilter'] + ssoObs['dmagDetect'] + Hvals[:, np.newaxis] - 15.0 - ssoObs['fiveSigmaDepth']
+        xval = np.power(10, 0.5 * dmag)
+        snr = 1.0 / np.sqrt((0.04 - stacker.gamma) * xval + stacker.gamma * xval * xval)
+        completeness = 1.0 / (1 + np.exp(dmag / stacker.sigma))
+        probability = stacker._randomState(ssoObs).random_sample(nObs)
+        np.testing.assert_allclose(Hcols['SNR'], snr, rtol=1e-12)
+        np.testing.assert_equal(Hcols['vis'], np.where(probability <= completeness, 1, 0))
+        self.assertTrue(0 < Hcols['vis'].sum() < Hcols['vis'].size)
+        # The single H version agrees with the direct calculation too.
+        tmp = stacker.run(ssoObs.copy(), 15.0, Hvals[3])
+        np.testing.assert_allclose(tmp['SNR'], snr[3], rtol=1e-12)
+        probability = stacker._randomState(ssoObs, Hvals[3]).random_sample(nObs)
+        np.testing.assert_equal(tmp['vis'], np.where(probability <= completeness[3], 1, 0))
+
     def tearDown(self):
         del self.ssoObs
         del self.orb
@@ -159,6 +269,13 @@ class TestDiscoveryMetrics(unittest.TestCase):
         lon, lat, solarElong = child.run(self.ssoObs, self.orb, self.Hval, metricValue)
         self.assertEqual(lon, 10)
         self.assertEqual(lat, 25)
+        # The visible observations are shared with the child metrics, but they do not depend on this.
+        np.testing.assert_equal(metricValue['visIdx'], np.arange(len(self.ssoObs)))
+        values = dict(metricValue)
+        del values['visIdx']
+        for child in discMetric.childMetrics.values():
+            self.assertEqual(child.run(self.ssoObs, self.orb, self.Hval, values),
+                             child.run(self.ssoObs, self.orb, self.Hval, metricValue))
 
         discMetric2 = metrics.DiscoveryChancesMetric(nObsPerNight=2, tNight=0.3,
                                              nNightsPerWindow=3, tWindow=9, snrLimit=5)
@@ -197,5 +314,45 @@ class TestDiscoveryMetrics(unittest.TestCase):
         self.assertEqual(metricValue, 1)
 
 
+class TestMoCompleteness(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.Hvals = np.arange(15, 20, 0.5)
+        shape = (100, len(self.Hvals))
+        self.chances = np.ma.MaskedArray(rng.randint(0, 4, shape).astype(float), mask=rng.rand(*shape) < 0.2)
+        self.discTimes = np.ma.MaskedArray(rng.rand(*shape) * 120 - 10, mask=rng.rand(*shape) < 0.2)
+        self.times = np.arange(0, 101, 20)
+
+    def testCompletenessH(self):
+        """Test the differential and cumulative completeness from the number of discovery chances."""
+        differential, cumulative = metrics.completenessH(self.chances, self.Hvals, requiredChances=2)
+        for i in range(len(self.Hvals)):
+            found = np.sum(self.chances[:, i].filled(0) >= 2)
+            self.assertAlmostEqual(differential[i], found / 100.)
+        np.testing.assert_allclose(cumulative, metrics.integrateOverH(differential, self.Hvals))
+        summaryVal = metrics.MoCompletenessMetric(cumulative=False, requiredChances=2).run(self.chances, self.Hvals)
+        np.testing.assert_allclose(summaryVal['value'], differential)
+        # A stack of bundles gives the same results as each bundle.
+        stack = np.ma.array([self.chances, self.chances[::-1] * 2])
+        differentialStack, cumulativeStack = metrics.completenessH(stack, self.Hvals, requiredChances=2)
+        np.testing.assert_allclose(differentialStack[0], differential)
+        for i, chances in enumerate(stack):
+            np.testing.assert_allclose(cumulativeStack[i], metrics.completenessH(chances, self.Hvals, 2)[1])
+
+    def testCompletenessAtTime(self):
+        """Test the completeness as a function of time from the discovery times."""
+        differential, cumulative = metrics.completenessAtTime(self.discTimes, self.Hvals, self.times)
+        self.assertEqual(differential.shape, (len(self.times), len(self.Hvals)))
+        for i in range(len(self.Hvals)):
+            n, b = np.histogram(self.discTimes[:, i].compressed(), bins=self.times)
+            np.testing.assert_allclose(differential[:, i], np.concatenate([[0], n.cumsum()]) / 100.)
+        for j in range(len(self.times)):
+            np.testing.assert_allclose(cumulative[j], metrics.integrateOverH(differential[j], self.Hvals))
+        metric = metrics.MoCompletenessAtTimeMetric(times=self.times, Hval=17.2)
+        summaryVal = metric.run(self.discTimes, self.Hvals)
+        np.testing.assert_allclose(summaryVal['value'], [np.interp(17.2, self.Hvals, c) for c in cumulative])
+
+
 if __name__ == "__main__":
     unittest.main()
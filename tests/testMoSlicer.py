@@ -0,0 +1,147 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import tempfile
+import unittest
+import lsst.sims.maf.slicers as slicers
+from lsst.sims.maf.slicers.orbits import Orbits
+import lsst.utils.tests
+
+
+class TestMoObjSlicer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        nobs = 500
+        self.allObs = pd.DataFrame({'objId': rng.randint(0, 20, nobs), 'expMJD': rng.rand(nobs),
+                                    'magV': rng.rand(nobs) + 20.})
+        self.slicer = slicers.MoObjSlicer()
+        self.slicer.allObs = self.allObs
+        # Include some orbits without any observations.
+        self.slicer.orbits = pd.DataFrame({'objId': np.arange(25), 'H': np.zeros(25) + 20.})
+        self.slicer.nSso = len(self.slicer.orbits)
+        self.slicer.Hrange = None
+
+    def testSliceObs(self):
+        """Test that the observations of each object match a query on objId."""
+        for constraint in [None, 'expMJD > 0.5']:
+            self.slicer.subsetObs(constraint)
+            for i, slicePoint in enumerate(self.slicer):
+                expected = self.slicer.obs.query('objId == %d' % i).to_records()
+                self.assertEqual(slicePoint['obs'].dtype, expected.dtype)
+                np.testing.assert_equal(slicePoint['obs'], expected)
+                np.testing.assert_equal(slicePoint['Hvals'], [20.])
+
+
+    def testStreamObs(self):
+        """Test that streaming the observations in chunks gives the same observations for each object."""
+        tmpDir = tempfile.mkdtemp()
+        try:
+            obsfile = os.path.join(tmpDir, 'obs.txt')
+            obs = self.allObs.sort_values('objId', kind='mergesort')
+            obs = obs.assign(dmagColor=0.1, dradt=0.5, ddecdt=0.5)
+            obs = obs[['objId', 'expMJD', 'magV', 'dmagColor', 'dradt', 'ddecdt']]
+            obs.to_csv(obsfile, sep=' ', index=False)
+            self.slicer.readObs(obsfile)
+            expected = [slicePoint['obs'] for slicePoint in self.slicer]
+            for chunkSize, readRows in [(1, 7), (3, 50), (6, 1000)]:
+                self.slicer.readObs(obsfile, chunkSize=chunkSize, readRows=readRows)
+                self.slicer.subsetObs()
+                found = np.zeros(self.slicer.nSso, int)
+                for orbitIdxs in self.slicer.iterObsChunks():
+                    self.assertLessEqual(len(orbitIdxs), chunkSize)
+                    for i in orbitIdxs:
+                        found[i] += 1
+                        ssoObs = self.slicer[i]['obs']
+                        np.testing.assert_equal(ssoObs['expMJD'], expected[i]['expMJD'])
+                        np.testing.assert_equal(ssoObs['velocity'], expected[i]['velocity'])
+                # Each object with observations is in exactly one chunk.
+                np.testing.assert_equal(found, [1 if len(e) > 0 else 0 for e in expected])
+        finally:
+            shutil.rmtree(tmpDir)
+
+
+    def testCachedObs(self):
+        """Test that observations and orbits read from the binary cache match the text files."""
+        tmpDir = tempfile.mkdtemp()
+        try:
+            obsfile = os.path.join(tmpDir, 'obs.txt')
+            obs = self.allObs.sort_values('objId', kind='mergesort')
+            obs = obs.assign(dmagColor=0.1, dradt=0.5, ddecdt=0.5)
+            obs.to_csv(obsfile, sep=' ', index=False)
+            self.slicer.readObs(obsfile)
+            expected = [slicePoint['obs'] for slicePoint in self.slicer]
+            # The first read writes the cache, the second reads it.
+            for i in range(2):
+                self.slicer.readObs(obsfile, cache=True)
+                for slicePoint, e in zip(self.slicer, expected):
+                    for col in ['objId', 'expMJD', 'magFilter', 'velocity']:
+                        np.testing.assert_equal(slicePoint['obs'][col], e[col])
+            self.assertTrue(self.slicer.obsColumns is not None)
+            # Streaming from the cache.
+            self.slicer.readObs(obsfile, chunkSize=4, cache=True)
+            self.slicer.subsetObs('expMJD > 0.5')
+            for orbitIdxs in self.slicer.iterObsChunks():
+                for i in orbitIdxs:
+                    e = expected[i][expected[i]['expMJD'] > 0.5]
+                    np.testing.assert_equal(self.slicer[i]['obs']['expMJD'], e['expMJD'])
+            # Orbits.
+            orbitfile = os.path.join(tmpDir, 'orbits.txt')
+            orbits = pd.DataFrame({'objId': np.arange(5, 0, -1), 'q': np.zeros(5) + 1.5, 'e': np.zeros(5) + 0.1,
+                                   'inc': np.arange(5.), 'Omega': np.arange(5.), 'argPeri': np.arange(5.),
+                                   'tPeri': np.zeros(5) + 59580., 'epoch': np.zeros(5) + 59580.,
+                                   'H': np.zeros(5) + 18.})
+            orbits.to_csv(orbitfile, sep=' ', index=False)
+            orbs = []
+            for i in range(2):
+                orb = Orbits()
+                orb.readOrbits(orbitfile, cache=True)
+                orbs.append(orb.orbits)
+            self.assertEqual(list(orbs[0].columns), list(orbs[1].columns))
+            for col in orbs[0].columns:
+                np.testing.assert_equal(orbs[0][col].values, orbs[1][col].values)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testOrbitRecords(self):
+        """Test the lightweight access to single orbits."""
+        self.slicer.subsetObs()
+        for i, slicePoint in enumerate(self.slicer):
+            self.assertEqual(slicePoint['orbit']['objId'], i)
+            self.assertEqual(slicePoint['orbit']['H'], 20.)
+        orbits = pd.DataFrame({'objId': np.arange(5), 'a': np.array([1.5, 2.5, 3.0, 3.5, 5.0]),
+                               'e': np.zeros(5) + 0.1, 'inc': np.arange(5.), 'Omega': np.arange(5.),
+                               'argPeri': np.arange(5.), 'meanAnomaly': np.arange(5.),
+                               'epoch': np.zeros(5) + 59580.})
+        orb = Orbits()
+        orb.setOrbits(orbits)
+        self.assertEqual(orb.format, 'KEP')
+        # Small objects are always S type, large ones C type; the SEDs are reproducible with a seed.
+        seds = orb.assignSed(orb.orbits, randomSeed=42)
+        self.assertEqual(seds[0], 'S.dat')
+        self.assertEqual(seds[-1], 'C.dat')
+        np.testing.assert_equal(orb.assignSed(orb.records(), randomSeed=42), seds)
+        records = orb.records()
+        self.assertTrue(orb.records() is records)
+        for i, (single, record) in enumerate(zip(orb, orb.iterRecords())):
+            self.assertEqual(single.format, 'KEP')
+            self.assertEqual(len(single), 1)
+            self.assertEqual(single.orbits['a'].iloc[0], orbits['a'][i])
+            self.assertEqual(record['a'], orbits['a'][i])
+            self.assertEqual(orb[i].orbits['objId'].iloc[0], i)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
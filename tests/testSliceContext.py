@@ -0,0 +1,114 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import unittest
+import lsst.sims.maf.metrics as metrics
+import lsst.utils.tests
+
+
+class TestSliceContext(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        nights = np.repeat(np.arange(20), 5)
+        times = nights + rng.rand(nights.size) * 0.3
+        filters = np.array(['g', 'r', 'i', 'r', 'g'] * 20)
+        m5 = rng.rand(nights.size) + 24.
+        # Shuffle the visits, so that the data is not in time order.
+        order = rng.permutation(nights.size)
+        self.dataSlice = np.core.records.fromarrays([times[order], nights[order], filters[order], m5[order]],
+                                                    names=['expMJD', 'night', 'filter', 'fiveSigmaDepth'])
+
+    def testPrimitives(self):
+        """Test the values returned by the SliceContext."""
+        context = metrics.SliceContext(self.dataSlice)
+        times = np.sort(self.dataSlice['expMJD'])
+        np.testing.assert_equal(context.sortedCol('expMJD'), times)
+        np.testing.assert_equal(context.dtimes(), np.diff(times))
+        np.testing.assert_equal(context.unique('night'), np.arange(20))
+        unights, first, last = context.nightBounds()
+        np.testing.assert_equal(first, np.arange(0, 100, 5))
+        np.testing.assert_equal(last, np.arange(4, 100, 5))
+        coadd = 1.25 * np.log10(context.coaddFlux())
+        self.assertAlmostEqual(coadd, metrics.Coaddm5Metric().run(self.dataSlice))
+        # Values are memoized.
+        self.assertTrue(context.dtimes() is context.dtimes())
+
+    def testInPlaceSort(self):
+        """Test that cached values remain valid if the dataSlice is sorted in place."""
+        context = metrics.SliceContext(self.dataSlice)
+        sortedFilters = context.sortedCol('filter').copy()
+        self.dataSlice.sort(order='fiveSigmaDepth')
+        np.testing.assert_equal(context.sortedCol('filter'), sortedFilters)
+
+    def testSortedOn(self):
+        """Test that data which is already sorted is not copied."""
+        self.dataSlice.sort(order='expMJD')
+        context = metrics.SliceContext(self.dataSlice, sortedOn='expMJD')
+        self.assertTrue(context.sortedSlice('expMJD') is self.dataSlice)
+        context = metrics.SliceContext(self.dataSlice)
+        self.assertTrue(context.sortedSlice('expMJD') is self.dataSlice)
+        # Nights increase with time, so the slice is also sorted on night.
+        self.assertTrue(context.sortedSlice('night') is self.dataSlice)
+        # sortedOn is not trusted for a dataSlice taken from the parent, whose idxs may not be in order.
+        idxs = np.arange(100)[::-1]
+        context = metrics.SliceContext(self.dataSlice[idxs], sortedOn='expMJD', parent=context, idxs=idxs)
+        np.testing.assert_equal(context.sortedCol('expMJD'), self.dataSlice['expMJD'])
+
+    def testStateChanges(self):
+        """Test that state changes from the parent index match those calculated for the slice."""
+        self.dataSlice.sort(order='expMJD')
+        parent = metrics.SliceContext(self.dataSlice, sortedOn='expMJD')
+        for start, end in [(0, 100), (0, 10), (13, 47), (99, 100)]:
+            idxs = np.arange(start, end)
+            context = metrics.SliceContext(self.dataSlice[idxs], parent=parent, idxs=idxs)
+            self.assertEqual(context._parentSegment('expMJD'), (start, end))
+            local = metrics.SliceContext(self.dataSlice[idxs])
+            np.testing.assert_equal(context.stateChangeTimes('filter'), local.stateChangeTimes('filter'))
+            np.testing.assert_equal(context.stateChangeDtimes('filter'), local.stateChangeDtimes('filter'))
+        # A slice which is not contiguous falls back to calculating the changes itself.
+        idxs = np.arange(0, 100, 3)
+        context = metrics.SliceContext(self.dataSlice[idxs], parent=parent, idxs=idxs)
+        self.assertTrue(context._parentSegment('expMJD') is None)
+        filters = self.dataSlice['filter'][idxs]
+        self.assertEqual(context.stateChangeTimes('filter').size, np.sum(filters[1:] != filters[:-1]))
+
+    def testGetSliceContext(self):
+        """Test that the SliceContext is only shared for the same dataSlice."""
+        context = metrics.SliceContext(self.dataSlice)
+        slicePoint = {'sid': 0, 'sliceContext': context}
+        self.assertTrue(metrics.getSliceContext(self.dataSlice, slicePoint) is context)
+        other = metrics.getSliceContext(self.dataSlice[:10], slicePoint)
+        self.assertFalse(other is context)
+        self.assertFalse(metrics.getSliceContext(self.dataSlice) is context)
+
+    def testSharedMetrics(self):
+        """Test that metrics give the same results with a shared SliceContext."""
+        metricList = [metrics.InterNightGapsMetric(), metrics.IntraNightGapsMetric(),
+                      metrics.AveGapMetric(), metrics.NRevisitsMetric(dT=120.),
+                      metrics.TgapsMetric(bins=np.arange(0, 2, 0.05)),
+                      metrics.PairMetric(), metrics.Coaddm5Metric(),
+                      metrics.VisitGroupsMetric(timesCol='expMJD', nightsCol='night',
+                                                deltaTmax=0.3)]
+        expected = [m.run(self.dataSlice.copy()) for m in metricList]
+        slicePoint = {'sid': 0, 'sliceContext': metrics.SliceContext(self.dataSlice)}
+        for m, e in zip(metricList, expected):
+            result = m.run(self.dataSlice, slicePoint)
+            if isinstance(e, dict):
+                for k in e:
+                    np.testing.assert_equal(result[k], e[k])
+            else:
+                np.testing.assert_equal(result, e)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -4,9 +4,11 @@ from builtins import zip
 import numpy as np
 import matplotlib
 import warnings
+import palpy
 import unittest
 import lsst.utils.tests
 import lsst.sims.maf.stackers as stackers
+import lsst.sims.maf.stackers.ditherStackers as ditherStackers
 from lsst.sims.utils import _galacticFromEquatorial, calcLmstLast, Site, _altAzPaFromRaDec, ObservationMetaData
 
 matplotlib.use("Agg")
@@ -69,6 +71,23 @@ class TestStackerClasses(unittest.TestCase):
             np.max(data['ra_pi_amp']**2 + data['dec_pi_amp']**2), 1.1)
         self.assertGreater(min(np.abs(data['ra_pi_amp'])), 0.)
         self.assertGreater(min(np.abs(data['dec_pi_amp'])), 0.)
+        # Compare with the per-visit palpy calculation.
+        rng = np.random.RandomState(42)
+        data['fieldRA'] = rng.uniform(0, 2 * np.pi, data.size)
+        data['fieldDec'] = np.arcsin(rng.uniform(-1, 0.5, data.size))
+        data['expMJD'] = 59580. + rng.uniform(0, 3650., data.size)
+        for timeStep in (0.05, None):
+            stacker = stackers.ParallaxFactorStacker(timeStep=timeStep)
+            data = stacker.run(data)
+            for i in range(0, data.size, 50):
+                ra, dec = data['fieldRA'][i], data['fieldDec'][i]
+                amprms = palpy.mappa(2000., data['expMJD'][i])
+                ra1, dec1 = palpy.mapqk(ra, dec, 0., 0., 1., 0., amprms)
+                ra0, dec0 = palpy.mapqk(ra, dec, 0., 0., 0., 0., amprms)
+                x1, y1 = stacker._gnomonic_project_toxy(ra1, dec1, ra, dec)
+                x0, y0 = stacker._gnomonic_project_toxy(ra0, dec0, ra, dec)
+                self.assertAlmostEqual(data['ra_pi_amp'][i], np.degrees(x1 - x0) * 3600., places=6)
+                self.assertAlmostEqual(data['dec_pi_amp'][i], np.degrees(y1 - y0) * 3600., places=6)
 
     def _tDitherRange(self, diffsra, diffsdec, ra, dec, maxDither):
         self.assertTrue(np.all(np.abs(diffsra) <= np.radians(maxDither)))
@@ -144,6 +163,37 @@ class TestStackerClasses(unittest.TestCase):
         self._tDitherPerNight(diffsra, diffsdec, data['fieldRA'], data[
                               'fieldDec'], data['night'])
 
+    def testRandomDitherOffsetPool(self):
+        """
+        Test that seeded random dither offsets are shared and do not change the global random state.
+        """
+        maxDither = np.radians(0.5)
+        state = np.random.get_state()
+        x1, y1 = ditherStackers.randomDitherOffsets(100, maxDither, randomSeed=1234)
+        x2, y2 = ditherStackers.randomDitherOffsets(500, maxDither, randomSeed=1234)
+        # The global random state is not reseeded.
+        np.testing.assert_equal(np.random.get_state()[1], state[1])
+        self.assertEqual(len(x1), 100)
+        self.assertEqual(len(x2), 500)
+        # The first offsets are the same however many are requested.
+        np.testing.assert_equal(x2[:100], x1)
+        np.testing.assert_equal(y2[:100], y1)
+        self.assertTrue(np.all(np.sqrt(x2**2 + y2**2) <= maxDither))
+        self.assertEqual(len(ditherStackers.inHexagon(x2, y2, maxDither)), 500)
+        # Stackers with the same seed share the offsets (and a new seed gives new offsets).
+        data = np.zeros(300, dtype=list(zip(['fieldRA', 'fieldDec'], [float, float])))
+        data['fieldRA'] = np.pi
+        s1 = stackers.RandomDitherFieldPerVisitStacker(maxDither=0.5, randomSeed=1234)
+        s2 = stackers.RandomDitherFieldPerVisitStacker(maxDither=0.5, randomSeed=1234)
+        s3 = stackers.RandomDitherFieldPerVisitStacker(maxDither=0.5, randomSeed=4321)
+        d1 = s1.run(data.copy())
+        d2 = s2.run(data.copy())
+        d3 = s3.run(data.copy())
+        np.testing.assert_equal(d1['randomDitherFieldPerVisitDec'], y2[:300])
+        np.testing.assert_equal(d1['randomDitherFieldPerVisitRa'], d2['randomDitherFieldPerVisitRa'])
+        self.assertFalse(np.all(d1['randomDitherFieldPerVisitDec'] == d3['randomDitherFieldPerVisitDec']))
+        self.assertTrue((1234, maxDither, True) in ditherStackers._offsetPools)
+
     def testSpiralDitherPerNight(self):
         """
         Test the per-night spiral dither pattern.
@@ -196,6 +246,100 @@ class TestStackerClasses(unittest.TestCase):
         self._tDitherPerNight(diffsra, diffsdec, data['fieldRA'],
                               data['fieldDec'], data['night'])
 
+    def testFieldDitherIndexes(self):
+        """
+        Test the per-field visit and night counters used by the per-field dither stackers.
+        """
+        rng = np.random.RandomState(42)
+        ndata = 500
+        fieldIds = rng.randint(0, 20, ndata)
+        nights = rng.randint(0, 30, ndata)
+        visitIdx = ditherStackers._fieldVisitIndex(fieldIds)
+        nightIdx = ditherStackers._fieldNightIndex(fieldIds, nights)
+        for fieldId in np.unique(fieldIds):
+            match = np.where(fieldIds == fieldId)[0]
+            np.testing.assert_array_equal(visitIdx[match], np.arange(len(match)))
+            np.testing.assert_array_equal(nightIdx[match],
+                                          np.searchsorted(np.unique(nights[match]), nights[match]))
+        # The per-field stackers apply the same offset to all visits to a field in a night.
+        data = np.zeros(ndata, dtype=list(zip(['fieldRA', 'fieldDec', 'fieldID', 'night'],
+                                              [float, float, int, int])))
+        data['fieldRA'] = rng.rand(ndata) * np.pi + np.pi / 2.0
+        data['fieldDec'] = rng.rand(ndata) * np.pi / 2.0 - np.pi / 4.0
+        data['fieldID'] = fieldIds
+        data['night'] = nights
+        stacker = stackers.HexDitherFieldPerNightStacker(fieldIdCol='fieldID')
+        data = stacker.run(data)
+        decOffsets = data['hexDitherFieldPerNightDec'] - data['fieldDec']
+        np.testing.assert_allclose(decOffsets, stacker.yOff[nightIdx % stacker.numPoints], atol=1e-12)
+        self.assertEqual(len(ditherStackers._fieldVisitIndex(np.array([], int))), 0)
+
+    def testStackerEngine(self):
+        """
+        Test that the StackerEngine orders stackers and reuses cached per-visit columns.
+        """
+        rng = np.random.RandomState(42)
+        ndata = 100
+        data = np.zeros(ndata, dtype=list(zip(['expMJD', 'fieldRA', 'fieldDec', 'lst'], [float] * 4)))
+        data['expMJD'] = 59580. + np.arange(ndata) * 0.01
+        data['fieldRA'] = rng.rand(ndata) * 2. * np.pi
+        data['fieldDec'] = rng.rand(ndata) * np.pi / 2.0 - np.pi / 4.0
+        data['lst'] = rng.rand(ndata) * 2. * np.pi
+        haStacker = stackers.HourAngleStacker()
+        ditherStacker = stackers.RandomDitherFieldPerVisitStacker(randomSeed=42)
+        eclStacker = stackers.EclipticStacker(raCol='randomDitherFieldPerVisitRa',
+                                              decCol='randomDitherFieldPerVisitDec')
+        # The ecliptic coordinates of the dithered pointings need the dither stacker to run first.
+        ordered = stackers.orderStackers([eclStacker, haStacker, ditherStacker])
+        self.assertEqual(ordered, [haStacker, ditherStacker, eclStacker])
+        engine = stackers.StackerEngine()
+        # Run on a subset of the visits first, then on all of them (in a different order).
+        subset = engine.run(data[rng.permutation(ndata)[:40]].copy(), [haStacker])
+        self.assertEqual(len(engine._cache[0][1]), 40)
+        shuffled = data[rng.permutation(ndata)]
+        result = engine.run(shuffled.copy(), [stackers.HourAngleStacker(), ditherStacker, eclStacker])
+        self.assertEqual(len(engine._cache), 1)
+        self.assertEqual(len(engine._cache[0][1]), ndata)
+        expected = stackers.HourAngleStacker().run(shuffled.copy())
+        np.testing.assert_array_equal(result['HA'], expected['HA'])
+        np.testing.assert_array_equal(subset['HA'], stackers.HourAngleStacker().run(subset.copy())['HA'])
+        # Stackers depending on a (not per-visit) dither stacker are run on the full data each time.
+        expected = eclStacker.run(ditherStacker.run(shuffled.copy()))
+        np.testing.assert_array_equal(result['eclipLon'], expected['eclipLon'])
+        # Deferred stackers are only calculated for the rows passed to fill.
+        normStacker = stackers.NormAirmassStacker()
+        data = np.zeros(ndata, dtype=list(zip(['expMJD', 'airmass', 'fieldDec', 'lst', 'fieldRA'], [float] * 5)))
+        data['expMJD'] = 59580. + np.arange(ndata) * 0.01
+        data['airmass'] = 1. + rng.rand(ndata)
+        data['fieldDec'] = rng.rand(ndata) * np.pi / 2.0 - np.pi / 4.0
+        engine = stackers.StackerEngine()
+        lazy = engine.run(data.copy(), [normStacker, haStacker], eagerCols=['HA'])
+        self.assertTrue(np.all(np.isnan(lazy['normairmass'])))
+        self.assertFalse(np.any(np.isnan(lazy['HA'])))
+        expected = normStacker.run(data.copy())['normairmass']
+        engine.fill(lazy, np.arange(10, 20))
+        engine.fill(lazy, lazy['expMJD'] > lazy['expMJD'][90])
+        filled = np.zeros(ndata, bool)
+        filled[10:20] = True
+        filled[91:] = True
+        np.testing.assert_array_equal(lazy['normairmass'][filled], expected[filled])
+        self.assertTrue(np.all(np.isnan(lazy['normairmass'][~filled])))
+        self.assertEqual(engine.deferredCols, ['normairmass'])
+        # The filled rows are cached (once) by cacheDeferred, and gathered when the stacker is deferred again.
+        self.assertEqual(len(engine._cache), 1)
+        engine.cacheDeferred(lazy)
+        self.assertEqual(len(engine._cache), 2)
+        lazy = engine.run(data.copy(), [normStacker, haStacker], eagerCols=['HA'])
+        np.testing.assert_array_equal(lazy['normairmass'][filled], expected[filled])
+        self.assertTrue(np.all(np.isnan(lazy['normairmass'][~filled])))
+        engine.fill(lazy, np.arange(ndata))
+        np.testing.assert_array_equal(lazy['normairmass'], expected)
+        engine.cacheDeferred(lazy)
+        self.assertEqual(len(engine._cache[1][1]), ndata)
+        # Circular dependencies can not be ordered.
+        self.assertRaises(ValueError, stackers.orderStackers,
+                          [stackers.EclipticStacker(raCol='HA'), stackers.HourAngleStacker(raCol='eclipLon')])
+
     def testHAStacker(self):
         """Test the Hour Angle stacker"""
         data = np.zeros(100, dtype=list(zip(['lst', 'fieldRA'], [float, float])))
@@ -266,6 +410,102 @@ class TestStackerClasses(unittest.TestCase):
         data['filter'] = 'q'
         self.assertRaises(IndexError, stacker.run, data)
 
+    def testFilterIdxStacker(self):
+        """Test the filter index stacker and lookup tables."""
+        filters = np.array(['u', 'g', 'r', 'i', 'z', 'y', 'q', 'r'])
+        expected = np.array([0, 1, 2, 3, 4, 5, -1, 2])
+        for f in [filters, filters.astype('S1'), filters.astype(object), np.char.add(filters, 'x')]:
+            idx = stackers.filterIndex(f)
+            self.assertEqual(idx.dtype, np.int8)
+            if f.dtype.kind == 'U' and f.dtype.itemsize > 4:
+                np.testing.assert_equal(idx, -1)
+            else:
+                np.testing.assert_equal(idx, expected)
+        table = stackers.filterTable({'u': 1., 'r': 3.}, default=-9.)
+        np.testing.assert_equal(table[expected], [1., -9., 3., -9., -9., -9., -9., 3.])
+        data = np.zeros(len(filters), dtype=list(zip(['filter'], ['<U1'])))
+        data['filter'] = filters
+        stacker = stackers.FilterIdxStacker()
+        data = stacker.run(data)
+        self.assertEqual(data['filterIdx'].dtype, np.int8)
+        np.testing.assert_equal(data['filterIdx'], expected)
+        # The column is recalculated if it is already present (such as when it was added as a deferred column).
+        data['filterIdx'] = 0
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            data = stacker.run(data)
+        np.testing.assert_equal(data['filterIdx'], expected)
+        # The filterIdx column is only used for the 'filter' column.
+        data = np.zeros(len(filters), dtype=list(zip(['filter', 'otherFilter'], ['<U1', '<U1'])))
+        data['filter'] = 'u'
+        data['otherFilter'] = filters
+        data = stackers.FilterIdxStacker().run(data)
+        np.testing.assert_equal(stackers.getFilterIdx(data), 0)
+        np.testing.assert_equal(stackers.getFilterIdx(data, 'otherFilter'), expected)
+        # filterLookup gathers the values for each visit, raising KeyError for filters without a value.
+        data = np.zeros(len(filters), dtype=list(zip(['filter'], ['<U1'])))
+        data['filter'] = filters
+        values = dict((f, float(i)) for i, f in enumerate(stackers.filterNames))
+        self.assertRaises(KeyError, stackers.filterLookup, values, data)
+        np.testing.assert_equal(stackers.filterLookup(values, data[filters != 'q']), expected[filters != 'q'])
+        del values['r']
+        self.assertRaises(KeyError, stackers.filterLookup, values, data[:6])
+        rgb = stackers.filterLookup({'u': (0, 0, 1), 'g': (0, 1, 0)}, data[:2])
+        np.testing.assert_equal(rgb, [[0, 0, 1], [0, 1, 0]])
+        # Stackers give the same results with or without the filterIdx column.
+        np.random.seed(42)
+        ndata = 100
+        data = np.zeros(ndata, dtype=list(zip(['filter', 'fiveSigmaDepth', 'solarElong', 'sunAz', 'azimuth'],
+                                              ['<U1', float, float, float, float])))
+        data['filter'] = np.random.choice(list('ugrizy'), ndata)
+        data['fiveSigmaDepth'] = np.random.rand(ndata) + 23.
+        data['solarElong'] = np.random.rand(ndata) * 120. + 60.
+        withIdx = stackers.FilterIdxStacker().run(data)
+        stacker = stackers.NEODistStacker()
+        np.testing.assert_equal(stacker.run(data)['MaxGeoDist'], stacker.run(withIdx)['MaxGeoDist'])
+
+    def testEclipticStacker(self):
+        """
+        Test the numpy ecliptic coordinates against the pyephem calculation.
+        """
+        rng = np.random.RandomState(42)
+        data = np.zeros(300, dtype=list(zip(['fieldRA', 'fieldDec', 'expMJD'], [float] * 3)))
+        data['fieldRA'] = rng.uniform(0, 2. * np.pi, data.size)
+        data['fieldDec'] = np.arcsin(rng.uniform(-1, 1, data.size))
+        data['expMJD'] = rng.uniform(51544., 62502., data.size)
+        for subtractSunLon, tol in ((False, 1e-10), (True, np.radians(0.015))):
+            newData = stackers.EclipticStacker(subtractSunLon=subtractSunLon).run(data)
+            ephemData = stackers.EclipticStacker(subtractSunLon=subtractSunLon, useEphem=True).run(data)
+            np.testing.assert_allclose(newData['eclipLat'], ephemData['eclipLat'], atol=1e-10)
+            dLon = (newData['eclipLon'] - ephemData['eclipLon'] + np.pi) % (2. * np.pi) - np.pi
+            self.assertLess(np.max(np.abs(dLon)), tol)
+            self.assertTrue(np.all((newData['eclipLon'] >= 0) & (newData['eclipLon'] < 2. * np.pi)))
+
+    def testNEODistStacker(self):
+        """
+        Test the NEO distance stacker against a direct solve for each visit.
+        """
+        rng = np.random.RandomState(42)
+        data = np.zeros(200, dtype=list(zip(['solarElong', 'filter', 'fiveSigmaDepth', 'sunAz', 'azimuth'],
+                                            [float, '<U1', float, float, float])))
+        data['solarElong'] = rng.uniform(40, 180, data.size)
+        data['filter'] = rng.choice(list('ugrizy'), data.size)
+        data['fiveSigmaDepth'] = rng.uniform(21, 25, data.size)
+        data['sunAz'] = rng.uniform(0, 2 * np.pi, data.size)
+        data['azimuth'] = rng.uniform(0, 2 * np.pi, data.size)
+        stacker = stackers.NEODistStacker(chunkSize=30)
+        newData = stacker.run(data)
+        for i in range(0, data.size, 10):
+            deltas = stacker.deltas
+            appmag = stacker._appmag(np.cos(np.radians(data['solarElong'][i])), deltas)
+            v5 = data['fiveSigmaDepth'][i] + stacker.limitingAdjust[data['filter'][i]]
+            self.assertEqual(newData['MaxGeoDist'][i], np.min(deltas[appmag > v5]))
+        # The NEO is always too faint at the largest distances for these depths.
+        self.assertFalse(np.any(np.isnan(newData['MaxGeoDist'])))
+        parallelData = stackers.NEODistStacker(chunkSize=30, nProcesses=2).run(data)
+        for col in stacker.colsAdded:
+            np.testing.assert_array_equal(parallelData[col], newData[col])
+
     def testGalacticStacker(self):
         """
         Test the galactic coordinate stacker
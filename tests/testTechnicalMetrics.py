@@ -108,6 +108,9 @@ class TestTechnicalMetrics(unittest.TestCase):
         metric = metrics.TeffMetric(fiducialDepth={'u': 20, 'g': 25}, teffBase=30.0)
         result = metric.run(data)
         self.assertEqual(result, 30.0*m5.size)
+        # Filters without a fiducial depth are an error.
+        metric = metrics.TeffMetric(fiducialDepth={'g': 25}, teffBase=30.0)
+        self.assertRaises(KeyError, metric.run, data)
 
     def testOpenShutterFractionMetric(self):
         """
@@ -1,6 +1,10 @@
 import matplotlib
 matplotlib.use("Agg")
 import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
 import lsst.sims.maf.utils as utils
 import lsst.utils.tests
 
@@ -39,6 +43,122 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(sqlWhere, badprop)
 
 
+class TestWindowUtils(unittest.TestCase):
+
+    def testWindows(self):
+        """Test the window primitives against selecting the values in each window."""
+        rng = np.random.RandomState(42)
+        values = np.sort(rng.randint(0, 100, size=50)).astype(float)
+        weights = rng.rand(values.size)
+        width = 7.
+        ends = utils.windowEnds(values, width)
+        counts = utils.windowCounts(values, width)
+        countsRight = utils.windowCounts(values, width, side='right')
+        sums = utils.windowSums(weights, np.arange(values.size), ends)
+        for i, v in enumerate(values):
+            inWindow = (values >= v) & (values < v + width)
+            # Values equal to v which come earlier in the sorted array are not in the window starting at i.
+            inWindow[:i] = False
+            self.assertEqual(counts[i], inWindow.sum())
+            self.assertAlmostEqual(sums[i], weights[inWindow].sum())
+            inWindow[values == v + width] = True
+            self.assertEqual(countsRight[i], inWindow.sum())
+
+
+class TestColumnCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def testColumnCache(self):
+        """Test writing, reading and invalidating a binary column cache."""
+        import pandas as pd
+        filename = os.path.join(self.cacheDir, 'data.txt')
+        data = pd.DataFrame({'objId': [3, 1, 2, 1], 'x': [0.5, 1.5, 2.5, 3.5], 'name': ['c', 'a', 'b', 'a2']})
+        data.to_csv(filename, sep=' ', index=False)
+        self.assertTrue(utils.readColumnCache(filename) is None)
+        utils.writeColumnCache(data, filename, sortCol='objId')
+        columns = utils.readColumnCache(filename)
+        self.assertEqual(list(columns.keys()), ['objId', 'x', 'name'])
+        np.testing.assert_equal(columns['objId'], [1, 1, 2, 3])
+        np.testing.assert_equal(columns['x'], [1.5, 3.5, 2.5, 0.5])
+        np.testing.assert_equal(columns['name'], ['a', 'a2', 'b', 'c'])
+        self.assertTrue(isinstance(columns['x'], np.memmap))
+        # Modifying the source file invalidates the cache.
+        indexFile = os.path.join(filename + '.columns', 'columns.txt')
+        os.utime(filename, (os.path.getmtime(indexFile) + 10, os.path.getmtime(indexFile) + 10))
+        self.assertTrue(utils.readColumnCache(filename) is None)
+
+
+class TestAlmanac(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.latitude = np.radians(-30.2446388)
+        self.longitude = np.radians(-70.7494167)
+        self.height = 2650.
+
+    def testAlmanac(self):
+        """Test the almanac lookups and disk cache."""
+        almanac = utils.Almanac(self.latitude, self.longitude, self.height,
+                                cacheDir=self.cacheDir, blockSize=30)
+        mjds = np.array([59000.1, 59000.3, 59010.9, 59040.5])
+        nights = almanac.getNights(mjds)
+        # Midnights are about a day apart, and the nearest midnight is within half a day.
+        np.testing.assert_allclose(np.diff(almanac.table['midnight']), 1., atol=0.01)
+        self.assertTrue(np.all(np.abs(nights['midnight'] - mjds) <= 0.5))
+        # Twilights bracket midnight, and the 18 degree twilight is closest to midnight.
+        self.assertTrue(np.all(nights['twi18_set'] < nights['midnight']))
+        self.assertTrue(np.all(nights['twi18_rise'] > nights['midnight']))
+        self.assertTrue(np.all(nights['twi18_rise'] < nights['twi6_rise']))
+        self.assertTrue(np.all((nights['moonPer'] >= 0) & (nights['moonPer'] <= 100)))
+        # A new almanac should read the same values back from disk.
+        self.assertTrue(len(os.listdir(self.cacheDir)) > 0)
+        almanac2 = utils.Almanac(self.latitude, self.longitude, self.height,
+                                 cacheDir=self.cacheDir, blockSize=30)
+        np.testing.assert_equal(almanac2.getNights(mjds), nights)
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+
+class TestRaggedMetricValues(unittest.TestCase):
+
+    def testRaggedMetricValues(self):
+        """Test setting and getting ragged metric values."""
+        cols = [('start', 'int32'), ('trackletNights', 'float')]
+        values = utils.RaggedMetricValues((3, 4), cols, fill_value=0)
+        self.assertTrue(np.all(values.mask))
+        shared = {'start': np.array([1, 5]), 'trackletNights': np.array([2., 3., 9.]), 'other': 1}
+        values[0, 0] = shared
+        values[0, 1] = shared
+        values[0, 2] = {'start': np.array([], int), 'trackletNights': np.array([4.])}
+        values[2, 3] = {'start': np.array([7]), 'trackletNights': np.array([7., 8.])}
+        values.mask[1] = True
+        # The same value set for consecutive H values is only stored once.
+        self.assertEqual(values._size['trackletNights'], 6)
+        np.testing.assert_equal(values[0, 1]['start'], [1, 5])
+        np.testing.assert_equal(values[0, 2]['trackletNights'], [4.])
+        self.assertEqual(values[0, 2]['start'].size, 0)
+        self.assertEqual(values[0, 0]['start'].dtype, np.int32)
+        self.assertFalse('other' in values[0, 0])
+        self.assertTrue(values[0, 3] is np.ma.masked)
+        self.assertEqual(values.filled()[1, 1], 0)
+        # Take a subset of objects, and put them back in a different order.
+        subset = values[np.array([2, 0])]
+        self.assertEqual(subset.shape, (2, 4))
+        np.testing.assert_equal(subset[1, 0]['trackletNights'], [2., 3., 9.])
+        self.assertEqual(subset._size['trackletNights'], 6)
+        other = utils.RaggedMetricValues((3, 4), cols)
+        other[np.array([1, 2])] = subset
+        np.testing.assert_equal(other.mask, values.mask[[0, 2, 0]] | [[True], [False], [False]])
+        np.testing.assert_equal(other[1, 3]['start'], [7])
+        np.testing.assert_equal(other[2, 1]['trackletNights'], [2., 3., 9.])
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 